@@ -27,7 +27,13 @@ def nostrchat_renderer():
 nostr_client: NostrClient = NostrClient()
 
 
-from .tasks import wait_for_nostr_events  # noqa
+from .services import dm_writer  # noqa
+from .tasks import (  # noqa
+    compress_old_messages,
+    run_retention_job,
+    send_outbox_events,
+    wait_for_nostr_events,
+)
 from .views import *  # noqa
 from .views_api import *  # noqa
 
@@ -41,19 +47,17 @@ async def nostrchat_stop():
         except Exception as ex:
             logger.warning(ex)
 
+    await dm_writer.flush()
     await nostr_client.stop()
 
 
 def nostrchat_start():
 
     async def _subscribe_to_nostr_client():
-        # wait for 'nostrclient' extension to initialize
-        await asyncio.sleep(10)
+        # connects as soon as the 'nostrclient' extension accepts websockets
         await nostr_client.run_forever()
 
     async def _wait_for_nostr_events():
-        # wait for this extension to initialize
-        await asyncio.sleep(15)
         await wait_for_nostr_events(nostr_client)
 
     task1 = create_permanent_unique_task(
@@ -62,4 +66,12 @@ def nostrchat_start():
     task2 = create_permanent_unique_task(
         "ext_nostrchat_wait_for_events", _wait_for_nostr_events
     )
-    scheduled_tasks.extend([task1, task2])
+    task3 = create_permanent_unique_task(
+        "ext_nostrchat_send_outbox_events", send_outbox_events
+    )
+    task4 = create_permanent_unique_task(
+        "ext_nostrchat_retention", run_retention_job
+    )
+    # runs once, until the messages stored before compression are done
+    task5 = asyncio.create_task(compress_old_messages())
+    scheduled_tasks.extend([task1, task2, task3, task4, task5])
@@ -0,0 +1,116 @@
+"""
+Relay frame -> NostrEvent -> event id throughput.
+
+Compares the slotted `NostrEvent` (with orjson when installed) against the
+previous pydantic model, which re-serialized and re-hashed on every
+`event_id` access.
+
+    poetry run python benchmarks/bench_event_parsing.py [frames] [rounds]
+"""
+
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from nostr.event import NostrEvent, json_loads, orjson
+
+
+def make_frames(count: int) -> List[str]:
+    rnd = random.Random(42)
+    frames = []
+    for i in range(count):
+        event = {
+            "id": "%064x" % rnd.getrandbits(256),
+            "pubkey": "%064x" % rnd.getrandbits(256),
+            "created_at": 1_700_000_000 + i,
+            "kind": 4 if i % 5 else 0,
+            "tags": [["p", "%064x" % rnd.getrandbits(256)]],
+            "content": f"{rnd.getrandbits(1024):x}?iv={rnd.getrandbits(128):x}",
+            "sig": "%0128x" % rnd.getrandbits(512),
+        }
+        frames.append(json.dumps(["EVENT", "sub", event]))
+    return frames
+
+
+def current_path(frames: List[str]):
+    for frame in frames:
+        _, _, data = json_loads(frame)
+        event = NostrEvent.from_dict(data)
+        # `check_signature` and the DM routing both read these
+        _ = event.event_id
+        _ = event.event_id
+        _ = event.tag_values("p")
+        _ = event.has_tag_value("p", event.pubkey)
+
+
+def legacy_path() -> Optional[Callable[[List[str]], None]]:
+    try:
+        from pydantic import BaseModel
+    except ImportError:
+        return None
+
+    class LegacyNostrEvent(BaseModel):
+        id: str = ""
+        pubkey: str
+        created_at: int
+        kind: int
+        tags: List[List[str]] = []
+        content: str = ""
+        sig: Optional[str] = None
+
+        def serialize_json(self) -> str:
+            e = [0, self.pubkey, self.created_at, self.kind, self.tags, self.content]
+            return json.dumps(e, separators=(",", ":"), ensure_ascii=False)
+
+        @property
+        def event_id(self) -> str:
+            return hashlib.sha256(self.serialize_json().encode()).hexdigest()
+
+        def tag_values(self, tag_name: str) -> List[str]:
+            return [t[1] for t in self.tags if t[0] == tag_name]
+
+    def run(frames: List[str]):
+        for frame in frames:
+            _, _, data = json.loads(frame)
+            event = LegacyNostrEvent(**data)
+            _ = event.event_id
+            _ = event.event_id
+            _ = event.tag_values("p")
+            _ = event.pubkey in event.tag_values("p")
+
+    return run
+
+
+def bench(name: str, fn: Callable[[List[str]], None], frames: List[str], rounds: int):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn(frames)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<10} {len(frames) / best:>12,.0f} events/s  ({best * 1000:.1f} ms)")
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    frames = make_frames(count)
+    print(f"{count} frames, best of {rounds}, orjson: {'yes' if orjson else 'no'}")
+
+    current = bench("current", current_path, frames, rounds)
+    legacy = legacy_path()
+    if not legacy:
+        print("pydantic not installed, skipping the legacy path")
+        return
+    previous = bench("legacy", legacy, frames, rounds)
+    print(f"speedup    {previous / current:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+A local websocket server imitating the 'nostrclient' relay endpoint.
+
+It answers every REQ with EOSE, every EVENT with OK, and replays a
+pre-serialized list of EVENT frames once the first kind 4 subscription
+arrives. The time each frame was handed to the socket is kept by event id.
+"""
+
+import asyncio
+import json
+import time
+from typing import Dict, List, Optional
+
+from websockets.server import WebSocketServerProtocol, serve
+
+
+class FakeRelay:
+    def __init__(self, frames: List[str], rate: float = 0):
+        # (event id, frame), frames are serialized up front to keep the
+        # relay side out of the measurement as much as possible
+        self.frames = [(json.loads(f)[2]["id"], f) for f in frames]
+        # events per second, 0 sends as fast as the socket accepts them
+        self.rate = rate
+        self.sent_at: Dict[str, float] = {}
+        self.requests = 0
+        self.published = 0
+        self.replay_done = asyncio.Event()
+
+        self._server = None
+        self._replay_task: Optional[asyncio.Task] = None
+
+    @property
+    def url(self) -> str:
+        assert self._server, "Relay not started"
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"ws://{host}:{port}"
+
+    async def start(self):
+        self._server = await serve(self._handler, "127.0.0.1", 0, max_size=None)
+
+    async def stop(self):
+        if self._replay_task:
+            self._replay_task.cancel()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handler(self, ws: WebSocketServerProtocol):
+        async for message in ws:
+            type_, *rest = json.loads(message)
+            if type_ == "REQ":
+                self.requests += 1
+                subscription_id, *filters = rest
+                if self._replay_task is None and any(
+                    4 in f.get("kinds", []) for f in filters
+                ):
+                    self._replay_task = asyncio.create_task(
+                        self._replay(ws, subscription_id)
+                    )
+                else:
+                    await ws.send(json.dumps(["EOSE", subscription_id]))
+            elif type_ == "EVENT":
+                self.published += 1
+                await ws.send(json.dumps(["OK", rest[0]["id"], True, ""]))
+
+    async def _replay(self, ws: WebSocketServerProtocol, subscription_id: str):
+        interval = 1 / self.rate if self.rate else 0
+        start = time.perf_counter()
+        for index, (event_id, frame) in enumerate(self.frames):
+            if interval:
+                delay = start + index * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif index % 100 == 0:
+                await asyncio.sleep(0)
+            self.sent_at[event_id] = time.perf_counter()
+            await ws.send(frame)
+        await ws.send(json.dumps(["EOSE", subscription_id]))
+        self.replay_done.set()
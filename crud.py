@@ -1,21 +1,98 @@
 import json
-from typing import List, Optional, Tuple
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
+from lnbits.db import Connection
 from lnbits.helpers import urlsafe_short_hash
+from sqlalchemy import text
 
 from . import db
+from .helpers import (
+    compress_message,
+    compress_rows,
+    decompress_rows,
+    parse_message_cursor,
+    parse_search_terms,
+    shared_secrets,
+)
 from .models import (
-    Peer,
-    PeerProfile,
+    ArchivedConversation,
+    DeliveryStatus,
     DirectMessage,
+    DirectMessageSearchHit,
     NostrAcct,
     NostrAcctConfig,
+    OutboxEvent,
     PartialDirectMessage,
     PartialNostrAcct,
+    Peer,
+    PeerProfile,
 )
+from .nostr.event import NostrEvent
+from .nostr.metrics import StageTimings
+
+# database time of the hot queries, recorded by their `@db_timings.timed` decorator
+db_timings = StageTimings()
+
+
+class _TransactionConnection(Connection):
+    """A connection that leaves the commit to `transaction`."""
+
+    async def execute(self, query: str, values: Optional[dict] = None):
+        params = self.rewrite_values(values) if values else {}
+        return await self.conn.execute(text(self.rewrite_query(query)), params)
+
+
+@asynccontextmanager
+async def transaction() -> AsyncIterator[Connection]:
+    """
+    All statements run on the yielded connection are committed together when
+    the block exits, or rolled back if it raises. A plain LNbits connection
+    commits every statement on its own.
+    """
+    async with db.connect() as conn:
+        tx = _TransactionConnection(conn.conn, conn.type, conn.name, conn.schema)
+        try:
+            yield tx
+        except BaseException:
+            await conn.conn.rollback()
+            raise
+        await conn.conn.commit()
 
 ######################################## ACCOUNT ######################################
 
+# process-wide `public_key -> NostrAcct` index used to route relay events
+# without a database round trip. Kept coherent by the CRUD functions below.
+_nostracct_index: Dict[str, NostrAcct] = {}
+_nostracct_index_loaded = False
+
+
+async def load_nostracct_index() -> None:
+    global _nostracct_index_loaded
+    nostraccts = await get_nostraccts()
+    _nostracct_index.clear()
+    _nostracct_index.update({n.public_key: n for n in nostraccts})
+    _nostracct_index_loaded = True
+
+
+async def get_indexed_nostracct(public_key: str) -> Optional[NostrAcct]:
+    if not _nostracct_index_loaded:
+        await load_nostracct_index()
+    return _nostracct_index.get(public_key)
+
+
+def _index_nostracct(nostracct: Optional[NostrAcct]) -> Optional[NostrAcct]:
+    if nostracct:
+        _nostracct_index[nostracct.public_key] = nostracct
+    return nostracct
+
+
+def _unindex_nostracct(nostracct_id: str) -> None:
+    for public_key, nostracct in list(_nostracct_index.items()):
+        if nostracct.id == nostracct_id:
+            del _nostracct_index[public_key]
+
 
 async def create_nostracct(user_id: str, m: PartialNostrAcct) -> NostrAcct:
     nostracct_id = urlsafe_short_hash()
@@ -30,12 +107,12 @@ async def create_nostracct(user_id: str, m: PartialNostrAcct) -> NostrAcct:
             "id": nostracct_id,
             "private_key": m.private_key,
             "public_key": m.public_key,
-            "meta": json.dumps(dict(m.config)),
+            "meta": json.dumps(m.config.dict()),
         },
     )
     nostracct = await get_nostracct(user_id, nostracct_id)
     assert nostracct, "Created nostracct cannot be retrieved"
-    return nostracct
+    return _index_nostracct(nostracct)
 
 
 async def update_nostracct(
@@ -48,7 +125,7 @@ async def update_nostracct(
         """,
         {"meta": json.dumps(config.dict()), "id": nostracct_id, "user_id": user_id},
     )
-    return await get_nostracct(user_id, nostracct_id)
+    return _index_nostracct(await get_nostracct(user_id, nostracct_id))
 
 
 async def touch_nostracct(user_id: str, nostracct_id: str) -> Optional[NostrAcct]:
@@ -59,7 +136,7 @@ async def touch_nostracct(user_id: str, nostracct_id: str) -> Optional[NostrAcct
         """,
         {"id": nostracct_id, "user_id": user_id},
     )
-    return await get_nostracct(user_id, nostracct_id)
+    return _index_nostracct(await get_nostracct(user_id, nostracct_id))
 
 
 async def get_nostracct(user_id: str, nostracct_id: str) -> Optional[NostrAcct]:
@@ -74,6 +151,7 @@ async def get_nostracct(user_id: str, nostracct_id: str) -> Optional[NostrAcct]:
     return NostrAcct.from_row(row) if row else None
 
 
+@db_timings.timed("get_nostracct_by_pubkey")
 async def get_nostracct_by_pubkey(public_key: str) -> Optional[NostrAcct]:
     row: dict = await db.fetchone(
         """SELECT * FROM nostrchat.nostraccts WHERE public_key = :public_key""",
@@ -83,6 +161,11 @@ async def get_nostracct_by_pubkey(public_key: str) -> Optional[NostrAcct]:
     return NostrAcct.from_row(row) if row else None
 
 
+async def get_nostraccts() -> List[NostrAcct]:
+    rows: list[dict] = await db.fetchall("SELECT * FROM nostrchat.nostraccts")
+    return [NostrAcct.from_row(row) for row in rows]
+
+
 async def get_nostraccts_ids_with_pubkeys() -> List[Tuple[str, str]]:
     rows: list[dict] = await db.fetchall(
         """SELECT id, public_key FROM nostrchat.nostraccts""",
@@ -91,6 +174,7 @@ async def get_nostraccts_ids_with_pubkeys() -> List[Tuple[str, str]]:
     return [(row["id"], row["public_key"]) for row in rows]
 
 
+@db_timings.timed("get_nostracct_for_user")
 async def get_nostracct_for_user(user_id: str) -> Optional[NostrAcct]:
     row: dict = await db.fetchone(
         """SELECT * FROM nostrchat.nostraccts WHERE user_id = :user_id """,
@@ -107,26 +191,36 @@ async def delete_nostracct(nostracct_id: str) -> None:
             "id": nostracct_id,
         },
     )
+    await delete_sync_cursors(nostracct_id)
+    _unindex_nostracct(nostracct_id)
+    shared_secrets.invalidate(nostracct_id)
 
 
 ######################################## MESSAGES ######################################
 
 
+@db_timings.timed("create_direct_message")
 async def create_direct_message(
-    nostracct_id: str, dm: PartialDirectMessage
+    nostracct_id: str,
+    dm: PartialDirectMessage,
+    delivery_status: Optional[DeliveryStatus] = None,
+    conn: Optional[Connection] = None,
 ) -> DirectMessage:
     dm_id = urlsafe_short_hash()
-    await db.execute(
+    message, message_format, message_size = compress_message(dm.message)
+    await (conn or db).execute(
         """
         INSERT INTO nostrchat.direct_messages
         (
-            nostracct_id, id, event_id, event_created_at,
-            message, public_key, type, incoming
+            nostracct_id, id, event_id, event_created_at, message,
+            message_format, message_size, public_key, type, incoming,
+            delivery_status
         )
         VALUES
             (
-            :nostracct_id, :id, :event_id, :event_created_at,
-            :message, :public_key, :type, :incoming
+            :nostracct_id, :id, :event_id, :event_created_at, :message,
+            :message_format, :message_size, :public_key, :type, :incoming,
+            :delivery_status
             )
         ON CONFLICT(event_id) DO NOTHING
         """,
@@ -135,22 +229,255 @@ async def create_direct_message(
             "id": dm_id,
             "event_id": dm.event_id,
             "event_created_at": dm.event_created_at,
-            "message": dm.message,
+            "message": message,
+            "message_format": message_format,
+            "message_size": message_size,
             "public_key": dm.public_key,
             "type": dm.type,
             "incoming": dm.incoming,
+            "delivery_status": delivery_status.value if delivery_status else None,
         },
     )
     if dm.event_id:
-        msg = await get_direct_message_by_event_id(nostracct_id, dm.event_id)
+        msg = await get_direct_message_by_event_id(nostracct_id, dm.event_id, conn)
     else:
-        msg = await get_direct_message(nostracct_id, dm_id)
+        msg = await get_direct_message(nostracct_id, dm_id, conn)
     assert msg, "Newly created dm couldn't be retrieved"
+    if msg.id == dm_id:
+        await index_direct_messages([(nostracct_id, msg)], conn)
+    await update_peers_last_message(nostracct_id, [msg], conn)
     return msg
 
 
-async def get_direct_message(nostracct_id: str, dm_id: str) -> Optional[DirectMessage]:
-    row: dict = await db.fetchone(
+# keep multi-row statements well below the bind parameter limits of SQLite
+_MAX_ROWS_PER_STATEMENT = 100
+# characters of the last message kept on the peer for the conversation list
+PEER_PREVIEW_LENGTH = 200
+
+
+@db_timings.timed("store_direct_messages")
+async def store_direct_messages(
+    dms: List[Tuple[str, PartialDirectMessage]],
+) -> Tuple[List[Tuple[str, DirectMessage]], List[Tuple[str, str]]]:
+    """
+    Persist a batch of direct messages in one transaction: one multi-row
+    INSERT for the messages, then one peer upsert, one unread counter update
+    and one last message update per nostracct. Events already stored are
+    skipped. A failed batch leaves nothing behind and can be stored again.
+    Returns the newly stored messages and the newly created peers.
+    """
+    async with transaction() as conn:
+        created = await create_direct_messages(dms, conn)
+
+        unread: Dict[str, Dict[str, int]] = {}
+        for nostracct_id, dm in created:
+            counts = unread.setdefault(nostracct_id, {})
+            counts[dm.public_key] = counts.get(dm.public_key, 0) + int(dm.incoming)
+
+        new_peers: List[Tuple[str, str]] = []
+        for nostracct_id, counts in unread.items():
+            public_keys = await upsert_peers_unread_messages(nostracct_id, counts, conn)
+            new_peers += [(nostracct_id, pk) for pk in public_keys]
+
+        by_nostracct: Dict[str, List[DirectMessage]] = {}
+        for nostracct_id, dm in created:
+            by_nostracct.setdefault(nostracct_id, []).append(dm)
+        for nostracct_id, messages in by_nostracct.items():
+            await update_peers_last_message(nostracct_id, messages, conn)
+
+    return created, new_peers
+
+
+async def create_direct_messages(
+    dms: List[Tuple[str, PartialDirectMessage]], conn: Optional[Connection] = None
+) -> List[Tuple[str, DirectMessage]]:
+    by_event_id = {
+        dm.event_id: (nostracct_id, dm) for nostracct_id, dm in dms if dm.event_id
+    }
+    existing = await get_existing_event_ids(list(by_event_id.keys()), conn)
+    new_dms = [
+        (nostracct_id, dm)
+        for event_id, (nostracct_id, dm) in by_event_id.items()
+        if event_id not in existing
+    ] + [(nostracct_id, dm) for nostracct_id, dm in dms if not dm.event_id]
+
+    now = int(time.time())
+    created: List[Tuple[str, DirectMessage]] = []
+    for nostracct_id, dm in new_dms:
+        msg = DirectMessage(**dm.dict(exclude={"time"}), id=urlsafe_short_hash())
+        msg.time = now
+        created.append((nostracct_id, msg))
+    await insert_direct_messages(created, conn)
+    return created
+
+
+async def insert_direct_messages(
+    dms: List[Tuple[str, DirectMessage]], conn: Optional[Connection] = None
+) -> None:
+    """Multi-row INSERT of complete messages, also added to the search index."""
+    for i in range(0, len(dms), _MAX_ROWS_PER_STATEMENT):
+        chunk = dms[i : i + _MAX_ROWS_PER_STATEMENT]
+        rows, values = [], {}
+        for j, (nostracct_id, msg) in enumerate(chunk):
+            message, message_format, message_size = compress_message(msg.message)
+            rows.append(
+                f"""(
+                :nostracct_id_{j}, :id_{j}, :event_id_{j}, :event_created_at_{j},
+                :message_{j}, :message_format_{j}, :message_size_{j},
+                :public_key_{j}, :type_{j}, :incoming_{j}, :delivery_status_{j}
+                )"""
+            )
+            values.update(
+                {
+                    f"nostracct_id_{j}": nostracct_id,
+                    f"id_{j}": msg.id,
+                    f"event_id_{j}": msg.event_id,
+                    f"event_created_at_{j}": msg.event_created_at,
+                    f"message_{j}": message,
+                    f"message_format_{j}": message_format,
+                    f"message_size_{j}": message_size,
+                    f"public_key_{j}": msg.public_key,
+                    f"type_{j}": msg.type,
+                    f"incoming_{j}": msg.incoming,
+                    f"delivery_status_{j}": (
+                        msg.delivery_status.value if msg.delivery_status else None
+                    ),
+                }
+            )
+
+        result = await (conn or db).execute(
+            f"""
+            INSERT INTO nostrchat.direct_messages
+            (
+                nostracct_id, id, event_id, event_created_at, message,
+                message_format, message_size, public_key, type, incoming,
+                delivery_status
+            )
+            VALUES {", ".join(rows)}
+            ON CONFLICT(event_id) DO NOTHING
+            RETURNING id
+            """,
+            values,
+        )
+        # rows skipped by ON CONFLICT are already in the index
+        inserted = {row.id for row in result}
+        await index_direct_messages(
+            [(nostracct_id, msg) for nostracct_id, msg in chunk if msg.id in inserted],
+            conn,
+        )
+
+
+async def index_direct_messages(
+    dms: List[Tuple[str, DirectMessage]], conn: Optional[Connection] = None
+) -> None:
+    """Add messages to the full-text search index (`nostrchat.dm_search`)."""
+    for i in range(0, len(dms), _MAX_ROWS_PER_STATEMENT):
+        rows, values = [], {}
+        for j, (nostracct_id, dm) in enumerate(dms[i : i + _MAX_ROWS_PER_STATEMENT]):
+            rows.append(f"(:id_{j}, :nostracct_id_{j}, :message_{j})")
+            values.update(
+                {
+                    f"id_{j}": dm.id,
+                    f"nostracct_id_{j}": nostracct_id,
+                    f"message_{j}": dm.message,
+                }
+            )
+        if rows:
+            await (conn or db).execute(
+                f"""
+                INSERT INTO nostrchat.dm_search (id, nostracct_id, message)
+                VALUES {", ".join(rows)}
+                """,
+                values,
+            )
+
+
+@db_timings.timed("search_direct_messages")
+async def search_direct_messages(
+    nostracct_id: str,
+    query: str,
+    public_key: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> List[DirectMessageSearchHit]:
+    """
+    Ranked full-text search over the messages of a nostracct, optionally within
+    one conversation. All words must match, the last one as a prefix.
+    """
+    terms = parse_search_terms(query)
+    values: dict = {"nostracct_id": nostracct_id}
+    peer_filter = ""
+    if public_key:
+        peer_filter = "AND d.public_key = :public_key"
+        values["public_key"] = public_key
+
+    if db.type == "SQLITE":
+        words = " ".join(_fts_phrase(t) for t in terms) + "*"
+        values["query"] = (
+            f"nostracct_id : {_fts_phrase(nostracct_id)} AND message : ({words})"
+        )
+        sql = f"""
+            SELECT d.*,
+                snippet(dm_search, 2, '[', ']', '…', 16) AS snippet,
+                -bm25(dm_search, 0, 0, 1) AS rank
+            FROM nostrchat.dm_search
+            JOIN nostrchat.direct_messages d ON d.id = dm_search.id
+            WHERE dm_search MATCH :query
+            AND dm_search.nostracct_id = :nostracct_id {peer_filter}
+            ORDER BY rank DESC
+        """
+    else:
+        values["query"] = " & ".join(terms) + ":*"
+        sql = f"""
+            SELECT d.*,
+                ts_headline(
+                    'simple', s.message, q,
+                    'StartSel=[, StopSel=], MaxWords=16, MinWords=4'
+                ) AS snippet,
+                ts_rank(s.tsv, q) AS rank
+            FROM nostrchat.dm_search s
+            JOIN nostrchat.direct_messages d ON d.id = s.id,
+                to_tsquery('simple', :query) q
+            WHERE s.tsv @@ q AND s.nostracct_id = :nostracct_id {peer_filter}
+            ORDER BY rank DESC
+        """
+    rows: list[dict] = await db.fetchall(
+        f"{sql} LIMIT {int(limit)} OFFSET {int(offset)}", values
+    )
+    hits = []
+    for row in rows:
+        row = dict(row)
+        snippet, rank = row.pop("snippet"), row.pop("rank")
+        hits.append(
+            DirectMessageSearchHit(
+                dm=DirectMessage.from_row(row), snippet=snippet, rank=rank
+            )
+        )
+    return hits
+
+
+async def get_existing_event_ids(
+    event_ids: List[str], conn: Optional[Connection] = None
+) -> set:
+    existing: set = set()
+    for i in range(0, len(event_ids), _MAX_ROWS_PER_STATEMENT):
+        chunk = event_ids[i : i + _MAX_ROWS_PER_STATEMENT]
+        placeholders = ", ".join(f":event_id_{j}" for j in range(len(chunk)))
+        rows: list[dict] = await (conn or db).fetchall(
+            f"""
+            SELECT event_id FROM nostrchat.direct_messages
+            WHERE event_id IN ({placeholders})
+            """,
+            {f"event_id_{j}": event_id for j, event_id in enumerate(chunk)},
+        )
+        existing.update(row["event_id"] for row in rows)
+    return existing
+
+
+async def get_direct_message(
+    nostracct_id: str, dm_id: str, conn: Optional[Connection] = None
+) -> Optional[DirectMessage]:
+    row: dict = await (conn or db).fetchone(
         """
             SELECT * FROM nostrchat.direct_messages
             WHERE nostracct_id = :nostracct_id AND id = :id
@@ -164,9 +491,9 @@ async def get_direct_message(nostracct_id: str, dm_id: str) -> Optional[DirectMe
 
 
 async def get_direct_message_by_event_id(
-    nostracct_id: str, event_id: str
+    nostracct_id: str, event_id: str, conn: Optional[Connection] = None
 ) -> Optional[DirectMessage]:
-    row: dict = await db.fetchone(
+    row: dict = await (conn or db).fetchone(
         """
         SELECT * FROM nostrchat.direct_messages
         WHERE nostracct_id = :nostracct_id AND event_id = :event_id
@@ -179,49 +506,212 @@ async def get_direct_message_by_event_id(
     return DirectMessage.from_row(row) if row else None
 
 
-async def get_direct_messages(nostracct_id: str, public_key: str) -> List[DirectMessage]:
+@db_timings.timed("get_direct_messages")
+async def get_direct_messages(
+    nostracct_id: str,
+    public_key: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> List[DirectMessage]:
+    """
+    Messages of a conversation in chronological order. Pages are selected with
+    `(event_created_at, id)` keyset cursors (see `DirectMessage.cursor`):
+    `before` returns the `limit` messages preceding the cursor, `after` the ones
+    following it, and neither the latest `limit` messages.
+    """
+    values: dict = {"nostracct_id": nostracct_id, "public_key": public_key}
+    clause = ""
+    newest_first = limit is not None and after is None
+    if before:
+        values["created_at"], values["id"] = parse_message_cursor(before)
+        clause = """AND (event_created_at < :created_at
+                OR (event_created_at = :created_at AND id < :id))"""
+    elif after:
+        values["created_at"], values["id"] = parse_message_cursor(after)
+        clause = """AND (event_created_at > :created_at
+                OR (event_created_at = :created_at AND id > :id))"""
+
+    order = "DESC" if newest_first else "ASC"
     rows: list[dict] = await db.fetchall(
-        """
+        f"""
         SELECT * FROM nostrchat.direct_messages
-        WHERE nostracct_id = :nostracct_id AND public_key = :public_key
-        ORDER BY event_created_at
+        WHERE nostracct_id = :nostracct_id AND public_key = :public_key {clause}
+        ORDER BY event_created_at {order}, id {order}
+        {f"LIMIT {int(limit)}" if limit is not None else ""}
         """,
-        {"nostracct_id": nostracct_id, "public_key": public_key},
+        values,
     )
-    return [DirectMessage.from_row(row) for row in rows]
+    messages = [DirectMessage.from_row(row) for row in rows]
+    if newest_first:
+        messages.reverse()
+    return messages
 
 
-async def get_orders_from_direct_messages(nostracct_id: str) -> List[DirectMessage]:
+async def get_direct_messages_event_ids(
+    after: str = "", limit: int = 10_000
+) -> List[str]:
     rows: list[dict] = await db.fetchall(
-        """
+        f"""
+        SELECT event_id FROM nostrchat.direct_messages
+        WHERE event_id > :after ORDER BY event_id LIMIT {int(limit)}
+        """,
+        {"after": after},
+    )
+    return [row["event_id"] for row in rows]
+
+
+@db_timings.timed("update_direct_messages_delivery_status")
+async def update_direct_messages_delivery_status(
+    event_ids: List[str],
+    status: DeliveryStatus,
+    only_status: Optional[DeliveryStatus] = None,
+) -> None:
+    if not event_ids:
+        return
+    values: dict = {"status": status.value}
+    values.update({f"id_{j}": event_id for j, event_id in enumerate(event_ids)})
+    placeholders = ", ".join(f":id_{j}" for j in range(len(event_ids)))
+    guard = ""
+    if only_status:
+        guard = "AND delivery_status = :only_status"
+        values["only_status"] = only_status.value
+    await db.execute(
+        f"""
+        UPDATE nostrchat.direct_messages SET delivery_status = :status
+        WHERE event_id IN ({placeholders}) {guard}
+        """,
+        values,
+    )
+
+
+async def get_uncompressed_direct_messages(
+    after: str = "", limit: int = 200
+) -> List[DirectMessage]:
+    """
+    Messages stored before compression existed, in `id` order starting after
+    `after`. `compress_direct_messages` records their size, which takes them
+    off the `idx_direct_messages_unsized` partial index used here.
+    """
+    rows: list[dict] = await db.fetchall(
+        f"""
         SELECT * FROM nostrchat.direct_messages
-        WHERE nostracct_id = :nostracct_id AND type >= 0 ORDER BY event_created_at, type
+        WHERE id > :after AND message_size IS NULL
+        ORDER BY id LIMIT {int(limit)}
         """,
-        {"nostracct_id": nostracct_id},
+        {"after": after},
     )
     return [DirectMessage.from_row(row) for row in rows]
 
 
-async def get_last_direct_messages_time(nostracct_id: str) -> int:
-    row: dict = await db.fetchone(
+async def compress_direct_messages(messages: List[DirectMessage]) -> int:
+    """
+    Store the given messages compressed where that saves space, and record the
+    plain text size of all of them so they are not looked at again.
+    Returns the number of messages compressed.
+    """
+    compressed = 0
+    for i in range(0, len(messages), _MAX_ROWS_PER_STATEMENT):
+        chunk = messages[i : i + _MAX_ROWS_PER_STATEMENT]
+        values: dict = {}
+        for j, dm in enumerate(chunk):
+            message, message_format, message_size = compress_message(dm.message)
+            values[f"id_{j}"] = dm.id
+            values[f"message_{j}"] = message
+            values[f"format_{j}"] = message_format
+            values[f"size_{j}"] = message_size
+            compressed += int(message_format is not None)
+
+        columns = {
+            "message": ":message_{j}",
+            "message_format": ":format_{j}",
+            "message_size": "CAST(:size_{j} AS INTEGER)",
+        }
+        sets = ", ".join(
+            f"{column} = CASE "
+            + " ".join(
+                f"WHEN id = :id_{j} THEN {value.format(j=j)}"
+                for j in range(len(chunk))
+            )
+            + f" ELSE {column} END"
+            for column, value in columns.items()
+        )
+        keys = ", ".join(f":id_{j}" for j in range(len(chunk)))
+        await db.execute(
+            f"""
+            UPDATE nostrchat.direct_messages SET {sets}
+            WHERE id IN ({keys}) AND message_size IS NULL
+            """,
+            values,
+        )
+    return compressed
+
+
+async def get_message_storage_report() -> List[dict]:
+    """Stored and plain text bytes of the compressed messages, per format."""
+    rows: list[dict] = await db.fetchall(
+        """
+        SELECT message_format, COUNT(*) AS messages,
+            SUM(message_size) AS plain_bytes, SUM(LENGTH(message)) AS stored_bytes
+        FROM nostrchat.direct_messages
+        WHERE message_format IS NOT NULL
+        GROUP BY message_format
         """
-            SELECT time FROM nostrchat.direct_messages
-            WHERE nostracct_id = :nostracct_id ORDER BY time DESC LIMIT 1
-        """,
-        {"nostracct_id": nostracct_id},
     )
-    return row["time"] if row else 0
+    return [
+        {
+            "format": row["message_format"],
+            "messages": row["messages"],
+            "plain_bytes": int(row["plain_bytes"] or 0),
+            "stored_bytes": int(row["stored_bytes"] or 0),
+            "bytes_saved": int(row["plain_bytes"] or 0)
+            - int(row["stored_bytes"] or 0),
+        }
+        for row in rows
+    ]
 
 
-async def get_last_direct_messages_created_at() -> int:
+async def get_search_index_storage() -> dict:
+    """
+    Size of the full-text search index. It keeps its own plain text copy of
+    every message, compressed or not, on top of the index itself.
+    """
+    byte_length = (
+        "LENGTH(CAST(message AS BLOB))"
+        if db.type == "SQLITE"
+        else "OCTET_LENGTH(message)"
+    )
     row: dict = await db.fetchone(
+        f"""
+        SELECT COUNT(*) AS messages, SUM({byte_length}) AS text_bytes
+        FROM nostrchat.dm_search
         """
-            SELECT event_created_at FROM nostrchat.direct_messages
-            ORDER BY event_created_at DESC LIMIT 1
+    )
+    if db.type == "SQLITE":
+        # FTS5 keeps the inverted index as blobs in its `_data` shadow table
+        index: dict = await db.fetchone(
+            "SELECT SUM(LENGTH(block)) AS index_bytes FROM nostrchat.dm_search_data"
+        )
+    else:
+        index = await db.fetchone(
+            "SELECT pg_indexes_size('nostrchat.dm_search') AS index_bytes"
+        )
+    return {
+        "messages": row["messages"],
+        "text_bytes": int(row["text_bytes"] or 0),
+        "index_bytes": int(index["index_bytes"] or 0),
+    }
+
+
+async def get_orders_from_direct_messages(nostracct_id: str) -> List[DirectMessage]:
+    rows: list[dict] = await db.fetchall(
+        """
+        SELECT * FROM nostrchat.direct_messages
+        WHERE nostracct_id = :nostracct_id AND type >= 0 ORDER BY event_created_at, type
         """,
-        {},
+        {"nostracct_id": nostracct_id},
     )
-    return row["event_created_at"] if row else 0
+    return [DirectMessage.from_row(row) for row in rows]
 
 
 async def delete_nostracct_direct_messages(nostracct_id: str) -> None:
@@ -229,6 +719,62 @@ async def delete_nostracct_direct_messages(nostracct_id: str) -> None:
         "DELETE FROM nostrchat.direct_messages WHERE nostracct_id = :nostracct_id",
         {"nostracct_id": nostracct_id},
     )
+    search_filter, search_values = _search_rows_filter(
+        "nostracct_id", [nostracct_id]
+    )
+    await db.execute(
+        f"""
+        DELETE FROM nostrchat.dm_search
+        WHERE {search_filter} AND nostracct_id = :nostracct_id
+        """,
+        {"nostracct_id": nostracct_id, **search_values},
+    )
+    await db.execute(
+        """
+        DELETE FROM nostrchat.direct_messages_archive
+        WHERE nostracct_id = :nostracct_id
+        """,
+        {"nostracct_id": nostracct_id},
+    )
+
+
+async def delete_direct_messages(
+    ids: List[str], conn: Optional[Connection] = None
+) -> None:
+    """Delete messages by id, together with their search index rows."""
+    for i in range(0, len(ids), _MAX_ROWS_PER_STATEMENT):
+        chunk = ids[i : i + _MAX_ROWS_PER_STATEMENT]
+        values = {f"value_{j}": id_ for j, id_ in enumerate(chunk)}
+        keys = ", ".join(f":value_{j}" for j in range(len(chunk)))
+        await (conn or db).execute(
+            f"DELETE FROM nostrchat.direct_messages WHERE id IN ({keys})", values
+        )
+        search_filter, search_values = _search_rows_filter("id", chunk)
+        await (conn or db).execute(
+            f"""
+            DELETE FROM nostrchat.dm_search
+            WHERE {search_filter} AND id IN ({keys})
+            """,
+            {**values, **search_values},
+        )
+
+
+def _fts_phrase(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _search_rows_filter(column: str, values: List[str]) -> Tuple[str, dict]:
+    """
+    Index lookup for `nostrchat.dm_search` rows by exact column values, to be
+    combined with the exact comparison: FTS5 tokenizes (and case folds) the
+    values, the MATCH only narrows down the candidates.
+    """
+    if db.type != "SQLITE":
+        return "TRUE", {}
+    phrases = " OR ".join(_fts_phrase(v) for v in values)
+    return "dm_search MATCH :search_match", {
+        "search_match": f"{column} : ({phrases})"
+    }
 
 
 ######################################## PEERS #####################################
@@ -274,6 +820,36 @@ async def get_peers(nostracct_id: str) -> List[Peer]:
     return [Peer.from_row(row) for row in rows]
 
 
+@db_timings.timed("get_peers_by_recency")
+async def get_peers_by_recency(
+    nostracct_id: str, before: Optional[str] = None, limit: int = 50
+) -> List[Peer]:
+    """
+    Peers ordered by their last message, newest first. `before` is the
+    `<last_message_at>:<public_key>` cursor of the last peer of the previous page.
+    """
+    values: dict = {"nostracct_id": nostracct_id}
+    keyset = ""
+    if before:
+        values["at"], values["public_key"] = parse_message_cursor(before)
+        keyset = """
+            AND (
+                last_message_at < :at
+                OR (last_message_at = :at AND public_key < :public_key)
+            )
+        """
+    rows: list[dict] = await db.fetchall(
+        f"""
+        SELECT * FROM nostrchat.peers
+        WHERE nostracct_id = :nostracct_id {keyset}
+        ORDER BY last_message_at DESC, public_key DESC
+        LIMIT {int(limit)}
+        """,
+        values,
+    )
+    return [Peer.from_row(row) for row in rows]
+
+
 async def get_all_unique_peers() -> List[Peer]:
     q = """
             SELECT public_key, MAX(nostracct_id) as nostracct_id, MAX(event_created_at)
@@ -315,6 +891,120 @@ async def increment_peer_unread_messages(nostracct_id: str, public_key: str):
     )
 
 
+async def upsert_peers_unread_messages(
+    nostracct_id: str, unread: Dict[str, int], conn: Optional[Connection] = None
+) -> List[str]:
+    """
+    Add `unread[public_key]` to the unread counter of each peer, creating the
+    peers that do not exist yet. Returns the public keys of the new peers.
+    """
+    if not unread:
+        return []
+    public_keys = list(unread.keys())
+    values: dict = {"nostracct_id": nostracct_id}
+    for j, public_key in enumerate(public_keys):
+        values[f"public_key_{j}"] = public_key
+        values[f"unread_{j}"] = unread[public_key]
+    placeholders = ", ".join(f":public_key_{j}" for j in range(len(public_keys)))
+
+    rows: list[dict] = await (conn or db).fetchall(
+        f"""
+        SELECT public_key FROM nostrchat.peers
+        WHERE nostracct_id = :nostracct_id AND public_key IN ({placeholders})
+        """,
+        values,
+    )
+    existing = {row["public_key"] for row in rows}
+    new_peers = [j for j, pk in enumerate(public_keys) if pk not in existing]
+    old_peers = [
+        j for j, pk in enumerate(public_keys) if pk in existing and unread[pk] != 0
+    ]
+
+    if new_peers:
+        rows_sql = ", ".join(
+            f"(:nostracct_id, :public_key_{j}, :unread_{j}, '{{}}')" for j in new_peers
+        )
+        await (conn or db).execute(
+            f"""
+            INSERT INTO nostrchat.peers
+            (nostracct_id, public_key, unread_messages, meta)
+            VALUES {rows_sql}
+            """,
+            values,
+        )
+
+    if old_peers:
+        cases = " ".join(
+            f"WHEN :public_key_{j} THEN CAST(:unread_{j} AS INTEGER)" for j in old_peers
+        )
+        keys = ", ".join(f":public_key_{j}" for j in old_peers)
+        await (conn or db).execute(
+            f"""
+            UPDATE nostrchat.peers
+            SET unread_messages = unread_messages + CASE public_key {cases} END
+            WHERE nostracct_id = :nostracct_id AND public_key IN ({keys})
+            """,
+            values,
+        )
+
+    return [public_keys[j] for j in new_peers]
+
+
+async def update_peers_last_message(
+    nostracct_id: str, messages: List[DirectMessage], conn: Optional[Connection] = None
+) -> None:
+    """Move the last message summary of the peers forward to the newest `messages`."""
+    latest: Dict[str, DirectMessage] = {}
+    for dm in messages:
+        current = latest.get(dm.public_key)
+        if not current or (dm.event_created_at or 0, dm.id) > (
+            current.event_created_at or 0,
+            current.id,
+        ):
+            latest[dm.public_key] = dm
+
+    last_messages = list(latest.values())
+    for i in range(0, len(last_messages), _MAX_ROWS_PER_STATEMENT):
+        chunk = last_messages[i : i + _MAX_ROWS_PER_STATEMENT]
+        values: dict = {"nostracct_id": nostracct_id}
+        for j, dm in enumerate(chunk):
+            values[f"public_key_{j}"] = dm.public_key
+            values[f"at_{j}"] = dm.event_created_at or 0
+            values[f"id_{j}"] = dm.id
+            values[f"message_{j}"] = dm.message[:PEER_PREVIEW_LENGTH]
+            values[f"incoming_{j}"] = dm.incoming
+
+        columns = {
+            "last_message_at": "CAST(:at_{j} AS INTEGER)",
+            "last_message_id": ":id_{j}",
+            "last_message": ":message_{j}",
+            "last_message_incoming": ":incoming_{j}",
+        }
+        sets = ", ".join(
+            _newer_message_case(column, value, len(chunk))
+            for column, value in columns.items()
+        )
+        keys = ", ".join(f":public_key_{j}" for j in range(len(chunk)))
+        await (conn or db).execute(
+            f"""
+            UPDATE nostrchat.peers SET {sets}
+            WHERE nostracct_id = :nostracct_id AND public_key IN ({keys})
+            """,
+            values,
+        )
+
+
+def _newer_message_case(column: str, value: str, count: int) -> str:
+    # only newer messages move the summary, SET sees the old row values
+    whens = " ".join(
+        f"WHEN public_key = :public_key_{j} "
+        f"AND last_message_at <= CAST(:at_{j} AS INTEGER) "
+        f"THEN {value.format(j=j)}"
+        for j in range(count)
+    )
+    return f"{column} = CASE {whens} ELSE {column} END"
+
+
 # ??? two nostraccts
 async def update_peer_no_unread_messages(nostracct_id: str, public_key: str):
     await db.execute(
@@ -328,3 +1018,577 @@ async def update_peer_no_unread_messages(nostracct_id: str, public_key: str):
             "public_key": public_key,
         },
     )
+
+
+######################################## SYNC CURSORS ##################################
+
+
+async def get_sync_cursors() -> Dict[str, Dict[int, int]]:
+    """High-water marks (`event_created_at`) per nostracct and event kind."""
+    rows: list[dict] = await db.fetchall(
+        "SELECT nostracct_id, kind, since FROM nostrchat.sync_cursors"
+    )
+    cursors: Dict[str, Dict[int, int]] = {}
+    for row in rows:
+        cursors.setdefault(row["nostracct_id"], {})[row["kind"]] = row["since"]
+    return cursors
+
+
+async def update_sync_cursors(
+    cursors: Dict[Tuple[str, int], int], conn: Optional[Connection] = None
+) -> None:
+    """Move the cursors forward, a cursor never goes back in time."""
+    for (nostracct_id, kind), since in cursors.items():
+        await (conn or db).execute(
+            """
+            INSERT INTO nostrchat.sync_cursors AS c (nostracct_id, kind, since)
+            VALUES (:nostracct_id, :kind, :since)
+            ON CONFLICT (nostracct_id, kind) DO UPDATE
+            SET since = CASE WHEN excluded.since > c.since THEN excluded.since
+                        ELSE c.since END
+            """,
+            {"nostracct_id": nostracct_id, "kind": kind, "since": since},
+        )
+
+
+async def delete_sync_cursors(nostracct_id: str) -> None:
+    await db.execute(
+        "DELETE FROM nostrchat.sync_cursors WHERE nostracct_id = :nostracct_id",
+        {"nostracct_id": nostracct_id},
+    )
+
+
+######################################## OUTBOX ####################################
+
+
+@db_timings.timed("create_outbox_event")
+async def create_outbox_event(
+    nostracct_id: str, event: NostrEvent, conn: Optional[Connection] = None
+) -> OutboxEvent:
+    await (conn or db).execute(
+        """
+        INSERT INTO nostrchat.outbox (id, nostracct_id, event, next_attempt_at)
+        VALUES (:id, :nostracct_id, :event, :next_attempt_at)
+        ON CONFLICT(id) DO NOTHING
+        """,
+        {
+            "id": event.id,
+            "nostracct_id": nostracct_id,
+            "event": json.dumps(event.dict(), separators=(",", ":")),
+            "next_attempt_at": int(time.time()),
+        },
+    )
+    outbox_event = await get_outbox_event(event.id, conn)
+    assert outbox_event, "Newly created outbox event couldn't be retrieved"
+    return outbox_event
+
+
+async def get_outbox_event(
+    event_id: str, conn: Optional[Connection] = None
+) -> Optional[OutboxEvent]:
+    row: dict = await (conn or db).fetchone(
+        "SELECT * FROM nostrchat.outbox WHERE id = :id",
+        {"id": event_id},
+    )
+    return OutboxEvent.from_row(row) if row else None
+
+
+@db_timings.timed("get_due_outbox_events")
+async def get_due_outbox_events(limit: int = 100) -> List[OutboxEvent]:
+    rows: list[dict] = await db.fetchall(
+        f"""
+        SELECT * FROM nostrchat.outbox
+        WHERE status = :status AND next_attempt_at <= :now
+        ORDER BY next_attempt_at LIMIT {int(limit)}
+        """,
+        {"status": DeliveryStatus.PENDING.value, "now": int(time.time())},
+    )
+    return [OutboxEvent.from_row(row) for row in rows]
+
+
+async def get_next_outbox_attempt_at() -> Optional[int]:
+    row: dict = await db.fetchone(
+        """
+        SELECT MIN(next_attempt_at) AS next_attempt_at FROM nostrchat.outbox
+        WHERE status = :status
+        """,
+        {"status": DeliveryStatus.PENDING.value},
+    )
+    return row["next_attempt_at"] if row else None
+
+
+@db_timings.timed("update_outbox_events_status")
+async def update_outbox_events_status(
+    event_ids: List[str],
+    status: DeliveryStatus,
+    last_error: Optional[str] = None,
+    only_status: Optional[DeliveryStatus] = None,
+) -> None:
+    """`only_status` guards against overwriting a later status (e.g. an early OK)."""
+    if not event_ids:
+        return
+    values: dict = {"status": status.value, "last_error": last_error}
+    values.update({f"id_{j}": event_id for j, event_id in enumerate(event_ids)})
+    placeholders = ", ".join(f":id_{j}" for j in range(len(event_ids)))
+    guard = ""
+    if only_status:
+        guard = "AND status = :only_status"
+        values["only_status"] = only_status.value
+    await db.execute(
+        f"""
+        UPDATE nostrchat.outbox SET status = :status, last_error = :last_error
+        WHERE id IN ({placeholders}) {guard}
+        """,
+        values,
+    )
+
+
+async def reschedule_outbox_event(
+    event_id: str, attempts: int, next_attempt_at: int, last_error: Optional[str]
+) -> None:
+    await db.execute(
+        """
+        UPDATE nostrchat.outbox
+        SET attempts = :attempts, next_attempt_at = :next_attempt_at,
+            last_error = :last_error
+        WHERE id = :id
+        """,
+        {
+            "id": event_id,
+            "attempts": attempts,
+            "next_attempt_at": next_attempt_at,
+            "last_error": last_error,
+        },
+    )
+
+
+async def delete_nostracct_outbox_events(nostracct_id: str) -> None:
+    await db.execute(
+        "DELETE FROM nostrchat.outbox WHERE nostracct_id = :nostracct_id",
+        {"nostracct_id": nostracct_id},
+    )
+
+
+######################################## ARCHIVE ######################################
+
+# message columns kept by the archive and the exports
+MESSAGE_COLUMNS = (
+    "id",
+    "event_id",
+    "event_created_at",
+    "message",
+    "public_key",
+    "type",
+    "incoming",
+    "delivery_status",
+)
+
+# conversations restored from the archive are not archived again
+_NOT_ON_HOLD = """
+    public_key NOT IN (
+        SELECT public_key FROM nostrchat.peers
+        WHERE nostracct_id = :nostracct_id AND archive_hold_until > :now
+    )
+"""
+
+
+@db_timings.timed("get_direct_messages_older_than")
+async def get_direct_messages_older_than(
+    nostracct_id: str, created_before: int, limit: int
+) -> List[DirectMessage]:
+    rows: list[dict] = await db.fetchall(
+        f"""
+        SELECT * FROM nostrchat.direct_messages
+        WHERE nostracct_id = :nostracct_id AND event_created_at < :created_before
+        AND {_NOT_ON_HOLD}
+        ORDER BY event_created_at, id LIMIT {int(limit)}
+        """,
+        {
+            "nostracct_id": nostracct_id,
+            "created_before": created_before,
+            "now": int(time.time()),
+        },
+    )
+    return [DirectMessage.from_row(row) for row in rows]
+
+
+async def get_direct_messages_over_peer_limit(
+    nostracct_id: str, keep: int, limit: int
+) -> List[DirectMessage]:
+    """The oldest messages of the conversations with more than `keep` messages."""
+    counts: list[dict] = await db.fetchall(
+        f"""
+        SELECT public_key, COUNT(*) AS count FROM nostrchat.direct_messages
+        WHERE nostracct_id = :nostracct_id AND {_NOT_ON_HOLD}
+        GROUP BY public_key HAVING COUNT(*) > :keep
+        """,
+        {"nostracct_id": nostracct_id, "keep": keep, "now": int(time.time())},
+    )
+    messages: List[DirectMessage] = []
+    for row in counts:
+        count = min(row["count"] - keep, limit - len(messages))
+        if count <= 0:
+            break
+        rows: list[dict] = await db.fetchall(
+            f"""
+            SELECT * FROM nostrchat.direct_messages
+            WHERE nostracct_id = :nostracct_id AND public_key = :public_key
+            ORDER BY event_created_at, id LIMIT {int(count)}
+            """,
+            {"nostracct_id": nostracct_id, "public_key": row["public_key"]},
+        )
+        messages += [DirectMessage.from_row(r) for r in rows]
+    return messages
+
+
+@db_timings.timed("archive_direct_messages")
+async def archive_direct_messages(
+    nostracct_id: str, messages: List[DirectMessage]
+) -> int:
+    """
+    Move messages to the archive, one compressed archive row per conversation
+    and chunk of up to `_MAX_ROWS_PER_STATEMENT` messages.
+
+    Statements are committed one by one, so this is made safe to repeat
+    instead: an archive row is keyed by the id of its oldest message, which
+    stays the oldest live message of the conversation until the chunk is
+    deleted, and only the messages found in the stored archive row are
+    deleted. A run interrupted between the INSERT and the DELETE is completed
+    by the next run without archiving anything twice.
+    Returns the number of messages archived.
+    """
+    by_peer: Dict[str, List[DirectMessage]] = {}
+    for dm in messages:
+        by_peer.setdefault(dm.public_key, []).append(dm)
+
+    archived = 0
+    async with db.connect() as conn:
+        for public_key, dms in by_peer.items():
+            dms.sort(key=lambda dm: (dm.event_created_at or 0, dm.id))
+            for i in range(0, len(dms), _MAX_ROWS_PER_STATEMENT):
+                chunk = dms[i : i + _MAX_ROWS_PER_STATEMENT]
+                archived += await _archive_chunk(nostracct_id, public_key, chunk, conn)
+    return archived
+
+
+async def _archive_chunk(
+    nostracct_id: str, public_key: str, dms: List[DirectMessage], conn: Connection
+) -> int:
+    created_at = [dm.event_created_at or 0 for dm in dms]
+    rows = [{column: getattr(dm, column) for column in MESSAGE_COLUMNS} for dm in dms]
+    archive_id = dms[0].id
+    await conn.execute(
+        """
+        INSERT INTO nostrchat.direct_messages_archive
+        (
+            id, nostracct_id, public_key, first_created_at,
+            last_created_at, message_count, data
+        )
+        VALUES
+        (
+            :id, :nostracct_id, :public_key, :first_created_at,
+            :last_created_at, :message_count, :data
+        )
+        ON CONFLICT(id) DO NOTHING
+        """,
+        {
+            "id": archive_id,
+            "nostracct_id": nostracct_id,
+            "public_key": public_key,
+            "first_created_at": min(created_at),
+            "last_created_at": max(created_at),
+            "message_count": len(dms),
+            "data": compress_rows(rows),
+        },
+    )
+    # after an interrupted run the stored row can hold fewer messages
+    row: dict = await conn.fetchone(
+        "SELECT data FROM nostrchat.direct_messages_archive WHERE id = :id",
+        {"id": archive_id},
+    )
+    stored_ids = {r["id"] for r in decompress_rows(row["data"])}
+    confirmed = [dm.id for dm in dms if dm.id in stored_ids]
+    # a single statement for the messages, at most one chunk per statement
+    await delete_direct_messages(confirmed, conn)
+    return len(confirmed)
+
+
+async def get_archived_conversations(nostracct_id: str) -> List[ArchivedConversation]:
+    rows: list[dict] = await db.fetchall(
+        """
+        SELECT public_key, SUM(message_count) AS message_count,
+            MIN(first_created_at) AS first_created_at,
+            MAX(last_created_at) AS last_created_at, COUNT(*) AS batches
+        FROM nostrchat.direct_messages_archive
+        WHERE nostracct_id = :nostracct_id
+        GROUP BY public_key ORDER BY MAX(last_created_at) DESC
+        """,
+        {"nostracct_id": nostracct_id},
+    )
+    return [ArchivedConversation.from_row(row) for row in rows]
+
+
+async def insert_new_direct_messages(
+    nostracct_id: str, messages: List[DirectMessage], conn: Connection
+) -> List[DirectMessage]:
+    """
+    Insert complete messages, keeping their ids, unless a message with the same
+    id or event id is already stored. Returns the inserted messages.
+    """
+    messages = list({dm.id: dm for dm in messages}.values())
+    existing_ids: set = set()
+    for i in range(0, len(messages), _MAX_ROWS_PER_STATEMENT):
+        chunk = messages[i : i + _MAX_ROWS_PER_STATEMENT]
+        ids = {f"id_{j}": dm.id for j, dm in enumerate(chunk)}
+        rows: list[dict] = await conn.fetchall(
+            f"""
+            SELECT id FROM nostrchat.direct_messages
+            WHERE id IN ({", ".join(f":{key}" for key in ids)})
+            """,
+            ids,
+        )
+        existing_ids.update(row["id"] for row in rows)
+    existing_event_ids = await get_existing_event_ids(
+        [dm.event_id for dm in messages if dm.event_id], conn
+    )
+    new_messages = [
+        dm
+        for dm in messages
+        if dm.id not in existing_ids and dm.event_id not in existing_event_ids
+    ]
+    await insert_direct_messages([(nostracct_id, dm) for dm in new_messages], conn)
+    return new_messages
+
+
+async def restore_archived_conversation(
+    nostracct_id: str, public_key: str, hold_seconds: int
+) -> int:
+    """
+    Move the archived messages of a conversation back and keep the retention
+    job away from it for `hold_seconds`. Returns the number of messages restored.
+    """
+    values = {"nostracct_id": nostracct_id, "public_key": public_key}
+    async with db.connect() as conn:
+        archived: list[dict] = await conn.fetchall(
+            """
+            SELECT data FROM nostrchat.direct_messages_archive
+            WHERE nostracct_id = :nostracct_id AND public_key = :public_key
+            """,
+            values,
+        )
+        messages = [
+            DirectMessage(**row) for a in archived for row in decompress_rows(a["data"])
+        ]
+        restored = await insert_new_direct_messages(nostracct_id, messages, conn)
+        await conn.execute(
+            """
+            DELETE FROM nostrchat.direct_messages_archive
+            WHERE nostracct_id = :nostracct_id AND public_key = :public_key
+            """,
+            values,
+        )
+        await conn.execute(
+            """
+            UPDATE nostrchat.peers SET archive_hold_until = :hold_until
+            WHERE nostracct_id = :nostracct_id AND public_key = :public_key
+            """,
+            {**values, "hold_until": int(time.time()) + hold_seconds},
+        )
+        await update_peers_last_message(nostracct_id, restored, conn)
+    return len(restored)
+
+
+######################################## EXPORT ######################################
+
+
+async def get_peers_page(
+    nostracct_id: str, after: str = "", limit: int = 500
+) -> List[Peer]:
+    """Peers in `public_key` order, starting after `after`."""
+    rows: list[dict] = await db.fetchall(
+        f"""
+        SELECT * FROM nostrchat.peers
+        WHERE nostracct_id = :nostracct_id AND public_key > :after
+        ORDER BY public_key LIMIT {int(limit)}
+        """,
+        {"nostracct_id": nostracct_id, "after": after},
+    )
+    return [Peer.from_row(row) for row in rows]
+
+
+async def get_direct_messages_page(
+    nostracct_id: str,
+    after: Optional[Tuple[str, int, str]] = None,
+    limit: int = 500,
+) -> List[Tuple[DirectMessage, Optional[str]]]:
+    """
+    All messages of a nostracct in `(public_key, event_created_at, id)` order,
+    starting after the `after` key, with the signed event of the outbox when
+    the message was sent from here.
+    """
+    values: dict = {"nostracct_id": nostracct_id}
+    clause = ""
+    if after:
+        values["public_key"], values["created_at"], values["id"] = after
+        clause = """AND (d.public_key > :public_key OR (d.public_key = :public_key
+                AND (d.event_created_at > :created_at
+                OR (d.event_created_at = :created_at AND d.id > :id))))"""
+    rows: list[dict] = await db.fetchall(
+        f"""
+        SELECT d.*, o.event AS signed_event FROM nostrchat.direct_messages d
+        LEFT JOIN nostrchat.outbox o ON o.id = d.event_id
+        WHERE d.nostracct_id = :nostracct_id {clause}
+        ORDER BY d.public_key, d.event_created_at, d.id LIMIT {int(limit)}
+        """,
+        values,
+    )
+    page = []
+    for row in rows:
+        row = dict(row)
+        signed_event = row.pop("signed_event")
+        page.append((DirectMessage.from_row(row), signed_event))
+    return page
+
+
+async def get_archived_direct_messages_page(
+    nostracct_id: str, after: str = "", limit: int = 100
+) -> List[dict]:
+    """Archive rows, still compressed, in `id` order starting after `after`."""
+    rows: list[dict] = await db.fetchall(
+        f"""
+        SELECT id, public_key, first_created_at, last_created_at,
+            message_count, data
+        FROM nostrchat.direct_messages_archive
+        WHERE nostracct_id = :nostracct_id AND id > :after
+        ORDER BY id LIMIT {int(limit)}
+        """,
+        {"nostracct_id": nostracct_id, "after": after},
+    )
+    return [dict(row) for row in rows]
+
+
+async def import_peers(
+    nostracct_id: str, peers: List[Peer], conn: Optional[Connection] = None
+) -> None:
+    """Create the peers that do not exist yet, existing peers are left as they are."""
+    for i in range(0, len(peers), _MAX_ROWS_PER_STATEMENT):
+        rows, values = [], {"nostracct_id": nostracct_id}
+        for j, peer in enumerate(peers[i : i + _MAX_ROWS_PER_STATEMENT]):
+            rows.append(
+                f"""(
+                :nostracct_id, :public_key_{j}, :meta_{j}, :event_created_at_{j},
+                :unread_{j}, :last_message_at_{j}, :last_message_id_{j},
+                :last_message_{j}, :last_message_incoming_{j}
+                )"""
+            )
+            values.update(
+                {
+                    f"public_key_{j}": peer.public_key,
+                    f"meta_{j}": json.dumps(
+                        peer.profile.dict() if peer.profile else {}
+                    ),
+                    f"event_created_at_{j}": peer.event_created_at,
+                    f"unread_{j}": peer.unread_messages,
+                    f"last_message_at_{j}": peer.last_message_at,
+                    f"last_message_id_{j}": peer.last_message_id,
+                    f"last_message_{j}": peer.last_message,
+                    f"last_message_incoming_{j}": peer.last_message_incoming,
+                }
+            )
+        await (conn or db).execute(
+            f"""
+            INSERT INTO nostrchat.peers
+            (
+                nostracct_id, public_key, meta, event_created_at,
+                unread_messages, last_message_at, last_message_id,
+                last_message, last_message_incoming
+            )
+            VALUES {", ".join(rows)}
+            ON CONFLICT (nostracct_id, public_key) DO NOTHING
+            """,
+            values,
+        )
+
+
+async def import_direct_messages(
+    nostracct_id: str,
+    messages: List[DirectMessage],
+    events: List[Tuple[NostrEvent, DeliveryStatus]],
+) -> int:
+    """
+    Store a batch of exported messages and the signed events that came with
+    them. This is not atomic, every statement is committed on its own, but it
+    is idempotent: messages already stored are skipped and outbox rows are
+    keyed by event id, so an interrupted import is completed by running it
+    again. Returns the number of new messages.
+    """
+    async with db.connect() as conn:
+        created = await insert_new_direct_messages(nostracct_id, messages, conn)
+        await update_peers_last_message(nostracct_id, created, conn)
+        await import_outbox_events(nostracct_id, events, conn)
+        # the relays do not need to send this history again
+        if created:
+            since = max(dm.event_created_at or 0 for dm in created)
+            await update_sync_cursors({(nostracct_id, 4): since}, conn)
+    return len(created)
+
+
+async def import_outbox_events(
+    nostracct_id: str,
+    events: List[Tuple[NostrEvent, DeliveryStatus]],
+    conn: Connection,
+) -> None:
+    """
+    Keep the signed events of imported messages, with the delivery status of
+    their message. Pending ones are published again by the outbox sender.
+    Events already in the outbox are left as they are.
+    """
+    for i in range(0, len(events), _MAX_ROWS_PER_STATEMENT):
+        rows, values = [], {"nostracct_id": nostracct_id}
+        for j, (event, status) in enumerate(events[i : i + _MAX_ROWS_PER_STATEMENT]):
+            rows.append(f"(:id_{j}, :nostracct_id, :event_{j}, :status_{j})")
+            values.update(
+                {
+                    f"id_{j}": event.id,
+                    f"event_{j}": json.dumps(event.dict(), separators=(",", ":")),
+                    f"status_{j}": status.value,
+                }
+            )
+        await conn.execute(
+            f"""
+            INSERT INTO nostrchat.outbox (id, nostracct_id, event, status)
+            VALUES {", ".join(rows)}
+            ON CONFLICT(id) DO NOTHING
+            """,
+            values,
+        )
+
+
+async def import_archived_direct_messages(
+    nostracct_id: str, rows: List[dict], conn: Optional[Connection] = None
+) -> None:
+    for row in rows:
+        await (conn or db).execute(
+            """
+            INSERT INTO nostrchat.direct_messages_archive
+            (
+                id, nostracct_id, public_key, first_created_at,
+                last_created_at, message_count, data
+            )
+            VALUES
+            (
+                :id, :nostracct_id, :public_key, :first_created_at,
+                :last_created_at, :message_count, :data
+            )
+            ON CONFLICT(id) DO NOTHING
+            """,
+            {
+                "id": row["id"],
+                "nostracct_id": nostracct_id,
+                "public_key": row["public_key"],
+                "first_created_at": row["first_created_at"],
+                "last_created_at": row["last_created_at"],
+                "message_count": row["message_count"],
+                "data": row["data"],
+            },
+        )
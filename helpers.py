@@ -1,6 +1,11 @@
 import base64
+import json
+import re
 import secrets
-from typing import Optional
+import threading
+import zlib
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 
 import secp256k1
 from bech32 import bech32_decode, convertbits
@@ -8,12 +13,75 @@ from cffi import FFI
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
 
 def get_shared_secret(privkey: str, pubkey: str):
     point = secp256k1.PublicKey(bytes.fromhex("02" + pubkey), True)
     return point.ecdh(bytes.fromhex(privkey), hashfn=copy_x)
 
 
+class SharedSecretCache:
+    """Thread-safe LRU cache of ECDH shared secrets keyed by (account, peer)."""
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._secrets: OrderedDict[Tuple[str, str], bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, account_id: str, privkey: str, pubkey: str) -> bytes:
+        key = (account_id, pubkey)
+        with self._lock:
+            secret = self._secrets.get(key)
+            if secret is not None:
+                self._secrets.move_to_end(key)
+                self.hits += 1
+                return secret
+            self.misses += 1
+
+        # compute outside the lock, a duplicate ECDH is cheaper than contention
+        secret = get_shared_secret(privkey, pubkey)
+        with self._lock:
+            self._secrets[key] = secret
+            self._secrets.move_to_end(key)
+            while len(self._secrets) > self.maxsize:
+                self._secrets.popitem(last=False)
+        return secret
+
+    def invalidate(self, account_id: str, pubkey: Optional[str] = None):
+        with self._lock:
+            if pubkey:
+                self._secrets.pop((account_id, pubkey), None)
+                return
+            for key in [k for k in self._secrets if k[0] == account_id]:
+                del self._secrets[key]
+
+    def clear(self):
+        with self._lock:
+            self._secrets.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._secrets),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# (nostracct, peer) pairs kept, the least recently used are evicted first
+SHARED_SECRET_CACHE_SIZE = 4096
+shared_secrets = SharedSecretCache(SHARED_SECRET_CACHE_SIZE)
+
+
 def decrypt_message(encoded_message: str, encryption_key) -> str:
     encoded_data = encoded_message.split("?iv=")
     if len(encoded_data) == 1:
@@ -33,6 +101,19 @@ def decrypt_message(encoded_message: str, encryption_key) -> str:
     return unpadded_data.decode()
 
 
+def decrypt_messages(
+    encoded_messages: List[str], encryption_key
+) -> List[Optional[str]]:
+    """Decrypt a batch of messages sharing the same key. Failures map to `None`."""
+    decrypted: List[Optional[str]] = []
+    for encoded_message in encoded_messages:
+        try:
+            decrypted.append(decrypt_message(encoded_message, encryption_key))
+        except Exception:
+            decrypted.append(None)
+    return decrypted
+
+
 def encrypt_message(message: str, encryption_key, iv: Optional[bytes] = None) -> str:
     padder = padding.PKCS7(128).padder()
     padded_data = padder.update(message.encode()) + padder.finalize()
@@ -92,3 +173,68 @@ def normalize_public_key(pubkey: str) -> str:
         raise ValueError("Public Key is not valid hex")
     int(pubkey, 16)
     return pubkey
+
+
+def parse_message_cursor(cursor: str) -> Tuple[int, str]:
+    """Parse a `<event_created_at>:<id>` keyset pagination cursor."""
+    created_at, _, dm_id = cursor.partition(":")
+    if not created_at.isdigit() or not dm_id:
+        raise ValueError(f"Invalid message cursor: '{cursor}'")
+    return int(created_at), dm_id
+
+
+def parse_search_terms(query: str, max_terms: int = 16) -> List[str]:
+    """
+    Words of a free text search query. Operators and quotes are dropped so the
+    terms are safe to use in an FTS5 MATCH or a Postgres `to_tsquery`.
+    """
+    terms = re.findall(r"\w+", query.lower())[:max_terms]
+    if not terms:
+        raise ValueError("Search query has no words")
+    return terms
+
+
+def compress_rows(rows: List[dict]) -> str:
+    """Rows as zlib compressed JSON, base64 encoded to fit in a TEXT column."""
+    data = json.dumps(rows, separators=(",", ":")).encode()
+    return base64.b64encode(zlib.compress(data, 9)).decode()
+
+
+def decompress_rows(data: str) -> List[dict]:
+    return json.loads(zlib.decompress(base64.b64decode(data)))
+
+
+# messages shorter than this (in UTF-8 bytes) are stored as they are
+MESSAGE_COMPRESSION_THRESHOLD = 1024
+
+
+def compress_message(message: str) -> Tuple[str, Optional[str], int]:
+    """
+    Compress a message body for storage, with zstd when installed, zlib
+    otherwise. Returns the stored text, its format (`None` for plain text) and
+    the size of the plain text in bytes.
+    """
+    data = message.encode()
+    if len(data) < MESSAGE_COMPRESSION_THRESHOLD:
+        return message, None, len(data)
+    if zstandard:
+        compressed, message_format = zstandard.compress(data, 9), "zstd"
+    else:
+        compressed, message_format = zlib.compress(data, 6), "zlib"
+    encoded = base64.b64encode(compressed).decode()
+    if len(encoded) >= len(data):
+        return message, None, len(data)
+    return encoded, message_format, len(data)
+
+
+def decompress_message(stored: str, message_format: Optional[str]) -> str:
+    if not message_format:
+        return stored
+    data = base64.b64decode(stored)
+    if message_format == "zlib":
+        return zlib.decompress(data).decode()
+    if message_format == "zstd":
+        if not zstandard:
+            raise ValueError("Message is zstd compressed, 'zstandard' is missing")
+        return zstandard.decompress(data).decode()
+    raise ValueError(f"Unknown message format: '{message_format}'")
@@ -64,3 +64,294 @@ async def m001_initial(db):
         """
     )
 
+
+async def create_index(
+    db, name: str, table: str, columns: str, unique=False, where: str = ""
+):
+    # SQLite wants the schema on the index name, Postgres on the table name
+    index_name, table_name = (
+        (f"nostrchat.{name}", table)
+        if db.type == "SQLITE"
+        else (name, f"nostrchat.{table}")
+    )
+    await db.execute(
+        f"""
+        CREATE {"UNIQUE " if unique else ""}INDEX {index_name}
+        ON {table_name} ({columns}){f" WHERE {where}" if where else ""}
+        """
+    )
+
+
+async def m002_direct_messages_keyset_index(db):
+    """
+    Composite index for keyset pagination of a conversation.
+    """
+    await create_index(
+        db,
+        "idx_direct_messages_conversation",
+        "direct_messages",
+        "nostracct_id, public_key, event_created_at, id",
+    )
+
+
+async def m003_query_indexes(db):
+    """
+    Indexes for the hot queries on both backends and a unique peer per nostracct.
+    """
+    if db.type == "SQLITE":
+        await db.execute(
+            """
+            DELETE FROM nostrchat.peers WHERE rowid NOT IN (
+                SELECT MIN(rowid) FROM nostrchat.peers
+                GROUP BY nostracct_id, public_key
+            )
+            """
+        )
+    else:
+        await db.execute(
+            """
+            DELETE FROM nostrchat.peers a USING nostrchat.peers b
+            WHERE a.ctid > b.ctid
+            AND a.nostracct_id = b.nostracct_id AND a.public_key = b.public_key
+            """
+        )
+
+    await create_index(
+        db,
+        "idx_peers_nostracct_public_key",
+        "peers",
+        "nostracct_id, public_key",
+        unique=True,
+    )
+    await create_index(db, "idx_peers_public_key", "peers", "public_key")
+
+    await create_index(db, "idx_nostraccts_public_key", "nostraccts", "public_key")
+    await create_index(db, "idx_nostraccts_user_id", "nostraccts", "user_id")
+
+    await create_index(
+        db,
+        "idx_direct_messages_nostracct_type",
+        "direct_messages",
+        "nostracct_id, type, event_created_at",
+    )
+
+
+async def m004_sync_cursors(db):
+    """
+    Per nostracct and event kind resume cursors for the relay subscriptions.
+    """
+    await db.execute(
+        """
+        CREATE TABLE nostrchat.sync_cursors (
+            nostracct_id TEXT NOT NULL,
+            kind INTEGER NOT NULL,
+            since INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (nostracct_id, kind)
+        );
+        """
+    )
+    await db.execute(
+        """
+        INSERT INTO nostrchat.sync_cursors (nostracct_id, kind, since)
+        SELECT nostracct_id, 4, MAX(event_created_at)
+        FROM nostrchat.direct_messages GROUP BY nostracct_id
+        """
+    )
+
+
+async def m005_outbox(db):
+    """
+    Signed events waiting to be published, retried until they go through.
+    """
+    await db.execute(
+        f"""
+        CREATE TABLE nostrchat.outbox (
+            id TEXT PRIMARY KEY,
+            nostracct_id TEXT NOT NULL,
+            event TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            time TIMESTAMP NOT NULL DEFAULT {db.timestamp_now}
+        );
+        """
+    )
+    await create_index(db, "idx_outbox_due", "outbox", "status, next_attempt_at")
+
+
+async def m006_direct_messages_delivery_status(db):
+    """
+    Relay delivery status of the messages sent from this extension.
+    """
+    await db.execute(
+        "ALTER TABLE nostrchat.direct_messages ADD COLUMN delivery_status TEXT;"
+    )
+
+
+async def m007_peers_last_message(db):
+    """
+    Last message summary per peer, for the recency ordered peer list.
+    """
+    await db.execute(
+        "ALTER TABLE nostrchat.peers "
+        "ADD COLUMN last_message_at INTEGER NOT NULL DEFAULT 0;"
+    )
+    await db.execute("ALTER TABLE nostrchat.peers ADD COLUMN last_message_id TEXT;")
+    await db.execute("ALTER TABLE nostrchat.peers ADD COLUMN last_message TEXT;")
+    await db.execute(
+        "ALTER TABLE nostrchat.peers ADD COLUMN last_message_incoming BOOLEAN;"
+    )
+
+    last_message = """
+        (
+            SELECT {column} FROM nostrchat.direct_messages d
+            WHERE d.nostracct_id = peers.nostracct_id
+            AND d.public_key = peers.public_key
+            ORDER BY d.event_created_at DESC, d.id DESC LIMIT 1
+        )
+    """
+    await db.execute(
+        f"""
+        UPDATE nostrchat.peers SET
+            last_message_at = COALESCE(
+                {last_message.format(column="d.event_created_at")}, 0
+            ),
+            last_message_id = {last_message.format(column="d.id")},
+            last_message = {last_message.format(column="SUBSTR(d.message, 1, 200)")},
+            last_message_incoming = {last_message.format(column="d.incoming")}
+        """
+    )
+    await create_index(
+        db,
+        "idx_peers_last_message",
+        "peers",
+        "nostracct_id, last_message_at, public_key",
+    )
+
+
+async def m008_direct_messages_search(db):
+    """
+    Full-text index of the direct messages: FTS5 on SQLite, tsvector on Postgres.
+    """
+    if db.type == "SQLITE":
+        await db.execute(
+            """
+            CREATE VIRTUAL TABLE nostrchat.dm_search USING fts5(
+                id UNINDEXED, nostracct_id UNINDEXED, message
+            );
+            """
+        )
+    else:
+        await db.execute(
+            """
+            CREATE TABLE nostrchat.dm_search (
+                id TEXT PRIMARY KEY,
+                nostracct_id TEXT NOT NULL,
+                message TEXT NOT NULL,
+                tsv tsvector GENERATED ALWAYS AS (to_tsvector('simple', message)) STORED
+            );
+            """
+        )
+        await db.execute(
+            "CREATE INDEX idx_dm_search_tsv ON nostrchat.dm_search USING GIN (tsv);"
+        )
+        await create_index(db, "idx_dm_search_nostracct", "dm_search", "nostracct_id")
+
+    await db.execute(
+        """
+        INSERT INTO nostrchat.dm_search (id, nostracct_id, message)
+        SELECT id, nostracct_id, message FROM nostrchat.direct_messages
+        """
+    )
+
+
+async def m009_direct_messages_archive(db):
+    """
+    Compressed archive of the messages moved out by the retention job.
+    """
+    await db.execute(
+        f"""
+        CREATE TABLE nostrchat.direct_messages_archive (
+            id TEXT PRIMARY KEY,
+            nostracct_id TEXT NOT NULL,
+            public_key TEXT NOT NULL,
+            first_created_at INTEGER NOT NULL,
+            last_created_at INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            time TIMESTAMP NOT NULL DEFAULT {db.timestamp_now}
+        );
+        """
+    )
+    await create_index(
+        db,
+        "idx_direct_messages_archive_conversation",
+        "direct_messages_archive",
+        "nostracct_id, public_key",
+    )
+    # restored conversations are not archived again until then
+    await db.execute(
+        "ALTER TABLE nostrchat.peers "
+        "ADD COLUMN archive_hold_until INTEGER NOT NULL DEFAULT 0;"
+    )
+
+    if db.type == "SQLITE":
+        # index `id` and `nostracct_id` too, so rows can be found without a
+        # scan of the whole FTS table when messages are archived or deleted
+        await db.execute(
+            """
+            CREATE VIRTUAL TABLE nostrchat.dm_search_v2 USING fts5(
+                id, nostracct_id, message
+            );
+            """
+        )
+        await db.execute(
+            """
+            INSERT INTO nostrchat.dm_search_v2 (id, nostracct_id, message)
+            SELECT id, nostracct_id, message FROM nostrchat.dm_search
+            """
+        )
+        await db.execute("DROP TABLE nostrchat.dm_search;")
+        await db.execute("ALTER TABLE nostrchat.dm_search_v2 RENAME TO dm_search;")
+
+
+async def m010_direct_messages_message_format(db):
+    """
+    Large message bodies are stored compressed, `message_format` says how
+    (NULL for plain text). `message_size` is the plain text size in bytes.
+    Existing rows are compressed in the background after startup.
+    """
+    await db.execute(
+        "ALTER TABLE nostrchat.direct_messages ADD COLUMN message_format TEXT;"
+    )
+    await db.execute(
+        "ALTER TABLE nostrchat.direct_messages ADD COLUMN message_size INTEGER;"
+    )
+
+
+async def m011_direct_messages_retention_index(db):
+    """
+    Index the oldest messages per nostracct for the retention job.
+    """
+    await create_index(
+        db,
+        "idx_direct_messages_nostracct_created_at",
+        "direct_messages",
+        "nostracct_id, event_created_at, id",
+    )
+
+
+async def m012_direct_messages_unsized_index(db):
+    """
+    Partial index of the messages stored before `message_size` existed. The
+    compression job records the size of every message it looks at, so the
+    index empties out and later startups find nothing left to scan.
+    """
+    await create_index(
+        db,
+        "idx_direct_messages_unsized",
+        "direct_messages",
+        "id",
+        where="message_size IS NULL",
+    )
@@ -1,17 +1,19 @@
 import json
 import time
 from abc import abstractmethod
+from datetime import datetime, timezone
 from enum import Enum
-from typing import Any, List, Optional, Tuple
+from typing import Any, Optional, Tuple
 
 # TODO: don't think needed
 # from lnbits.utils.exchange_rates import btc_price, fiat_amount_as_satoshis
 from pydantic import BaseModel
 
 from .helpers import (
+    decompress_message,
     decrypt_message,
     encrypt_message,
-    get_shared_secret,
+    shared_secrets,
     sign_message_hash,
 )
 from .nostr.event import NostrEvent
@@ -38,11 +40,23 @@ class NostrAcctProfile(BaseModel):
     picture: Optional[str] = None
 
 
+class RetentionPolicy(BaseModel):
+    # archive messages older than this many days
+    days: Optional[int] = None
+    # archive all but the newest messages of each conversation
+    messages_per_peer: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.days or self.messages_per_peer)
+
+
 class NostrAcctConfig(NostrAcctProfile):
     event_id: Optional[str] = None
     sync_from_nostr = False
     active: bool = False
     restore_in_progress: Optional[bool] = False
+    retention: RetentionPolicy = RetentionPolicy()
 
 
 class PartialNostrAcct(BaseModel):
@@ -58,12 +72,15 @@ class NostrAcct(PartialNostrAcct, Nostrable):
     def sign_hash(self, hash_: bytes) -> str:
         return sign_message_hash(self.private_key, hash_)
 
+    def shared_secret(self, public_key: str) -> bytes:
+        return shared_secrets.get(self.id, self.private_key, public_key)
+
     def decrypt_message(self, encrypted_message: str, public_key: str) -> str:
-        encryption_key = get_shared_secret(self.private_key, public_key)
+        encryption_key = self.shared_secret(public_key)
         return decrypt_message(encrypted_message, encryption_key)
 
     def encrypt_message(self, clear_text_message: str, public_key: str) -> str:
-        encryption_key = get_shared_secret(self.private_key, public_key)
+        encryption_key = self.shared_secret(public_key)
         return encrypt_message(clear_text_message, encryption_key)
 
     def build_dm_event(self, message: str, to_pubkey: str) -> NostrEvent:
@@ -130,6 +147,17 @@ class DirectMessageType(Enum):
     PLAIN_TEXT = -1
 
 
+class DeliveryStatus(str, Enum):
+    # stored, not yet written to the 'nostrclient' websocket
+    PENDING = "pending"
+    # written to the websocket, waiting for a relay `OK`
+    SENT = "sent"
+    ACCEPTED = "accepted"
+    REJECTED = "rejected"
+    # gave up after too many failed writes
+    FAILED = "failed"
+
+
 class PartialDirectMessage(BaseModel):
     event_id: Optional[str] = None
     event_created_at: Optional[int] = None
@@ -153,9 +181,42 @@ class PartialDirectMessage(BaseModel):
 
 class DirectMessage(PartialDirectMessage):
     id: str
+    # only set for messages sent from this extension
+    delivery_status: Optional[DeliveryStatus] = None
+
+    @property
+    def cursor(self) -> str:
+        return f"{self.event_created_at}:{self.id}"
 
     @classmethod
     def from_row(cls, row: dict) -> "DirectMessage":
+        row = dict(row)
+        if row.get("message_format"):
+            row["message"] = decompress_message(row["message"], row["message_format"])
+        if isinstance(row.get("time"), datetime):
+            # Postgres `TIMESTAMP` columns are read as naive datetimes (UTC)
+            row["time"] = int(row["time"].replace(tzinfo=timezone.utc).timestamp())
+        return cls(**row)
+
+
+class DirectMessageSearchHit(BaseModel):
+    dm: DirectMessage
+    # matching fragment, matched words wrapped in `[` `]`
+    snippet: str
+    # higher is more relevant
+    rank: float
+
+
+class ArchivedConversation(BaseModel):
+    public_key: str
+    message_count: int
+    first_created_at: int
+    last_created_at: int
+    # number of archive rows, one per retention run and conversation
+    batches: int
+
+    @classmethod
+    def from_row(cls, row: dict) -> "ArchivedConversation":
         return cls(**row)
 
 
@@ -173,6 +234,15 @@ class Peer(BaseModel):
     event_created_at: Optional[int] = None
     profile: Optional[PeerProfile] = None
     unread_messages: int = 0
+    # summary of the newest message in the conversation
+    last_message_at: int = 0
+    last_message_id: Optional[str] = None
+    last_message: Optional[str] = None
+    last_message_incoming: Optional[bool] = None
+
+    @property
+    def cursor(self) -> str:
+        return f"{self.last_message_at}:{self.public_key}"
 
     @classmethod
     def from_row(cls, row: dict) -> "Peer":
@@ -181,3 +251,23 @@ class Peer(BaseModel):
             PeerProfile(**json.loads(row["meta"])) if "meta" in row else None
         )
         return peer
+
+
+######################################## OUTBOX ####################################
+
+
+class OutboxEvent(BaseModel):
+    id: str
+    nostracct_id: str
+    event: str
+    status: DeliveryStatus = DeliveryStatus.PENDING
+    attempts: int = 0
+    next_attempt_at: int = 0
+    last_error: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row: dict) -> "OutboxEvent":
+        return cls(**row)
+
+    def nostr_event(self) -> NostrEvent:
+        return NostrEvent.parse(self.event)
@@ -0,0 +1,85 @@
+import hashlib
+import math
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter for hex event ids."""
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(
+            8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        )
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        # double hashing (Kirsch-Mitzenmacher) over a single digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+class EventIdFilter:
+    """
+    Duplicate filter for relay events: an exact, bounded set of recently seen
+    event ids, optionally backed by a Bloom filter of ids already persisted.
+    A Bloom hit only means "maybe seen" and must be confirmed by the caller.
+    """
+
+    def __init__(self, recent_size: int = 100_000, bloom: Optional[BloomFilter] = None):
+        self.recent_size = recent_size
+        self.bloom = bloom
+        self.duplicates = 0
+        self._recent: OrderedDict[str, None] = OrderedDict()
+
+    def is_recent(self, event_id: str) -> bool:
+        if event_id in self._recent:
+            self._recent.move_to_end(event_id)
+            return True
+        return False
+
+    def maybe_seen(self, event_id: str) -> bool:
+        return self.bloom is not None and event_id in self.bloom
+
+    def remember(self, event_id: str):
+        self._recent[event_id] = None
+        self._recent.move_to_end(event_id)
+        while len(self._recent) > self.recent_size:
+            self._recent.popitem(last=False)
+        if self.bloom is not None:
+            self.bloom.add(event_id)
+
+    def forget(self, event_id: str):
+        # the Bloom filter cannot forget, its hits are confirmed by the caller
+        self._recent.pop(event_id, None)
+
+    def seed(self, event_ids: Iterable[str]):
+        if self.bloom is None:
+            return
+        for event_id in event_ids:
+            self.bloom.add(event_id)
+
+    def stats(self) -> dict:
+        return {
+            "recent": len(self._recent),
+            "recent_size": self.recent_size,
+            "bloom_items": self.bloom.count if self.bloom else 0,
+            "duplicates": self.duplicates,
+        }
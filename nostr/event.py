@@ -1,32 +1,113 @@
 import hashlib
 import json
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
-from pydantic import BaseModel
 from secp256k1 import PublicKey
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
-class NostrEvent(BaseModel):
-    id: str = ""
-    pubkey: str
-    created_at: int
-    kind: int
-    tags: List[List[str]] = []
-    content: str = ""
-    sig: Optional[str] = None
+
+def json_loads(data: str) -> Any:
+    if not orjson:
+        return json.loads(data)
+    # orjson only takes exact `str`, relay frames are `RelayFrame(str)`
+    if isinstance(data, str) and type(data) is not str:
+        data = str(data)
+    return orjson.loads(data)
+
+
+def _canonical_json(data: list) -> bytes:
+    # NIP-01: no whitespace, UTF-8, only the JSON mandated escapes
+    if orjson:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # e.g. lone surrogates or integers above 64 bits
+            pass
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class NostrEvent:
+    """
+    A nostr event. Plain slotted class instead of a pydantic model, thousands
+    of these are built per relay backfill.
+
+    The id hash and the tag index are computed once: the event is not expected
+    to change after it is built, only `id` and `sig` are assigned.
+    """
+
+    __slots__ = (
+        "id",
+        "pubkey",
+        "created_at",
+        "kind",
+        "tags",
+        "content",
+        "sig",
+        "_event_id",
+        "_tag_index",
+    )
+
+    def __init__(
+        self,
+        pubkey: str,
+        created_at: int,
+        kind: int,
+        tags: Optional[List[List[str]]] = None,
+        content: str = "",
+        id: str = "",
+        sig: Optional[str] = None,
+    ):
+        self.id = id
+        self.pubkey = pubkey
+        self.created_at = created_at
+        self.kind = kind
+        self.tags = tags if tags is not None else []
+        self.content = content
+        self.sig = sig
+        self._event_id: Optional[str] = None
+        self._tag_index: Optional[Dict[str, List[str]]] = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "NostrEvent":
+        """Build an event from a relay payload, ignoring unknown keys."""
+        pubkey, created_at, kind = data["pubkey"], data["created_at"], data["kind"]
+        if not isinstance(pubkey, str):
+            raise ValueError(f"Invalid pubkey: '{pubkey}'")
+        if not isinstance(created_at, int) or not isinstance(kind, int):
+            raise ValueError(f"Invalid event: '{data.get('id')}'")
+        tags = data.get("tags") or []
+        if not isinstance(tags, list) or not all(isinstance(t, list) for t in tags):
+            raise ValueError(f"Invalid tags for event: '{data.get('id')}'")
+        return cls(
+            pubkey=pubkey,
+            created_at=created_at,
+            kind=kind,
+            tags=tags,
+            content=data.get("content") or "",
+            id=data.get("id") or "",
+            sig=data.get("sig"),
+        )
+
+    @classmethod
+    def parse(cls, data: str) -> "NostrEvent":
+        return cls.from_dict(json_loads(data))
 
     def serialize(self) -> List:
         return [0, self.pubkey, self.created_at, self.kind, self.tags, self.content]
 
     def serialize_json(self) -> str:
-        e = self.serialize()
-        return json.dumps(e, separators=(",", ":"), ensure_ascii=False)
+        return _canonical_json(self.serialize()).decode()
 
     @property
     def event_id(self) -> str:
-        data = self.serialize_json()
-        id = hashlib.sha256(data.encode()).hexdigest()
-        return id
+        if self._event_id is None:
+            data = _canonical_json(self.serialize())
+            self._event_id = hashlib.sha256(data).hexdigest()
+        return self._event_id
 
     def check_signature(self):
         event_id = self.event_id
@@ -47,11 +128,34 @@ class NostrEvent(BaseModel):
         if not valid_signature:
             raise ValueError(f"Invalid signature: '{self.sig}' for event '{self.id}'")
 
+    def dict(self) -> dict:
+        return {
+            "id": self.id,
+            "pubkey": self.pubkey,
+            "created_at": self.created_at,
+            "kind": self.kind,
+            "tags": self.tags,
+            "content": self.content,
+            "sig": self.sig,
+        }
+
     def stringify(self) -> str:
-        return json.dumps(dict(self))
+        return json.dumps(self.dict())
 
     def tag_values(self, tag_name: str) -> List[str]:
-        return [t[1] for t in self.tags if t[0] == tag_name]
+        if self._tag_index is None:
+            index: Dict[str, List[str]] = {}
+            for tag in self.tags:
+                if len(tag) > 1:
+                    index.setdefault(tag[0], []).append(tag[1])
+            self._tag_index = index
+        return self._tag_index.get(tag_name, [])
 
     def has_tag_value(self, tag_name: str, tag_value: str) -> bool:
         return tag_value in self.tag_values(tag_name)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, NostrEvent) and self.dict() == other.dict()
+
+    def __repr__(self) -> str:
+        return f"NostrEvent(id={self.id!r}, kind={self.kind}, pubkey={self.pubkey!r})"
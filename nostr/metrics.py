@@ -0,0 +1,192 @@
+import functools
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import (
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+# seconds, from sub-millisecond to the ~minute range of a relay backfill
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Histogram:
+    """Fixed-bucket histogram. Observing a value does not allocate."""
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    @property
+    def average(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the `q` quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                if index < len(self.buckets):
+                    return self.buckets[index]
+                break
+        return float("inf")
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "average": self.average,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+
+class StageTimings:
+    """One histogram per named processing stage."""
+
+    def __init__(self):
+        self.stages: Dict[str, Histogram] = {}
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram = self.stages.get(stage)
+            if not histogram:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(time.perf_counter() - start)
+
+    def timed(self, stage: str) -> Callable:
+        """Decorator timing every call of a coroutine function."""
+
+        def decorator(fn: Callable) -> Callable:
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with self.time(stage):
+                    return await fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def stats(self) -> dict:
+        return {stage: h.stats() for stage, h in self.stages.items()}
+
+
+class Counter:
+    """
+    Monotonic counters keyed by the value of a single label. Any hashable
+    label value works (e.g. event kinds), it is formatted when rendered.
+    """
+
+    def __init__(self):
+        self.values: Dict[Hashable, int] = {}
+
+    def inc(self, label: Hashable = "", amount: int = 1):
+        self.values[label] = self.values.get(label, 0) + amount
+
+
+Samples = Union[float, Dict[Hashable, float]]
+
+
+class PrometheusText:
+    """Builds a Prometheus text exposition (format version 0.0.4)."""
+
+    def __init__(self, prefix: str = "nostrchat_"):
+        self.prefix = prefix
+        self.lines: List[str] = []
+
+    def counter(self, name: str, help_: str, samples: Samples, label: str = ""):
+        self._samples(f"{name}_total", "counter", help_, samples, label)
+
+    def gauge(self, name: str, help_: str, samples: Samples, label: str = ""):
+        self._samples(name, "gauge", help_, samples, label)
+
+    def histogram(
+        self,
+        name: str,
+        help_: str,
+        histograms: Union[Histogram, Dict[str, Histogram]],
+        label: str = "",
+    ):
+        name = self.prefix + name
+        self._header(name, "histogram", help_)
+        if isinstance(histograms, Histogram):
+            histograms = {"": histograms}
+        for label_value, histogram in histograms.items():
+            labels = _labels(label, label_value)
+            cumulative = 0
+            for bucket, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                bucket_labels = _labels(label, label_value, str(bucket))
+                self.lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = _labels(label, label_value, "+Inf")
+            self.lines.append(f"{name}_bucket{bucket_labels} {histogram.count}")
+            self.lines.append(f"{name}_sum{labels} {histogram.sum}")
+            self.lines.append(f"{name}_count{labels} {histogram.count}")
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+    def _samples(
+        self, name: str, type_: str, help_: str, samples: Samples, label: str
+    ):
+        name = self.prefix + name
+        self._header(name, type_, help_)
+        if not isinstance(samples, dict):
+            self.lines.append(f"{name} {samples}")
+            return
+        for label_value, value in samples.items():
+            self.lines.append(f"{name}{_labels(label, label_value)} {value}")
+
+    def _header(self, name: str, type_: str, help_: str):
+        self.lines.append(f"# HELP {name} {help_}")
+        self.lines.append(f"# TYPE {name} {type_}")
+
+
+def _labels(label: str, value: Hashable, le: Optional[str] = None) -> str:
+    pairs = []
+    if label:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        escaped = escaped.replace("\n", "\\n")
+        pairs.append(f'{label}="{escaped}"')
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
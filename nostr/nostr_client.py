@@ -1,66 +1,265 @@
 import asyncio
 import json
+import random
+import time
 from asyncio import Queue
-from threading import Thread
-from typing import List, Optional
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from loguru import logger
-from websocket import WebSocketApp
+from websockets.client import WebSocketClientProtocol, connect
 
 from lnbits.settings import settings
 from lnbits.helpers import encrypt_internal_message, urlsafe_short_hash
 
 from .event import NostrEvent
+from .metrics import Histogram
+from .profile_scheduler import ProfileFetchScheduler
+from .receive_queue import OverloadPolicy, ReceiveQueue, RelayFrame
+from .subscriptions import Subscription, SubscriptionRegistry
+
+
+@dataclass
+class SubscriptionShard:
+    """A fixed-size bucket of nostracct public keys sharing one subscription."""
+
+    subscription_id: str
+    public_keys: List[str] = field(default_factory=list)
+    dm_time: int = 0
+    profile_time: int = 0
+
+
+@dataclass
+class PublishReceipt:
+    """Tracks a published event: written to the websocket, then OK'ed by a relay."""
+
+    event_id: str
+    written: asyncio.Future
+    # resolves to `(accepted, message)` from the first relay `OK` frame
+    ok: asyncio.Future
+    published_at: float = field(default_factory=time.perf_counter)
+
+    async def wait_ok(
+        self, timeout: Optional[float] = None
+    ) -> Optional[Tuple[bool, str]]:
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.ok), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Backoff:
+    """Exponential backoff with full jitter."""
+
+    def __init__(self, initial: float = 0.5, maximum: float = 60, factor: float = 2):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempts = 0
+
+    def next(self) -> float:
+        delay = min(self.maximum, self.initial * self.factor**self.attempts)
+        self.attempts += 1
+        return random.uniform(delay / 2, delay)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class SendQueue(Queue):
+    """
+    FIFO of the frames to send. Unsent frames go back at the head, in order.
+    Keeps count of the queued EVENT frames per event id.
+    """
+
+    def _init(self, maxsize: int):
+        super()._init(maxsize)
+        self._requeueing = False
+        self._event_ids: Dict[str, int] = {}
+
+    def _put(self, item):
+        if item[0] == "EVENT":
+            event_id = item[1]["id"]
+            self._event_ids[event_id] = self._event_ids.get(event_id, 0) + 1
+        if self._requeueing:
+            self._queue.appendleft(item)
+        else:
+            self._queue.append(item)
+
+    def _get(self):
+        item = self._queue.popleft()
+        if item[0] == "EVENT":
+            event_id = item[1]["id"]
+            count = self._event_ids.pop(event_id) - 1
+            if count:
+                self._event_ids[event_id] = count
+        return item
+
+    def has_event(self, event_id: str) -> bool:
+        return event_id in self._event_ids
+
+    def requeue(self, items: List):
+        self._requeueing = True
+        try:
+            for item in reversed(items):
+                self.put_nowait(item)
+        finally:
+            self._requeueing = False
 
 
 class NostrClient:
-    def __init__(self):
-        self.recieve_event_queue: Queue = Queue()
-        self.send_req_queue: Queue = Queue()
-        self.ws: Optional[WebSocketApp] = None
-        self.subscription_id = "nostrchat-" + urlsafe_short_hash()[:32]
+    def __init__(
+        self,
+        shard_size: int = 200,
+        send_batch_size: int = 100,
+        receive_queue_size: int = 10_000,
+        overload_policy: OverloadPolicy = OverloadPolicy.PAUSE,
+        spill_dir: Optional[str] = None,
+        relay_url: Optional[str] = None,
+    ):
+        # defaults to the 'nostrclient' extension relay endpoint
+        self.relay_url = relay_url
+        self.recieve_event_queue = ReceiveQueue(
+            receive_queue_size, overload_policy, spill_dir
+        )
+        self.send_req_queue = SendQueue()
+        self.ws: Optional[WebSocketClientProtocol] = None
+        # many relays reject or truncate filters with more than a few hundred keys
+        self.shard_size = shard_size
+        self.shards: List[SubscriptionShard] = []
         self.running = False
+        self.send_batch_size = send_batch_size
+        # relay frame arrival -> `process_nostr_message` completion
+        self.frame_latency = Histogram()
+        self.subscriptions = SubscriptionRegistry()
+        self.profile_scheduler = ProfileFetchScheduler(self)
+        self._receive_task: Optional[asyncio.Task] = None
+        # event id -> receipt, until the relay OK (or `ok_timeout`)
+        self._receipts: Dict[str, PublishReceipt] = {}
+        self.ok_timeout = 60
+        # `publish_nostr_event` -> relay `OK`, the end-to-end send latency
+        self.ok_latency = Histogram()
+
+        self.connected = asyncio.Event()
+        self.reconnects = 0
+        # seconds from `run_forever` start to the first open websocket
+        self.startup_time: Optional[float] = None
 
     @property
     def is_websocket_connected(self):
         if not self.ws:
             return False
-        return self.ws.keep_running
-
-    async def connect_to_nostrclient_ws(self) -> WebSocketApp:
-        logger.debug(f"Connecting to websockets for 'nostrclient' extension...")
-
-        relay_endpoint = encrypt_internal_message("relay", urlsafe=True)
-        on_open, on_message, on_error, on_close = self._ws_handlers()
-        ws = WebSocketApp(
-            f"ws://localhost:{settings.port}/nostrclient/api/v1/{relay_endpoint}",
-            on_message=on_message,
-            on_open=on_open,
-            on_close=on_close,
-            on_error=on_error,
-        )
+        return self.ws.open
 
-        wst = Thread(target=ws.run_forever)
-        wst.daemon = True
-        wst.start()
+    async def connect_to_nostrclient_ws(self) -> WebSocketClientProtocol:
+        logger.debug("Connecting to websockets for 'nostrclient' extension...")
 
+        relay_url = self.relay_url
+        if not relay_url:
+            relay_endpoint = encrypt_internal_message("relay", urlsafe=True)
+            relay_url = (
+                f"ws://localhost:{settings.port}/nostrclient/api/v1/{relay_endpoint}"
+            )
+        ws = await connect(relay_url, max_size=None)
+        logger.info("Connected to 'nostrclient' websocket")
+
+        self._receive_task = asyncio.create_task(self._receive_frames(ws))
         return ws
 
     async def run_forever(self):
         self.running = True
+        started_at = time.monotonic()
+        backoff = Backoff()
         while self.running:
-            try:
-                if not self.is_websocket_connected:
+            if not self.is_websocket_connected:
+                try:
+                    # also the readiness probe for the 'nostrclient' extension
                     self.ws = await self.connect_to_nostrclient_ws()
-                    # be sure the connection is open
-                    await asyncio.sleep(5)
-
-                req = await self.send_req_queue.get()
-                assert self.ws
-                self.ws.send(json.dumps(req))
+                except Exception as ex:
+                    delay = backoff.next()
+                    logger.debug(
+                        f"'nostrclient' not ready ({ex}). Retry in {delay:.1f}s"
+                    )
+                    await asyncio.sleep(delay)
+                    continue
+
+                backoff.reset()
+                if self.startup_time is None:
+                    self.startup_time = time.monotonic() - started_at
+                    logger.info(f"NostrClient ready in {self.startup_time:.2f} sec")
+                else:
+                    self.reconnects += 1
+                self.connected.set()
+
+            reqs = [await self.send_req_queue.get()]
+            while len(reqs) < self.send_batch_size and not self.send_req_queue.empty():
+                reqs.append(self.send_req_queue.get_nowait())
+            try:
+                await self._send_frames(reqs)
             except Exception as ex:
-                logger.warning(ex)
-                await asyncio.sleep(60)
+                delay = backoff.next()
+                logger.warning(
+                    f"Cannot send to 'nostrclient' ({ex}). Retry in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+    async def wait_until_connected(self, timeout: Optional[float] = None) -> bool:
+        try:
+            await asyncio.wait_for(self.connected.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _send_frames(self, reqs: List):
+        assert self.ws, "Websocket not connected"
+        # frames are written back to back, the transport flushes them together
+        for index, req in enumerate(reqs):
+            try:
+                await self.ws.send(json.dumps(req))
+                if req[0] == "EVENT":
+                    self._event_written(req[1]["id"])
+            except Exception:
+                # keep the unsent requests for the next connection, ahead of
+                # anything queued since
+                self.send_req_queue.requeue(reqs[index:])
+                raise
+
+    async def _receive_frames(self, ws: WebSocketClientProtocol):
+        try:
+            async for message in ws:
+                if isinstance(message, bytes):
+                    message = message.decode()
+                # with the `pause` policy this blocks, and so does the socket
+                await self.recieve_event_queue.put(RelayFrame.received(message))
+        except Exception as ex:
+            logger.warning(ex)
+        finally:
+            logger.warning(
+                f"Websocket closed: '{ws.close_code}' '{ws.close_reason}'"
+            )
+            self._connection_closed("Websocket close.")
+
+    def _connection_closed(self, reason: str):
+        """Drop the subscriptions of the closed connection, queued once per close."""
+        self.connected.clear()
+        # subscriptions do not survive the connection
+        self.subscriptions.clear("websocket closed")
+        # force re-subscribe
+        self.recieve_event_queue.put_nowait(ValueError(reason))
+
+    def queue_stats(self) -> dict:
+        return {
+            "recieve_event_queue": self.recieve_event_queue.stats(),
+            "send_req_queue": {"depth": self.send_req_queue.qsize()},
+            "pending_acks": len(self._receipts),
+            "ok_latency": self.ok_latency.stats(),
+        }
+
+    def observe_frames_processed(self, frames: Iterable[str]):
+        now = time.perf_counter()
+        for frame in frames:
+            if isinstance(frame, RelayFrame):
+                self.frame_latency.observe(now - frame.received_at)
 
     async def get_event(self):
         value = await self.recieve_event_queue.get()
@@ -68,30 +267,215 @@ class NostrClient:
             raise value
         return value
 
-    async def publish_nostr_event(self, e: NostrEvent):
-        await self.send_req_queue.put(["EVENT", e.dict()])
+    async def get_events(self, max_count: int = 500) -> List[str]:
+        """
+        Wait for at least one event, then drain whatever else is already queued
+        (up to `max_count`) so the consumer can process relay backfills in batches.
+        """
+        events = [await self.get_event()]
+        while len(events) < max_count and not self.recieve_event_queue.empty():
+            value = self.recieve_event_queue.get_nowait()
+            if isinstance(value, ValueError):
+                # deliver what we have, raise on the next call
+                self.recieve_event_queue.put_nowait(value)
+                break
+            events.append(value)
+        return events
+
+    async def publish_nostr_event(self, e: NostrEvent) -> PublishReceipt:
+        """
+        Queue an event for publishing. The receipt resolves `written` once the
+        EVENT frame is on the 'nostrclient' websocket and `ok` on the relay `OK`.
+        """
+        receipt = self._receipts.get(e.id)
+        if not receipt or receipt.written.done():
+            loop = asyncio.get_running_loop()
+            receipt = PublishReceipt(e.id, loop.create_future(), loop.create_future())
+            self._receipts[e.id] = receipt
+        # a retry while the previous frame is still waiting would send it twice
+        if not self.send_req_queue.has_event(e.id):
+            await self.send_req_queue.put(["EVENT", e.dict()])
+        return receipt
+
+    async def handle_ok(self, event_id: str, accepted: bool, message: str):
+        receipt = self._receipts.pop(event_id, None)
+        if not receipt:
+            return
+        self.ok_latency.observe(time.perf_counter() - receipt.published_at)
+        if not receipt.written.done():
+            receipt.written.set_result(True)
+        if not receipt.ok.done():
+            receipt.ok.set_result((accepted, message))
+
+    def _event_written(self, event_id: str):
+        receipt = self._receipts.get(event_id)
+        if not receipt or receipt.written.done():
+            return
+        receipt.written.set_result(True)
+        asyncio.get_running_loop().call_later(
+            self.ok_timeout, self._expire_receipt, receipt
+        )
+
+    def _expire_receipt(self, receipt: PublishReceipt):
+        if self._receipts.get(receipt.event_id) is receipt:
+            del self._receipts[receipt.event_id]
+        if not receipt.ok.done():
+            receipt.ok.cancel()
+
+    async def subscribe(
+        self,
+        subscription_id: str,
+        filters: List[dict],
+        one_shot: bool = False,
+        public_keys: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Subscription:
+        """
+        Send a REQ and track it in the registry. One-shot subscriptions are
+        closed as soon as the relays send EOSE, or after `timeout` seconds.
+        """
+        subscription = self.subscriptions.add(
+            Subscription(
+                id=subscription_id,
+                filters=filters,
+                one_shot=one_shot,
+                public_keys=public_keys or [],
+            )
+        )
+        await self.send_req_queue.put(["REQ", subscription_id, *filters])
+
+        if one_shot and timeout:
+            asyncio.get_running_loop().call_later(
+                timeout,
+                lambda: asyncio.create_task(
+                    self._close_if_backfilling(subscription, timeout)
+                ),
+            )
+        return subscription
+
+    async def _close_if_backfilling(self, subscription: Subscription, timeout: float):
+        if self.subscriptions.get(subscription.id) is subscription:
+            logger.debug(f"No EOSE after {timeout} sec for '{subscription.id}'")
+            await self.unsubscribe(subscription.id)
+
+    async def wait_for_backfill(
+        self, subscription_id: str, timeout: Optional[float] = None
+    ) -> bool:
+        """Wait for the EOSE of a subscription. False if it closed or timed out."""
+        subscription = self.subscriptions.get(subscription_id)
+        if not subscription:
+            return False
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(subscription.backfill_complete), timeout
+            )
+        except asyncio.TimeoutError:
+            return False
+
+    async def handle_event(self, subscription_id: str):
+        self.subscriptions.on_event(subscription_id)
+
+    async def handle_eose(self, subscription_id: str):
+        subscription = self.subscriptions.on_eose(subscription_id)
+        if subscription and subscription.one_shot:
+            await self.unsubscribe(subscription_id)
+
+    async def handle_closed(self, subscription_id: str, reason: str):
+        subscription = self.subscriptions.on_closed(subscription_id, reason)
+        if subscription:
+            logger.warning(f"Subscription '{subscription_id}' closed: {reason}")
+
+    def is_backfilling(self, public_key: str) -> bool:
+        return self.subscriptions.is_backfilling(public_key)
+
+    def is_live(self, public_key: str) -> bool:
+        return self.subscriptions.is_live(public_key)
 
     async def subscribe_nostraccts(
         self,
         public_keys: List[str],
         dm_time=0,
         profile_time=0,
+        cursors: Optional[Dict[str, Tuple[int, int]]] = None,
     ):
-        dm_filters = self._filters_for_direct_messages(public_keys, dm_time)
-        profile_filters = self._filters_for_user_profile(public_keys, profile_time)
+        """
+        Subscribe to all nostraccts. `cursors` maps a public key to its own
+        `(dm_time, profile_time)` resume point, a shard resumes from the oldest
+        cursor of its keys. Keys are sorted by cursor so that quiet accounts
+        share shards and do not drag busy ones back in time.
+        """
+        await self.unsubscribe_nostraccts()
 
-        nostracct_filters = (
-            dm_filters + profile_filters
-        )
+        cursors = cursors or {}
+        default = (dm_time, profile_time)
+        public_keys = sorted(public_keys, key=lambda pk: cursors.get(pk, default))
+        for i in range(0, len(public_keys), self.shard_size):
+            shard_keys = public_keys[i : i + self.shard_size]
+            shard = SubscriptionShard(
+                subscription_id="nostrchat-" + urlsafe_short_hash()[:32],
+                public_keys=shard_keys,
+                dm_time=min(cursors.get(pk, default)[0] for pk in shard_keys),
+                profile_time=min(cursors.get(pk, default)[1] for pk in shard_keys),
+            )
+            self.shards.append(shard)
+            await self._subscribe_shard(shard)
 
-        self.subscription_id = "nostrchat-" + urlsafe_short_hash()[:32]
-        await self.send_req_queue.put(["REQ", self.subscription_id] + nostracct_filters)
+        logger.debug(
+            f"Subscribing to events for: {len(public_keys)} keys "
+            f"in {len(self.shards)} shard(s)."
+        )
 
+    async def subscribe_nostracct(self, public_key: str, dm_time=0, profile_time=0):
+        """Add one key to the first shard with room, only that shard is re-issued."""
+        if self._shard_for(public_key):
+            return
+        shard = next(
+            (s for s in self.shards if len(s.public_keys) < self.shard_size), None
+        )
+        if not shard:
+            shard = SubscriptionShard(
+                subscription_id="nostrchat-" + urlsafe_short_hash()[:32],
+                dm_time=dm_time,
+                profile_time=profile_time,
+            )
+            self.shards.append(shard)
+        shard.dm_time = min(shard.dm_time, dm_time)
+        shard.profile_time = min(shard.profile_time, profile_time)
+        shard.public_keys.append(public_key)
+        await self._subscribe_shard(shard)
+
+    async def unsubscribe_nostracct(self, public_key: str):
+        """Remove one key from its shard, only that shard is re-issued (or closed)."""
+        shard = self._shard_for(public_key)
+        if not shard:
+            return
+        shard.public_keys.remove(public_key)
+        if len(shard.public_keys) == 0:
+            self.shards.remove(shard)
+            await self.unsubscribe(shard.subscription_id)
+        else:
+            await self._subscribe_shard(shard)
+
+    def _shard_for(self, public_key: str) -> Optional[SubscriptionShard]:
+        return next((s for s in self.shards if public_key in s.public_keys), None)
+
+    async def _subscribe_shard(self, shard: SubscriptionShard):
+        # a REQ with an existing subscription id replaces its filters
+        dm_filters = self._filters_for_direct_messages(shard.public_keys, shard.dm_time)
+        profile_filters = self._filters_for_user_profile(
+            shard.public_keys, shard.profile_time
+        )
+        await self.subscribe(
+            shard.subscription_id,
+            dm_filters + profile_filters,
+            public_keys=list(shard.public_keys),
+        )
         logger.debug(
-            f"Subscribing to events for: {len(public_keys)} keys. New subscription id: {self.subscription_id}"
+            f"Subscribing to events for: {len(shard.public_keys)} keys. "
+            f"Subscription id: {shard.subscription_id}"
         )
 
-    async def nostracct_temp_subscription(self, pk, duration=10):
+    async def nostracct_temp_subscription(self, pk, timeout=120) -> Subscription:
         dm_filters = self._filters_for_direct_messages([pk], 0)
         profile_filters = self._filters_for_user_profile([pk], 0)
 
@@ -101,30 +485,19 @@ class NostrClient:
 
         subscription_id = "nostracct-" + urlsafe_short_hash()[:32]
         logger.debug(
-            f"New nostracct temp subscription ({duration} sec). Subscription id: {subscription_id}"
+            f"New nostracct temp subscription. Subscription id: {subscription_id}"
+        )
+        return await self.subscribe(
+            subscription_id,
+            nostracct_filters,
+            one_shot=True,
+            public_keys=[pk],
+            timeout=timeout,
         )
-        await self.send_req_queue.put(["REQ", subscription_id] + nostracct_filters)
-
-        async def unsubscribe_with_delay(sub_id, d):
-            await asyncio.sleep(d)
-            await self.unsubscribe(sub_id)
-
-        asyncio.create_task(unsubscribe_with_delay(subscription_id, duration))
 
-    async def user_profile_temp_subscribe(self, public_key: str, duration=5):
+    async def user_profile_temp_subscribe(self, public_key: str):
         try:
-            profile_filter = [{"kinds": [0], "authors": [public_key]}]
-            subscription_id = "profile-" + urlsafe_short_hash()[:32]
-            logger.debug(
-                f"New user temp subscription ({duration} sec). Subscription id: {subscription_id}"
-            )
-            await self.send_req_queue.put(["REQ", subscription_id] + profile_filter)
-
-            async def unsubscribe_with_delay(sub_id, d):
-                await asyncio.sleep(d)
-                await self.unsubscribe(sub_id)
-
-            asyncio.create_task(unsubscribe_with_delay(subscription_id, duration))
+            self.profile_scheduler.request(public_key)
         except Exception as ex:
             logger.debug(ex)
 
@@ -144,56 +517,55 @@ class NostrClient:
 
         return [profile_filter]
 
-    def _safe_ws_stop(self):
+    async def _safe_ws_stop(self, reason: Optional[str] = None):
+        if self._receive_task and not self._receive_task.done():
+            # its `finally` reports the close
+            self._receive_task.cancel()
+        elif reason:
+            # already closed, still force the re-subscribe
+            self._connection_closed(reason)
+        self._receive_task = None
         if not self.ws:
             return
         try:
-            self.ws.close()
-        except:
+            await self.ws.close()
+        except Exception:
             pass
         self.ws = None
 
-    def _ws_handlers(self):
-        def on_open(_):
-            logger.info("Connected to 'nostrclient' websocket")
-
-        def on_message(_, message):
-            self.recieve_event_queue.put_nowait(message)
-
-        def on_error(_, error):
-            logger.warning(error)
-
-        def on_close(x, status_code, message):
-            logger.warning(f"Websocket closed: {x}: '{status_code}' '{message}'")
-            # force re-subscribe
-            self.recieve_event_queue.put_nowait(ValueError("Websocket close."))
-
-        return on_open, on_message, on_error, on_close
+    async def _wait_send_queue_drained(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while not self.send_req_queue.empty() and time.monotonic() < deadline:
+            if not self.is_websocket_connected:
+                return
+            await asyncio.sleep(0.1)
 
     async def restart(self):
         await self.unsubscribe_nostraccts()
         # Give some time for the CLOSE events to propagate before restarting
-        await asyncio.sleep(10)
+        await self._wait_send_queue_drained(10)
 
         logger.info("Restarting NostrClient...")
-        await self.recieve_event_queue.put(ValueError("Restarting NostrClient..."))
-
-        self._safe_ws_stop()
+        await self._safe_ws_stop("Restarting NostrClient...")
 
     async def stop(self):
         await self.unsubscribe_nostraccts()
         self.running = False
 
         # Give some time for the CLOSE events to propagate before closing the connection
-        await asyncio.sleep(10)
-        self._safe_ws_stop()
+        await self._wait_send_queue_drained(10)
+        await self._safe_ws_stop()
 
     async def unsubscribe_nostraccts(self):
-        await self.send_req_queue.put(["CLOSE", self.subscription_id])
+        shards, self.shards = self.shards, []
+        for shard in shards:
+            self.subscriptions.on_closed(shard.subscription_id, "unsubscribed")
+            await self.send_req_queue.put(["CLOSE", shard.subscription_id])
         logger.debug(
-            f"Unsubscribed from all nostraccts events. Subscription id: {self.subscription_id}"
+            f"Unsubscribed from all nostraccts events ({len(shards)} shard(s))."
         )
 
     async def unsubscribe(self, subscription_id):
+        self.subscriptions.on_closed(subscription_id, "unsubscribed")
         await self.send_req_queue.put(["CLOSE", subscription_id])
         logger.debug(f"Unsubscribed from subscription id: {subscription_id}")
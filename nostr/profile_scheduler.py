@@ -0,0 +1,96 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+
+from lnbits.helpers import urlsafe_short_hash
+from loguru import logger
+
+if TYPE_CHECKING:
+    from .nostr_client import NostrClient
+
+
+class ProfileFetchScheduler:
+    """
+    Coalesces profile (kind 0) lookups: public keys requested within `window`
+    seconds are fetched with a single one-shot REQ, keys already in flight or
+    fetched in the last `ttl` seconds are skipped. The client closes each REQ on
+    EOSE (or after `timeout` seconds if the relays never send one).
+    """
+
+    def __init__(
+        self,
+        client: "NostrClient",
+        window: float = 0.25,
+        max_authors: int = 200,
+        timeout: float = 10,
+        ttl: float = 600,
+        max_recent: int = 50_000,
+    ):
+        self.client = client
+        self.window = window
+        self.max_authors = max_authors
+        self.timeout = timeout
+        self.ttl = ttl
+        self.max_recent = max_recent
+
+        self._pending: Set[str] = set()
+        self._in_flight: Dict[str, List[str]] = {}
+        self._in_flight_keys: Set[str] = set()
+        self._recent: OrderedDict[str, float] = OrderedDict()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def request(self, public_key: str):
+        if public_key in self._pending or public_key in self._in_flight_keys:
+            return
+        fetched_at = self._recent.get(public_key)
+        if fetched_at and time.monotonic() - fetched_at < self.ttl:
+            return
+
+        self._pending.add(public_key)
+        if not self._flush_handle:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(
+                self.window, lambda: asyncio.create_task(self.flush())
+            )
+
+    async def flush(self):
+        self._flush_handle = None
+        public_keys, self._pending = list(self._pending), set()
+
+        for i in range(0, len(public_keys), self.max_authors):
+            authors = public_keys[i : i + self.max_authors]
+            subscription_id = "profile-" + urlsafe_short_hash()[:32]
+            self._in_flight[subscription_id] = authors
+            self._in_flight_keys.update(authors)
+
+            subscription = await self.client.subscribe(
+                subscription_id,
+                [{"kinds": [0], "authors": authors}],
+                one_shot=True,
+                timeout=self.timeout,
+            )
+            # the client closes the REQ on EOSE, we only keep the books
+            subscription.backfill_complete.add_done_callback(
+                lambda done, sub_id=subscription_id: self._fetched(sub_id, done)
+            )
+            logger.debug(
+                f"New profile subscription for {len(authors)} keys. "
+                f"Subscription id: {subscription_id}"
+            )
+
+    def _fetched(self, subscription_id: str, backfill_complete: asyncio.Future):
+        authors = self._in_flight.pop(subscription_id, None)
+        if authors is None:
+            return
+        self._in_flight_keys.difference_update(authors)
+        # closed or timed out before EOSE, the next request fetches them again
+        if backfill_complete.cancelled() or not backfill_complete.result():
+            return
+
+        now = time.monotonic()
+        for public_key in authors:
+            self._recent[public_key] = now
+            self._recent.move_to_end(public_key)
+        while len(self._recent) > self.max_recent:
+            self._recent.popitem(last=False)
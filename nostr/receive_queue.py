@@ -0,0 +1,192 @@
+import asyncio
+import json
+import re
+import tempfile
+import time
+from collections import deque
+from enum import Enum
+from typing import IO, Any, Deque, Optional
+
+# cheap checks on the raw frame, no JSON parsing on the hot path
+_EVENT_FRAME = re.compile(r'^\s*\[\s*"EVENT"')
+_DM_EVENT = re.compile(r'"kind"\s*:\s*4\b')
+
+
+class RelayFrame(str):
+    """A raw relay frame, stamped with the time it was read from the websocket."""
+
+    received_at: float = 0.0
+
+    @classmethod
+    def received(cls, data: str, received_at: Optional[float] = None) -> "RelayFrame":
+        frame = cls(data)
+        frame.received_at = received_at or time.perf_counter()
+        return frame
+
+
+class OverloadPolicy(str, Enum):
+    # stop reading from the socket, the relay connection applies backpressure
+    PAUSE = "pause"
+    # drop the oldest events that are not DMs (profiles), pause if none left
+    DROP_OLDEST = "drop_oldest"
+    # write overflowing frames to a temporary file and read them back later
+    SPILL = "spill"
+
+
+class ReceiveQueue:
+    """
+    Bounded FIFO for relay frames with a configurable overload policy.
+    Control items (the `ValueError` used to force a re-subscribe) are never
+    dropped, spilled or blocked on.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10_000,
+        policy: OverloadPolicy = OverloadPolicy.PAUSE,
+        spill_dir: Optional[str] = None,
+    ):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.spill_dir = spill_dir
+
+        self.queued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.paused = 0
+        self.peak_depth = 0
+
+        self._items: Deque[Any] = deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+
+        self._spill_file: Optional[IO[bytes]] = None
+        self._spill_read_pos = 0
+        self._spill_pending = 0
+
+    def qsize(self) -> int:
+        return len(self._items) + self._spill_pending
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def full(self) -> bool:
+        return len(self._items) >= self.maxsize
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.qsize(),
+            "maxsize": self.maxsize,
+            "policy": self.policy.value,
+            "queued": self.queued,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "paused": self.paused,
+            "peak_depth": self.peak_depth,
+        }
+
+    async def put(self, item: Any):
+        if not isinstance(item, str):
+            self._append(item)
+            return
+
+        if self.policy == OverloadPolicy.SPILL:
+            if self._spill_pending or self.full():
+                self._spill(item)
+            else:
+                self._append(item)
+            self.queued += 1
+            return
+
+        if self.full() and self.policy == OverloadPolicy.DROP_OLDEST:
+            self._drop_oldest_non_dm()
+
+        if self.full():
+            self.paused += 1
+        while self.full():
+            self._not_full.clear()
+            await self._not_full.wait()
+
+        self._append(item)
+        self.queued += 1
+
+    def put_nowait(self, item: Any):
+        if not isinstance(item, str):
+            self._append(item)
+            return
+        if self.policy == OverloadPolicy.SPILL:
+            if self._spill_pending or self.full():
+                self._spill(item)
+            else:
+                self._append(item)
+            self.queued += 1
+            return
+        if self.full() and self.policy == OverloadPolicy.DROP_OLDEST:
+            self._drop_oldest_non_dm()
+        if self.full():
+            raise asyncio.QueueFull()
+        self._append(item)
+        self.queued += 1
+
+    async def get(self) -> Any:
+        while self.empty():
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self.get_nowait()
+
+    def get_nowait(self) -> Any:
+        if not self._items and self._spill_pending:
+            self._unspill(max(self.maxsize // 2, 1))
+        if not self._items:
+            raise asyncio.QueueEmpty()
+
+        item = self._items.popleft()
+        if not self.full():
+            self._not_full.set()
+        return item
+
+    def _append(self, item: Any):
+        self._items.append(item)
+        self.peak_depth = max(self.peak_depth, self.qsize())
+        self._not_empty.set()
+
+    def _drop_oldest_non_dm(self) -> bool:
+        # linear scan, but only while overloaded
+        for index, item in enumerate(self._items):
+            if (
+                isinstance(item, str)
+                and _EVENT_FRAME.match(item)
+                and not _DM_EVENT.search(item)
+            ):
+                del self._items[index]
+                self.dropped += 1
+                return True
+        return False
+
+    def _spill(self, item: str):
+        if not self._spill_file:
+            self._spill_file = tempfile.TemporaryFile(
+                prefix="nostrchat-spill-", dir=self.spill_dir
+            )
+        received_at = item.received_at if isinstance(item, RelayFrame) else 0.0
+        self._spill_file.seek(0, 2)
+        self._spill_file.write(json.dumps([received_at, item]).encode() + b"\n")
+        self._spill_pending += 1
+        self.spilled += 1
+        self.peak_depth = max(self.peak_depth, self.qsize())
+        self._not_empty.set()
+
+    def _unspill(self, count: int):
+        assert self._spill_file
+        self._spill_file.seek(self._spill_read_pos)
+        for _ in range(min(count, self._spill_pending)):
+            received_at, frame = json.loads(self._spill_file.readline())
+            self._items.append(RelayFrame.received(frame, received_at))
+            self._spill_pending -= 1
+        self._spill_read_pos = self._spill_file.tell()
+
+        if not self._spill_pending:
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+            self._spill_read_pos = 0
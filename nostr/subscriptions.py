@@ -0,0 +1,111 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Dict, List, Optional
+
+
+class SubscriptionState(str, Enum):
+    # REQ sent, stored events are still coming in
+    BACKFILLING = "backfilling"
+    # EOSE received, only new events from now on
+    LIVE = "live"
+    # closed by us (CLOSE) or by the relay (CLOSED)
+    CLOSED = "closed"
+
+
+@dataclass
+class Subscription:
+    id: str
+    filters: List[dict]
+    one_shot: bool = False
+    public_keys: List[str] = field(default_factory=list)
+    state: SubscriptionState = SubscriptionState.BACKFILLING
+    event_count: int = 0
+    created_at: float = field(default_factory=time.time)
+    eose_at: Optional[float] = None
+    closed_reason: Optional[str] = None
+    # resolves to True on EOSE, False if closed before EOSE
+    backfill_complete: asyncio.Future = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+
+    def dict(self) -> dict:
+        return {
+            "id": self.id,
+            "state": self.state.value,
+            "one_shot": self.one_shot,
+            "public_keys": len(self.public_keys),
+            "event_count": self.event_count,
+            "created_at": round(self.created_at),
+            "eose_at": round(self.eose_at) if self.eose_at else None,
+            "closed_reason": self.closed_reason,
+        }
+
+
+class SubscriptionRegistry:
+    """State of every subscription id sent to the relays."""
+
+    def __init__(self):
+        self._subscriptions: Dict[str, Subscription] = {}
+
+    def add(self, subscription: Subscription) -> Subscription:
+        # a REQ with an existing id replaces the previous subscription
+        previous = self._subscriptions.get(subscription.id)
+        if previous:
+            self._close(previous, "replaced")
+        self._subscriptions[subscription.id] = subscription
+        return subscription
+
+    def get(self, subscription_id: str) -> Optional[Subscription]:
+        return self._subscriptions.get(subscription_id)
+
+    def on_event(self, subscription_id: str):
+        subscription = self._subscriptions.get(subscription_id)
+        if subscription:
+            subscription.event_count += 1
+
+    def on_eose(self, subscription_id: str) -> Optional[Subscription]:
+        subscription = self._subscriptions.get(subscription_id)
+        if not subscription or subscription.state != SubscriptionState.BACKFILLING:
+            return None
+        subscription.state = SubscriptionState.LIVE
+        subscription.eose_at = time.time()
+        if not subscription.backfill_complete.done():
+            subscription.backfill_complete.set_result(True)
+        return subscription
+
+    def on_closed(self, subscription_id: str, reason: str) -> Optional[Subscription]:
+        subscription = self._subscriptions.pop(subscription_id, None)
+        if subscription:
+            self._close(subscription, reason)
+        return subscription
+
+    def clear(self, reason: str):
+        for subscription in list(self._subscriptions.values()):
+            self._close(subscription, reason)
+        self._subscriptions.clear()
+
+    def live(self) -> List[Subscription]:
+        return list(self._subscriptions.values())
+
+    def is_backfilling(self, public_key: str) -> bool:
+        return any(
+            s.state == SubscriptionState.BACKFILLING and public_key in s.public_keys
+            for s in self._subscriptions.values()
+        )
+
+    def is_live(self, public_key: str) -> bool:
+        """True once a subscription of the key got its EOSE and none backfills."""
+        states = {
+            s.state for s in self._subscriptions.values() if public_key in s.public_keys
+        }
+        return SubscriptionState.LIVE in states and (
+            SubscriptionState.BACKFILLING not in states
+        )
+
+    def _close(self, subscription: Subscription, reason: str):
+        subscription.state = SubscriptionState.CLOSED
+        subscription.closed_reason = reason
+        if not subscription.backfill_complete.done():
+            subscription.backfill_complete.set_result(False)
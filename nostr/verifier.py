@@ -0,0 +1,128 @@
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor
+from enum import Enum
+from typing import List, Optional, Tuple
+
+from .event import NostrEvent
+from .metrics import Histogram
+
+
+class VerificationMode(str, Enum):
+    OFF = "off"
+    # only kind 0, a forged profile overwrites the peer metadata
+    PROFILES = "profiles"
+    ALL = "all"
+
+
+class SignatureVerifier:
+    """
+    Checks event ids and schnorr signatures before events are processed.
+    Batches of at least `batch_min_size` events are split across the executor
+    workers (libsecp256k1 releases the GIL), smaller ones are checked inline.
+    Verified `(id, sig)` pairs are cached, relays re-send the same profiles on
+    every re-subscribe. A cache hit still needs the id to match the content.
+    """
+
+    def __init__(
+        self,
+        mode: VerificationMode = VerificationMode.PROFILES,
+        executor: Optional[Executor] = None,
+        workers: int = 2,
+        batch_min_size: int = 16,
+        cache_size: int = 100_000,
+    ):
+        self.mode = mode
+        self.executor = executor
+        self.workers = workers
+        self.batch_min_size = batch_min_size
+        self.cache_size = cache_size
+
+        self.verified = 0
+        self.rejected = 0
+        self.cache_hits = 0
+        # wall time per verified batch
+        self.batch_latency = Histogram()
+        self._cache: OrderedDict[Tuple[str, Optional[str]], None] = OrderedDict()
+
+    def needs_verification(self, event: NostrEvent) -> bool:
+        if self.mode == VerificationMode.ALL:
+            return True
+        return self.mode == VerificationMode.PROFILES and event.kind == 0
+
+    def remember(self, event: NostrEvent):
+        key = (event.id, event.sig)
+        self._cache[key] = None
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def verify(self, events: List[NostrEvent]) -> List[NostrEvent]:
+        """Return the events that are valid or do not need verification."""
+        to_check: List[NostrEvent] = []
+        for event in events:
+            if not self.needs_verification(event):
+                continue
+            key = (event.id, event.sig)
+            # hashing is cheap, the signature is what the cache saves
+            if key in self._cache and event.event_id == event.id:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                continue
+            to_check.append(event)
+        if not to_check:
+            return events
+
+        start = time.perf_counter()
+        if self.executor and len(to_check) >= self.batch_min_size:
+            loop = asyncio.get_running_loop()
+            chunk_size = -(-len(to_check) // self.workers)
+            chunks = [
+                to_check[i : i + chunk_size]
+                for i in range(0, len(to_check), chunk_size)
+            ]
+            results = await asyncio.gather(
+                *[
+                    loop.run_in_executor(self.executor, _check_signatures, chunk)
+                    for chunk in chunks
+                ]
+            )
+            valid = [ok for chunk_results in results for ok in chunk_results]
+        else:
+            valid = _check_signatures(to_check)
+        self.batch_latency.observe(time.perf_counter() - start)
+
+        # by identity, a forged copy must not take the genuine event with it
+        invalid = set()
+        for event, ok in zip(to_check, valid):
+            if ok:
+                self.remember(event)
+                self.verified += 1
+            else:
+                invalid.add(id(event))
+                self.rejected += 1
+        if not invalid:
+            return events
+        return [e for e in events if id(e) not in invalid]
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode.value,
+            "verified": self.verified,
+            "rejected": self.rejected,
+            "cache_hits": self.cache_hits,
+            "cached": len(self._cache),
+            "batch_latency": self.batch_latency.stats(),
+        }
+
+
+def _check_signatures(events: List[NostrEvent]) -> List[bool]:
+    results = []
+    for event in events:
+        try:
+            event.check_signature()
+            results.append(True)
+        except Exception:
+            results.append(False)
+    return results
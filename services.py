@@ -1,6 +1,8 @@
 import asyncio
 import json
-from typing import List, Optional, Tuple
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 from lnbits.bolt11 import decode
 from lnbits.core.crud import get_wallet
@@ -9,25 +11,77 @@ from loguru import logger
 
 from . import nostr_client
 from .crud import (
+    MESSAGE_COLUMNS,
     PeerProfile,
-    create_peer,
-    create_direct_message,
-    get_peer,
-    get_last_direct_messages_created_at,
-    get_nostracct_by_pubkey,
+    archive_direct_messages,
+    compress_direct_messages,
+    db_timings,
+    get_direct_messages_older_than,
+    get_direct_messages_page,
+    get_direct_messages_over_peer_limit,
+    get_archived_direct_messages_page,
+    get_direct_messages_event_ids,
+    get_existing_event_ids,
+    get_due_outbox_events,
+    get_indexed_nostracct,
+    get_outbox_event,
+    get_next_outbox_attempt_at,
+    get_nostraccts,
     get_nostraccts_ids_with_pubkeys,
-    increment_peer_unread_messages,
+    get_peers_page,
+    get_sync_cursors,
+    get_uncompressed_direct_messages,
+    import_archived_direct_messages,
+    import_direct_messages,
+    import_peers,
+    reschedule_outbox_event,
+    store_direct_messages,
+    update_direct_messages_delivery_status,
+    update_outbox_events_status,
     update_peer_profile,
+    update_sync_cursors,
 )
+from .helpers import decrypt_messages, shared_secrets
 from .models import (
-    Peer,
+    DeliveryStatus,
     DirectMessage,
     DirectMessageType,
     NostrAcct,
     Nostrable,
+    OutboxEvent,
     PartialDirectMessage,
+    Peer,
+)
+from .nostr.dedup import BloomFilter, EventIdFilter
+from .nostr.event import NostrEvent, json_loads
+from .nostr.metrics import Counter, PrometheusText, StageTimings
+from .nostr.verifier import SignatureVerifier, VerificationMode
+
+# jobs smaller than this are decrypted inline, the thread hop is not worth it
+DECRYPT_BATCH_MIN_SIZE = 16
+# large groups are split so a single busy peer still keeps every worker busy
+DECRYPT_JOB_MAX_SIZE = 256
+decrypt_executor = ThreadPoolExecutor(
+    max_workers=2, thread_name_prefix="nostrchat-decrypt"
+)
+# drops relay duplicates and replays before they are parsed, routed and decrypted
+event_id_filter = EventIdFilter(recent_size=100_000, bloom=BloomFilter(1_000_000))
+# forged profiles overwrite peer metadata, verify those by default
+signature_verifier = SignatureVerifier(
+    mode=VerificationMode.PROFILES,
+    executor=ThreadPoolExecutor(max_workers=2, thread_name_prefix="nostrchat-verify"),
+    workers=2,
 )
-from .nostr.event import NostrEvent
+# time spent per stage of `process_nostr_messages`
+stage_timings = StageTimings()
+# relay frames by type, events by kind, undecryptable NIP-04 events
+frames_received = Counter()
+events_received = Counter()
+decrypt_failures = Counter()
+# messages moved to the archive by the retention job, by nostracct
+messages_archived = Counter()
+_FRAME_TYPES = {"EVENT", "EOSE", "CLOSED", "OK", "NOTICE", "AUTH"}
+
 
 async def update_nostracct_to_nostr(
     nostracct: NostrAcct, delete_nostracct=False
@@ -104,64 +158,205 @@ async def sign_and_send_to_nostr(
 
 
 async def process_nostr_message(msg: str):
-    try:
-        type_, *rest = json.loads(msg)
+    await process_nostr_messages([msg])
+
+
+async def process_nostr_messages(msgs: List[str]):
+    events: List[dict] = []
+    maybe_seen: List[str] = []
+    backfills_completed = 0
+    with stage_timings.time("parse"):
+        for msg in msgs:
+            try:
+                type_, *rest = json_loads(msg)
+                frames_received.inc(type_ if type_ in _FRAME_TYPES else "other")
 
-        if type_.upper() == "EVENT":
-            _, event = rest
-            event = NostrEvent(**event)
+                if type_.upper() == "EVENT":
+                    subscription_id, event = rest
+                    await nostr_client.handle_event(subscription_id)
+                    event_id = event.get("id")
+                    if event_id:
+                        if event_id_filter.is_recent(event_id):
+                            event_id_filter.duplicates += 1
+                            continue
+                        if event_id_filter.maybe_seen(event_id):
+                            maybe_seen.append(event_id)
+                        event_id_filter.remember(event_id)
+                    events.append(event)
+                elif type_.upper() == "EOSE":
+                    await nostr_client.handle_eose(rest[0])
+                    backfills_completed += 1
+                elif type_.upper() == "CLOSED":
+                    reason = rest[1] if len(rest) > 1 else ""
+                    await nostr_client.handle_closed(rest[0], reason)
+                elif type_.upper() == "OK":
+                    event_id, accepted, *message = rest
+                    await _handle_relay_ok(
+                        event_id, bool(accepted), message[0] if message else ""
+                    )
+                elif type_.upper() == "NOTICE":
+                    logger.info(f"Relay notice: {rest[0] if rest else ''}")
+
+            except Exception as ex:
+                logger.debug(ex)
+
+    with stage_timings.time("dedup"):
+        # Bloom filter hits can be false positives, confirm them in one query
+        stored = await get_existing_event_ids(maybe_seen) if maybe_seen else set()
+        event_id_filter.duplicates += len(stored)
+
+    nostr_events: List[NostrEvent] = []
+    for event in events:
+        try:
+            if event.get("id") in stored:
+                continue
+            nostr_events.append(NostrEvent.from_dict(event))
+        except Exception as ex:
+            logger.debug(ex)
+
+    with stage_timings.time("verify"):
+        valid_events = await signature_verifier.verify(nostr_events)
+    if len(valid_events) != len(nostr_events):
+        valid_ids = {e.id for e in valid_events}
+        for event in nostr_events:
+            if event.id not in valid_ids:
+                # let the genuine event through if it shows up later
+                event_id_filter.forget(event.id)
+                logger.debug(f"Dropped event with invalid signature: '{event.id}'")
+
+    nip04_events: List[NostrEvent] = []
+    with stage_timings.time("profiles"):
+        for event in valid_events:
+            events_received.inc(event.kind)
             if event.kind == 0:
                 await _handle_peer_profile_update(event)
             elif event.kind == 4:
-                await _handle_nip04_message(event)
-            return
+                nip04_events.append(event)
 
+    if len(nip04_events) != 0:
+        with stage_timings.time("dms"):
+            await _handle_nip04_messages(nip04_events)
+
+    try:
+        if backfills_completed:
+            # the backfilled messages are stored first, then the cursors can move
+            await dm_writer.flush()
+        await resume_cursors.save()
     except Exception as ex:
-        logger.debug(ex)
+        logger.warning(f"Cannot save the resume cursors: {ex}")
 
-async def _handle_nip04_message(event: NostrEvent):
+
+async def seed_event_id_filter(page_size: int = 10_000):
+    after = ""
+    while True:
+        event_ids = await get_direct_messages_event_ids(after, page_size)
+        event_id_filter.seed(event_ids)
+        if len(event_ids) < page_size:
+            break
+        after = event_ids[-1]
+    logger.debug(f"Event id filter seeded with {event_id_filter.stats()}")
+
+
+async def _handle_nip04_messages(events: List[NostrEvent]):
+    """
+    Decrypt a batch of NIP04 events. Events are grouped by (nostracct, peer) so
+    the shared secret is derived once per group. Large groups (relay backfills)
+    are decrypted on worker threads, all submitted at once, to keep the event
+    loop free.
+    """
+    routed: List[Tuple[NostrEvent, NostrAcct, str]] = []
+    for event in events:
+        try:
+            nostracct, peer_public_key = await _route_nip04_message(event)
+            routed.append((event, nostracct, peer_public_key))
+        except Exception as ex:
+            logger.debug(ex)
+
+    groups: Dict[Tuple[str, str], List[int]] = {}
+    for index, (_, nostracct, peer_public_key) in enumerate(routed):
+        groups.setdefault((nostracct.id, peer_public_key), []).append(index)
+
+    clear_text_msgs: List[Optional[str]] = [None] * len(routed)
+    loop = asyncio.get_running_loop()
+    jobs: List[List[int]] = []
+    futures: List[asyncio.Future] = []
+    for indexes in groups.values():
+        _, nostracct, peer_public_key = routed[indexes[0]]
+        try:
+            encryption_key = nostracct.shared_secret(peer_public_key)
+        except Exception as ex:
+            logger.warning(f"Cannot derive shared secret for '{peer_public_key}': {ex}")
+            continue
+        for start in range(0, len(indexes), DECRYPT_JOB_MAX_SIZE):
+            job = indexes[start : start + DECRYPT_JOB_MAX_SIZE]
+            contents = [routed[i][0].content for i in job]
+            if len(job) < DECRYPT_BATCH_MIN_SIZE:
+                decrypted = decrypt_messages(contents, encryption_key)
+                for i, clear_text_msg in zip(job, decrypted):
+                    clear_text_msgs[i] = clear_text_msg
+                continue
+            jobs.append(job)
+            futures.append(
+                loop.run_in_executor(
+                    decrypt_executor, decrypt_messages, contents, encryption_key
+                )
+            )
+
+    # all thread jobs are submitted before awaiting, so the workers run together
+    for job, decrypted in zip(jobs, await asyncio.gather(*futures)):
+        for i, clear_text_msg in zip(job, decrypted):
+            clear_text_msgs[i] = clear_text_msg
+
+    for (event, nostracct, _), clear_text_msg in zip(routed, clear_text_msgs):
+        if clear_text_msg is None:
+            logger.warning(f"Cannot decrypt NIP04 event: '{event.id}'")
+            decrypt_failures.inc("nip04")
+            continue
+        try:
+            if event.pubkey == nostracct.public_key:
+                await _handle_outgoing_dms(event, nostracct, clear_text_msg)
+            else:
+                await _handle_incoming_dms(event, nostracct, clear_text_msg)
+        except Exception as ex:
+            logger.debug(ex)
+
+
+async def _route_nip04_message(event: NostrEvent) -> Tuple[NostrAcct, str]:
+    """Find the nostracct owning a NIP04 event and the public key of the peer."""
     nostracct_public_key = event.pubkey
-    nostracct = await get_nostracct_by_pubkey(nostracct_public_key)
+    nostracct = await get_indexed_nostracct(nostracct_public_key)
 
     if not nostracct:
         p_tags = event.tag_values("p")
         if len(p_tags) and p_tags[0]:
             nostracct_public_key = p_tags[0]
-            nostracct = await get_nostracct_by_pubkey(nostracct_public_key)
+            nostracct = await get_indexed_nostracct(nostracct_public_key)
 
     assert nostracct, f"Nostr Account not found for public key '{nostracct_public_key}'"
 
     if event.pubkey == nostracct_public_key:
         assert len(event.tag_values("p")) != 0, "Outgong message has no 'p' tag"
-        clear_text_msg = nostracct.decrypt_message(
-            event.content, event.tag_values("p")[0]
-        )
-        await _handle_outgoing_dms(event, nostracct, clear_text_msg)
-    elif event.has_tag_value("p", nostracct_public_key):
-        clear_text_msg = nostracct.decrypt_message(event.content, event.pubkey)
-        await _handle_incoming_dms(event, nostracct, clear_text_msg)
-    else:
-        logger.warning(f"Bad NIP04 event: '{event.id}'")
+        return nostracct, event.tag_values("p")[0]
+    if event.has_tag_value("p", nostracct_public_key):
+        return nostracct, event.pubkey
+
+    raise ValueError(f"Bad NIP04 event: '{event.id}'")
 
 
 async def _handle_incoming_dms(
     event: NostrEvent, nostracct: NostrAcct, clear_text_msg: str
 ):
-    peer = await get_peer(nostracct.id, event.pubkey)
-    if not peer:
-        await _handle_new_peer(event, nostracct)
-    else:
-        await increment_peer_unread_messages(nostracct.id, event.pubkey)
-
-    dm_type, json_data = PartialDirectMessage.parse_message(clear_text_msg)
-    new_dm = await _persist_dm(
-        nostracct.id,
-        dm_type.value,
-        event.pubkey,
-        event.id,
-        event.created_at,
-        clear_text_msg,
+    dm_type, _ = PartialDirectMessage.parse_message(clear_text_msg)
+    dm = PartialDirectMessage(
+        event_id=event.id,
+        event_created_at=event.created_at,
+        message=clear_text_msg,
+        public_key=event.pubkey,
+        incoming=True,
+        type=dm_type.value,
     )
+    await dm_writer.add(nostracct, dm)
+
 
 async def _handle_outgoing_dms(
     event: NostrEvent, nostracct: NostrAcct, clear_text_msg: str
@@ -176,61 +371,301 @@ async def _handle_outgoing_dms(
             public_key=sent_to[0],
             type=type_.value,
         )
-        await create_direct_message(nostracct.id, dm)
-
-async def _persist_dm(
-    nostracct_id: str,
-    dm_type: int,
-    from_pubkey: str,
-    event_id: str,
-    event_created_at: int,
-    msg: str,
-) -> DirectMessage:
-    dm = PartialDirectMessage(
-        event_id=event_id,
-        event_created_at=event_created_at,
-        message=msg,
-        public_key=from_pubkey,
-        incoming=True,
-        type=dm_type,
+        await dm_writer.add(nostracct, dm)
+
+
+class ResumeCursors:
+    """
+    Resume points (`since`) of the relay subscriptions, per nostracct and event
+    kind. An event moves the cursor once it is stored, and the cursor is only
+    saved once the backfill of the nostracct is complete: relays send stored
+    events newest first, an interrupted backfill has to start over.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple[str, int], int] = {}
+        self._public_keys: Dict[str, str] = {}
+
+    def observe(self, nostracct: NostrAcct, kind: int, created_at: Optional[int]):
+        # senders pick `created_at`, never resume from the future
+        since = min(created_at or 0, int(time.time()))
+        key = (nostracct.id, kind)
+        self._pending[key] = max(self._pending.get(key, 0), since)
+        self._public_keys[nostracct.id] = nostracct.public_key
+
+    async def save(self):
+        ready = {
+            key: since
+            for key, since in self._pending.items()
+            if nostr_client.is_live(self._public_keys[key[0]])
+        }
+        if len(ready) == 0:
+            return
+        await update_sync_cursors(ready)
+        for key, since in ready.items():
+            # unless moved again while saving
+            if self._pending.get(key) == since:
+                del self._pending[key]
+
+
+resume_cursors = ResumeCursors()
+
+
+class DirectMessageWriter:
+    """
+    Micro-batching writer for DMs received from the relays. Messages are
+    accumulated for up to `flush_window` seconds (or `max_batch_size` messages)
+    and then stored with a few multi-row statements instead of several queries
+    per message.
+    """
+
+    def __init__(
+        self,
+        flush_window: float = 0.05,
+        max_batch_size: int = 500,
+        retry_delay: float = 1,
+        max_retries: int = 3,
+    ):
+        self.flush_window = flush_window
+        self.max_batch_size = max_batch_size
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self._pending: List[Tuple[NostrAcct, PartialDirectMessage]] = []
+        self._failures = 0
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def add(self, nostracct: NostrAcct, dm: PartialDirectMessage):
+        self._pending.append((nostracct, dm))
+        if len(self._pending) >= self.max_batch_size and not self._failures:
+            await self.flush()
+        else:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if not self._flush_task or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        while len(self._pending) != 0:
+            delay = self.retry_delay if self._failures else self.flush_window
+            await asyncio.sleep(delay)
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            if len(batch) == 0:
+                return
+            try:
+                created, new_peers = await store_direct_messages(
+                    [(nostracct.id, dm) for nostracct, dm in batch]
+                )
+                self._failures = 0
+            except Exception as ex:
+                self._failures += 1
+                if self._failures <= self.max_retries:
+                    logger.warning(
+                        f"Cannot store {len(batch)} direct messages, retrying: {ex}"
+                    )
+                    # ahead of the messages received in the meantime
+                    self._pending[:0] = batch
+                    self._schedule_flush()
+                    return
+                logger.warning(f"Dropped {len(batch)} direct messages: {ex}")
+                self._failures = 0
+                # their ids were remembered on arrival, accept relay resends
+                for _, dm in batch:
+                    if dm.event_id:
+                        event_id_filter.forget(dm.event_id)
+                return
+
+            # duplicates included, they are stored too
+            for nostracct, dm in batch:
+                resume_cursors.observe(nostracct, 4, dm.event_created_at)
+            try:
+                await resume_cursors.save()
+            except Exception as ex:
+                logger.warning(f"Cannot save the resume cursors: {ex}")
+
+        for _, public_key in new_peers:
+            await nostr_client.user_profile_temp_subscribe(public_key)
+
+        for nostracct_id, dm in created:
+            if not dm.incoming:
+                continue
+            await websocket_updater(
+                nostracct_id,
+                json.dumps(
+                    {
+                        "type": f"dm:{dm.type}",
+                        "peerPubkey": dm.public_key,
+                        "dm": dm.dict(),
+                    }
+                ),
+            )
+
+
+dm_writer = DirectMessageWriter()
+
+
+class OutboxSender:
+    """
+    Publishes the signed events stored in the outbox. New events are sent as
+    soon as `notify` is called; events that could not be written to the
+    'nostrclient' websocket are retried with exponential backoff, across
+    restarts, until `max_attempts` is reached.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 100,
+        send_timeout: float = 10,
+        max_attempts: int = 20,
+        max_retry_delay: int = 3600,
+    ):
+        self.batch_size = batch_size
+        self.send_timeout = send_timeout
+        self.max_attempts = max_attempts
+        self.max_retry_delay = max_retry_delay
+        self._wakeup = asyncio.Event()
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                await self._wait_for_work()
+                while await self.send_due_events() == self.batch_size:
+                    pass
+            except Exception as ex:
+                logger.warning(f"Outbox sender failed: {ex}")
+                await asyncio.sleep(5)
+
+    async def _wait_for_work(self):
+        next_attempt_at = await get_next_outbox_attempt_at()
+        timeout = (
+            max(0, next_attempt_at - time.time()) if next_attempt_at else None
+        )
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def send_due_events(self) -> int:
+        outbox_events = await get_due_outbox_events(self.batch_size)
+        if len(outbox_events) == 0:
+            return 0
+
+        nostr_events = [e.nostr_event() for e in outbox_events]
+        for event in nostr_events:
+            # signed here, the relay echo does not need to be verified
+            signature_verifier.remember(event)
+        receipts = [await nostr_client.publish_nostr_event(e) for e in nostr_events]
+        # shielded, a timeout must not cancel the receipt shared with a retry
+        writes = [
+            asyncio.wait_for(asyncio.shield(r.written), self.send_timeout)
+            for r in receipts
+        ]
+        results = await asyncio.gather(*writes, return_exceptions=True)
+
+        sent = [e.id for e, r in zip(outbox_events, results) if r is True]
+        # an `OK` can be processed before this update, do not downgrade it
+        pending = DeliveryStatus.PENDING
+        await update_outbox_events_status(
+            sent, DeliveryStatus.SENT, only_status=pending
+        )
+        await update_direct_messages_delivery_status(
+            sent, DeliveryStatus.SENT, only_status=pending
+        )
+        for outbox_event, receipt, result in zip(outbox_events, receipts, results):
+            if result is True and not receipt.ok.done():
+                await _push_delivery_status(outbox_event, DeliveryStatus.SENT)
+
+        for outbox_event, result in zip(outbox_events, results):
+            if result is not True:
+                await self._retry_later(outbox_event, repr(result))
+        return len(outbox_events)
+
+    async def _retry_later(self, outbox_event: OutboxEvent, error: str):
+        attempts = outbox_event.attempts + 1
+        if attempts >= self.max_attempts:
+            logger.warning(f"Giving up on publishing event '{outbox_event.id}'")
+            await update_outbox_events_status(
+                [outbox_event.id], DeliveryStatus.FAILED, error
+            )
+            await update_direct_messages_delivery_status(
+                [outbox_event.id], DeliveryStatus.FAILED
+            )
+            await _push_delivery_status(outbox_event, DeliveryStatus.FAILED)
+            return
+        delay = min(self.max_retry_delay, 2**attempts)
+        await reschedule_outbox_event(
+            outbox_event.id, attempts, int(time.time()) + delay, error
+        )
+
+
+async def _handle_relay_ok(event_id: str, accepted: bool, message: str):
+    await nostr_client.handle_ok(event_id, accepted, message)
+
+    outbox_event = await get_outbox_event(event_id)
+    # not ours, or already accepted by another relay
+    if not outbox_event or outbox_event.status == DeliveryStatus.ACCEPTED:
+        return
+
+    # NIP-20: a relay that already has the event still has it
+    accepted = accepted or message.startswith("duplicate:")
+    status = DeliveryStatus.ACCEPTED if accepted else DeliveryStatus.REJECTED
+    if not accepted:
+        logger.info(f"Relay rejected event '{event_id}': {message}")
+
+    await update_outbox_events_status(
+        [event_id], status, None if accepted else message
     )
-    new_dm = await create_direct_message(nostracct_id, dm)
+    await update_direct_messages_delivery_status([event_id], status)
+    await _push_delivery_status(outbox_event, status)
 
+
+async def _push_delivery_status(outbox_event: OutboxEvent, status: DeliveryStatus):
     await websocket_updater(
-        nostracct_id,
+        outbox_event.nostracct_id,
         json.dumps(
             {
-                "type": f"dm:{dm_type}",
-                "peerPubkey": from_pubkey,
-                "dm": new_dm.dict(),
+                "type": "dm:status",
+                "eventId": outbox_event.id,
+                "status": status.value,
             }
         ),
     )
-    return new_dm
 
-async def resubscribe_to_all_nostraccts():
-    await nostr_client.unsubscribe_nostraccts()
-    # give some time for the message to propagate
-    await asyncio.sleep(1)
-    await subscribe_to_all_nostraccts()
+
+outbox_sender = OutboxSender()
+
+
+async def subscribe_to_nostracct(public_key: str):
+    # a new nostracct has no cursor yet, its history is fetched by the
+    # `nostracct_temp_subscription`, the shard only needs to follow new events
+    now = int(time.time())
+    await nostr_client.subscribe_nostracct(public_key, now, now)
+
+
+async def unsubscribe_from_nostracct(public_key: str):
+    await nostr_client.unsubscribe_nostracct(public_key)
 
 
 async def subscribe_to_all_nostraccts():
     ids = await get_nostraccts_ids_with_pubkeys()
     public_keys = [pk for _, pk in ids]
 
-    last_dm_time = await get_last_direct_messages_created_at()
+    sync_cursors = await get_sync_cursors()
+    cursors = {
+        pk: (sync_cursors.get(id_, {}).get(4, 0), sync_cursors.get(id_, {}).get(0, 0))
+        for id_, pk in ids
+    }
 
-    await nostr_client.subscribe_nostraccts(
-        public_keys, last_dm_time, 0
-    )
-
-
-async def _handle_new_peer(event: NostrEvent, nostracct: NostrAcct):
-    await create_peer(
-        nostracct.id, Peer(nostracct_id=nostracct.id, public_key=event.pubkey)
-    )
-    await nostr_client.user_profile_temp_subscribe(event.pubkey)
+    await nostr_client.subscribe_nostraccts(public_keys, cursors=cursors)
 
 
 async def _handle_peer_profile_update(event: NostrEvent):
@@ -244,6 +679,311 @@ async def _handle_peer_profile_update(event: NostrEvent):
                 about=profile["about"] if "about" in profile else "",
             ),
         )
+
+        nostracct = await get_indexed_nostracct(event.pubkey)
+        if nostracct:
+            resume_cursors.observe(nostracct, 0, event.created_at)
     except Exception as ex:
         logger.warning(ex)
 
+
+async def enforce_retention(batch_size: int = 500, pause: float = 0.5) -> int:
+    """
+    Archive the messages of every nostracct that fall outside its retention
+    policy. Works in small batches of short statements (see
+    `archive_direct_messages` for why that is safe to interrupt) and yields
+    between them so relay events keep flowing while a backlog is moved.
+    Returns the number of messages archived.
+    """
+    archived = 0
+    for nostracct in await get_nostraccts():
+        policy = nostracct.config.retention
+        if not policy.enabled:
+            continue
+        while True:
+            messages = []
+            if policy.days:
+                created_before = int(time.time()) - policy.days * 86_400
+                messages = await get_direct_messages_older_than(
+                    nostracct.id, created_before, batch_size
+                )
+            if not messages and policy.messages_per_peer:
+                messages = await get_direct_messages_over_peer_limit(
+                    nostracct.id, policy.messages_per_peer, batch_size
+                )
+            if not messages:
+                break
+            count = await archive_direct_messages(nostracct.id, messages)
+            messages_archived.inc(nostracct.id, count)
+            archived += count
+            await asyncio.sleep(pause)
+    return archived
+
+
+async def compress_stored_messages(batch_size: int = 200, pause: float = 0.2) -> int:
+    """
+    Compress the large messages stored before compression was introduced, in
+    small batches. Returns the number of messages compressed.
+    """
+    compressed, after = 0, ""
+    while True:
+        messages = await get_uncompressed_direct_messages(after, batch_size)
+        if not messages:
+            return compressed
+        compressed += await compress_direct_messages(messages)
+        after = messages[-1].id
+        await asyncio.sleep(pause)
+
+
+EXPORT_FORMAT_VERSION = 1
+# longest NDJSON line accepted by the import, archive rows are the longest
+MAX_IMPORT_LINE_SIZE = 16 * 1024 * 1024
+
+
+def _ndjson(record: dict) -> bytes:
+    line = json.dumps(record, separators=(",", ":"), ensure_ascii=False)
+    return line.encode() + b"\n"
+
+
+async def export_nostracct_history(
+    nostracct: NostrAcct, include_events: bool = False, batch_size: int = 500
+) -> AsyncIterator[bytes]:
+    """
+    The peers, messages and archived messages of a nostracct as NDJSON, read in
+    keyset pages so memory use does not grow with the history. With
+    `include_events` the signed events of the messages sent from here are
+    included too (received messages are only stored decrypted).
+    """
+    yield _ndjson(
+        {
+            "type": "header",
+            "version": EXPORT_FORMAT_VERSION,
+            "public_key": nostracct.public_key,
+            "exported_at": int(time.time()),
+        }
+    )
+
+    after = ""
+    while True:
+        peers = await get_peers_page(nostracct.id, after, batch_size)
+        if not peers:
+            break
+        yield b"".join(
+            _ndjson({"type": "peer", "data": p.dict(exclude={"nostracct_id"})})
+            for p in peers
+        )
+        after = peers[-1].public_key
+
+    message_after: Optional[Tuple[str, int, str]] = None
+    while True:
+        page = await get_direct_messages_page(nostracct.id, message_after, batch_size)
+        if not page:
+            break
+        lines = []
+        for dm, signed_event in page:
+            record: dict = {
+                "type": "message",
+                "data": {column: getattr(dm, column) for column in MESSAGE_COLUMNS},
+            }
+            if include_events and signed_event:
+                record["event"] = json_loads(signed_event)
+            lines.append(_ndjson(record))
+        yield b"".join(lines)
+        last = page[-1][0]
+        message_after = (last.public_key, last.event_created_at or 0, last.id)
+
+    after = ""
+    while True:
+        rows = await get_archived_direct_messages_page(nostracct.id, after)
+        if not rows:
+            break
+        yield b"".join(_ndjson({"type": "archive", "data": row}) for row in rows)
+        after = rows[-1]["id"]
+
+
+async def _ndjson_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > MAX_IMPORT_LINE_SIZE:
+            raise ValueError("Import line too long")
+        for line in lines:
+            if line.strip():
+                yield json_loads(line)
+    if buffer.strip():
+        yield json_loads(buffer)
+
+
+async def import_nostracct_history(
+    nostracct: NostrAcct, chunks: AsyncIterator[bytes], batch_size: int = 500
+) -> Dict[str, int]:
+    """
+    Import an NDJSON export of the same nostracct, streamed as byte chunks.
+    Records are stored in batches of `batch_size`. The import is not atomic,
+    a failure leaves the batches before it stored, but it is resumable:
+    everything already stored is skipped, so it can simply be run again.
+    """
+    counts = {"peers": 0, "messages": 0, "messages_created": 0, "archived": 0}
+    peers: List[Peer] = []
+    messages: List[DirectMessage] = []
+    events: List[Tuple[NostrEvent, DeliveryStatus]] = []
+    archived: List[dict] = []
+
+    async def flush():
+        if peers:
+            await import_peers(nostracct.id, peers)
+            counts["peers"] += len(peers)
+        if messages:
+            created = await import_direct_messages(nostracct.id, messages, events)
+            counts["messages"] += len(messages)
+            counts["messages_created"] += created
+        if archived:
+            await import_archived_direct_messages(nostracct.id, archived)
+            counts["archived"] += len(archived)
+        peers.clear()
+        messages.clear()
+        events.clear()
+        archived.clear()
+
+    line = 0
+    async for record in _ndjson_records(chunks):
+        line += 1
+        try:
+            record_type = record.get("type")
+            if line == 1:
+                assert record_type == "header", "Missing export header"
+                assert (
+                    record.get("version") == EXPORT_FORMAT_VERSION
+                ), "Unsupported export version"
+                assert (
+                    record.get("public_key") == nostracct.public_key
+                ), "The export belongs to another nostracct"
+            elif record_type == "peer":
+                peers.append(Peer(**record["data"], nostracct_id=nostracct.id))
+            elif record_type == "message":
+                dm = DirectMessage(**record["data"])
+                messages.append(dm)
+                if record.get("event"):
+                    event = NostrEvent.from_dict(record["event"])
+                    assert event.id == dm.event_id, "Event does not match message"
+                    assert event.pubkey == nostracct.public_key, "Foreign event"
+                    status = dm.delivery_status or DeliveryStatus.SENT
+                    events.append((event, status))
+            elif record_type == "archive":
+                archived.append(record["data"])
+            else:
+                raise ValueError(f"Unknown record type: '{record_type}'")
+        except (AssertionError, AttributeError, KeyError, TypeError) as ex:
+            raise ValueError(f"Invalid record on line {line}: {ex}") from ex
+
+        if len(peers) + len(messages) + len(archived) >= batch_size:
+            await flush()
+    await flush()
+    return counts
+
+
+def render_metrics() -> str:
+    """Prometheus text exposition of the event pipeline, built on demand."""
+    metrics = PrometheusText()
+    metrics.counter(
+        "frames_received", "Relay frames by type.", frames_received.values, "type"
+    )
+    metrics.counter(
+        "events_received",
+        "Deduplicated events with a valid signature, by kind.",
+        events_received.values,
+        "kind",
+    )
+    metrics.counter(
+        "decrypt_failures",
+        "NIP-04 events that could not be decrypted.",
+        sum(decrypt_failures.values.values()),
+    )
+    metrics.counter(
+        "messages_archived",
+        "Messages moved to the archive by the retention job.",
+        sum(messages_archived.values.values()),
+    )
+    metrics.counter(
+        "duplicate_events", "Events dropped as duplicates.", event_id_filter.duplicates
+    )
+
+    receive_queue = nostr_client.recieve_event_queue
+    metrics.gauge("receive_queue_depth", "Frames waiting.", receive_queue.qsize())
+    metrics.gauge(
+        "receive_queue_peak_depth", "Highest queue depth.", receive_queue.peak_depth
+    )
+    metrics.counter(
+        "receive_queue_frames",
+        "Frames by what the overload policy did with them.",
+        {
+            "queued": receive_queue.queued,
+            "dropped": receive_queue.dropped,
+            "spilled": receive_queue.spilled,
+            "paused": receive_queue.paused,
+        },
+        "outcome",
+    )
+    metrics.gauge(
+        "send_queue_depth", "Requests waiting.", nostr_client.send_req_queue.qsize()
+    )
+
+    metrics.gauge(
+        "websocket_connected",
+        "1 if the 'nostrclient' websocket is open.",
+        int(bool(nostr_client.is_websocket_connected)),
+    )
+    metrics.counter(
+        "websocket_reconnects", "Websocket reconnections.", nostr_client.reconnects
+    )
+    if nostr_client.startup_time is not None:
+        metrics.gauge(
+            "startup_seconds",
+            "Seconds from start to the first open 'nostrclient' websocket.",
+            nostr_client.startup_time,
+        )
+    subscriptions: Dict[str, int] = {}
+    for subscription in nostr_client.subscriptions.live():
+        state = subscription.state.value
+        subscriptions[state] = subscriptions.get(state, 0) + 1
+    metrics.gauge("subscriptions", "Subscriptions by state.", subscriptions, "state")
+
+    metrics.counter(
+        "signatures",
+        "Signature checks by outcome.",
+        {
+            "verified": signature_verifier.verified,
+            "rejected": signature_verifier.rejected,
+            "cached": signature_verifier.cache_hits,
+        },
+        "outcome",
+    )
+    secrets_stats = shared_secrets.stats()
+    metrics.counter(
+        "shared_secret_lookups",
+        "ECDH shared secret cache lookups.",
+        {"hit": secrets_stats["hits"], "miss": secrets_stats["misses"]},
+        "result",
+    )
+
+    metrics.histogram(
+        "frame_latency_seconds",
+        "Relay frame received -> processed.",
+        nostr_client.frame_latency,
+    )
+    metrics.histogram(
+        "publish_ok_latency_seconds",
+        "Event published -> relay OK.",
+        nostr_client.ok_latency,
+    )
+    metrics.histogram(
+        "stage_seconds",
+        "Time per stage of a processed batch.",
+        stage_timings.stages,
+        "stage",
+    )
+    metrics.histogram(
+        "db_seconds", "Time per hot query call.", db_timings.stages, "function"
+    )
+    return metrics.render()
@@ -30,6 +30,9 @@ window.app.component('chatbox', {
       messages: [],
       newMessage: '',
       loading: false,
+      loadingOlder: false,
+      hasOlderMessages: false,
+      pageSize: 50,
       lastRefreshTime: 0
     }
   },
@@ -37,7 +40,10 @@ window.app.component('chatbox', {
   computed: {
     messagesAsJson() {
       return this.messages.map(m => {
-        const dateFrom = moment(m.event_created_at * 1000).fromNow()
+        let dateFrom = moment(m.event_created_at * 1000).fromNow()
+        if (!m.incoming && m.delivery_status) {
+          dateFrom = `${dateFrom} · ${m.delivery_status}`
+        }
         try {
           const message = JSON.parse(m.message)
           return {
@@ -74,10 +80,11 @@ window.app.component('chatbox', {
       try {
         const { data } = await LNbits.api.request(
           'GET',
-          '/nostrchat/api/v1/message/' + pubkey,
+          `/nostrchat/api/v1/message/${pubkey}?limit=${this.pageSize}`,
           this.inkey
         )
         this.messages = data
+        this.hasOlderMessages = data.length === this.pageSize
         this.$nextTick(() => {
           this.scrollToBottom()
         })
@@ -88,6 +95,46 @@ window.app.component('chatbox', {
       }
     },
 
+    async loadOlderMessages() {
+      if (!this.activePublicKey || !this.messages.length) return
+      if (this.loadingOlder || !this.hasOlderMessages) return
+
+      const pubkey = this.activePublicKey
+      const first = this.messages[0]
+      const before = `${first.event_created_at}:${first.id}`
+      this.loadingOlder = true
+      try {
+        const { data } = await LNbits.api.request(
+          'GET',
+          `/nostrchat/api/v1/message/${pubkey}?limit=${this.pageSize}&before=${before}`,
+          this.inkey
+        )
+        if (pubkey !== this.activePublicKey) return
+
+        const chatBox = this.$refs.chatBox
+        const previousHeight = chatBox ? chatBox.scrollHeight : 0
+        this.messages = data.concat(this.messages)
+        this.hasOlderMessages = data.length === this.pageSize
+        this.$nextTick(() => {
+          // keep the message the user was looking at in place
+          if (chatBox) {
+            chatBox.scrollTop += chatBox.scrollHeight - previousHeight
+          }
+        })
+      } catch (error) {
+        LNbits.utils.notifyApiError(error)
+      } finally {
+        this.loadingOlder = false
+      }
+    },
+
+    onScroll() {
+      const chatBox = this.$refs.chatBox
+      if (chatBox && chatBox.scrollTop < 50) {
+        this.loadOlderMessages()
+      }
+    },
+
     async sendDirectMessage() {
       if (!this.newMessage.trim()) return
 
@@ -133,6 +180,13 @@ window.app.component('chatbox', {
       }
     },
 
+    handleStatusUpdate(data) {
+      const message = this.messages.find(msg => msg.event_id === data.eventId)
+      if (message) {
+        message.delivery_status = data.status
+      }
+    },
+
     scrollToBottom() {
       const chatBox = this.$refs.chatBox
       if (chatBox) {
@@ -10,6 +10,10 @@ window.app.component('peers-list', {
     activePublicKey: {
       type: String,
       default: null
+    },
+    hasMore: {
+      type: Boolean,
+      default: false
     }
   },
 
@@ -26,6 +30,19 @@ window.app.component('peers-list', {
     
     getPeerAbout(peer) {
       return peer?.profile?.about || ''
+    },
+
+    getLastMessage(peer) {
+      if (!peer?.last_message) return this.getPeerAbout(peer)
+      return peer.last_message_incoming
+        ? peer.last_message
+        : `You: ${peer.last_message}`
+    },
+
+    getLastMessageTime(peer) {
+      return peer?.last_message_at
+        ? moment(peer.last_message_at * 1000).fromNow()
+        : ''
     }
   }
 }) 
\ No newline at end of file
@@ -23,6 +23,8 @@ window.app = Vue.createApp({
       windowHeight: window.innerHeight - 120,
       peerRefreshTimeout: null,
       peerRefreshInProgress: false,
+      peersPageSize: 100,
+      hasMorePeers: false,
       pendingMessages: []
     }
   },
@@ -214,6 +216,8 @@ window.app = Vue.createApp({
               console.log("Queueing message for later processing", parsedData)
               this.pendingMessages.push(parsedData)
             }
+          } else if (parsedData.type === 'dm:status' && this.$refs.chatBoxRef) {
+            this.$refs.chatBoxRef.handleStatusUpdate(parsedData)
           }
         })
       } catch (error) {
@@ -253,12 +257,38 @@ window.app = Vue.createApp({
 
       this.peerRefreshInProgress = true
       try {
+        // refresh every page loaded so far, most recent conversations first
+        const limit = Math.max(this.peersPageSize, this.peers.length)
         const { data } = await LNbits.api.request(
           'GET',
-          '/nostrchat/api/v1/peer',
+          `/nostrchat/api/v1/peer/summary?limit=${limit}`,
           this.g.user.wallets[0].inkey
         )
         this.peers = data
+        this.hasMorePeers = data.length === limit
+      } catch (error) {
+        LNbits.utils.notifyApiError(error)
+      } finally {
+        this.peerRefreshInProgress = false
+      }
+    },
+
+    async loadMorePeers() {
+      const last = this.peers[this.peers.length - 1]
+      if (!last || this.peerRefreshInProgress) return
+
+      this.peerRefreshInProgress = true
+      try {
+        const before = encodeURIComponent(
+          `${last.last_message_at}:${last.public_key}`
+        )
+        const { data } = await LNbits.api.request(
+          'GET',
+          `/nostrchat/api/v1/peer/summary?limit=${this.peersPageSize}&before=${before}`,
+          this.g.user.wallets[0].inkey
+        )
+        this.peers = this.peers.concat(data)
+        this.hasMorePeers = data.length === this.peersPageSize
       } catch (error) {
         LNbits.utils.notifyApiError(error)
       } finally {
@@ -4,21 +4,61 @@ from lnbits.core.models import Payment
 from lnbits.tasks import register_invoice_listener
 from loguru import logger
 
-from .nostr.nostr_client import NostrClient
+from .crud import load_nostracct_index
+from .nostr.nostr_client import Backoff, NostrClient
 from .services import (
-    process_nostr_message,
+    compress_stored_messages,
+    enforce_retention,
+    outbox_sender,
+    process_nostr_messages,
+    seed_event_id_filter,
     subscribe_to_all_nostraccts,
 )
 
 
 async def wait_for_nostr_events(nostr_client: NostrClient):
+    try:
+        await seed_event_id_filter()
+    except Exception as e:
+        logger.warning(f"Cannot seed the event id filter: {e}")
+
+    backoff = Backoff(initial=0.1, maximum=30)
     while True:
         try:
+            await load_nostracct_index()
+            # queued until the websocket is open, consuming starts right away
             await subscribe_to_all_nostraccts()
 
             while True:
-                message = await nostr_client.get_event()
-                await process_nostr_message(message)
+                messages = await nostr_client.get_events()
+                await process_nostr_messages(messages)
+                nostr_client.observe_frames_processed(messages)
+                backoff.reset()
         except Exception as e:
-            logger.warning(f"Subcription failed. Will retry in one minute: {e}")
-            await asyncio.sleep(10)
+            delay = backoff.next()
+            logger.warning(f"Subcription failed. Will retry in {delay:.1f} sec: {e}")
+            await asyncio.sleep(delay)
+
+
+async def send_outbox_events():
+    await outbox_sender.run()
+
+
+async def compress_old_messages():
+    try:
+        compressed = await compress_stored_messages()
+        if compressed:
+            logger.info(f"Compressed {compressed} stored direct messages.")
+    except Exception as ex:
+        logger.warning(f"Compressing stored messages failed: {ex}")
+
+
+async def run_retention_job(interval: int = 3600):
+    while True:
+        try:
+            archived = await enforce_retention()
+            if archived:
+                logger.info(f"Archived {archived} direct messages.")
+        except Exception as ex:
+            logger.warning(f"Retention job failed: {ex}")
+        await asyncio.sleep(interval)
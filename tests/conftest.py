@@ -0,0 +1,50 @@
+import importlib
+import os
+import sys
+import tempfile
+
+import pytest_asyncio
+
+EXT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# must happen before `lnbits.settings` is imported. SQLite by default, set
+# `NOSTRCHAT_TEST_DATABASE_URL` (postgres://...) to run against Postgres.
+if os.environ.get("NOSTRCHAT_TEST_DATABASE_URL"):
+    os.environ["LNBITS_DATABASE_URL"] = os.environ["NOSTRCHAT_TEST_DATABASE_URL"]
+else:
+    os.environ.pop("LNBITS_DATABASE_URL", None)
+os.environ["LNBITS_DATA_FOLDER"] = tempfile.mkdtemp(prefix="nostrchat-test-")
+
+# the extension is a package named after its directory, as in LNbits
+sys.path.insert(0, os.path.dirname(EXT_DIR))
+ext = importlib.import_module(os.path.basename(EXT_DIR))
+
+_migrated = False
+
+
+def ext_module(name: str):
+    return importlib.import_module(f"{ext.__name__}.{name}")
+
+
+@pytest_asyncio.fixture
+async def db():
+    global _migrated
+    if ext.db.type != "SQLITE":
+        # asyncpg connections are bound to the event loop of the test that
+        # opened them, every test runs on its own loop
+        engine = ext.db.engine.sync_engine
+        engine.pool = engine.pool.recreate()
+    if not _migrated:
+        if ext.db.type != "SQLITE":
+            # the test database is reused between runs, start from scratch
+            await ext.db.execute("DROP SCHEMA IF EXISTS nostrchat CASCADE")
+        migrations = ext_module("migrations")
+        steps = sorted(
+            (name, fn)
+            for name, fn in vars(migrations).items()
+            if name[:1] == "m" and name[1:4].isdigit() and callable(fn)
+        )
+        for _, step in steps:
+            await step(ext.db)
+        _migrated = True
+    return ext.db
@@ -0,0 +1,28 @@
+import pytest
+from conftest import ext_module
+
+crud = ext_module("crud")
+models = ext_module("models")
+
+
+@pytest.mark.asyncio
+async def test_only_the_timed_queries_are_recorded(db):
+    nostracct = await crud.create_nostracct(
+        "timings-user",
+        models.PartialNostrAcct(private_key="21" * 32, public_key="22" * 32),
+    )
+    crud.db_timings.stages.clear()
+    dm = models.PartialDirectMessage(
+        event_id="23" * 32,
+        event_created_at=1_700_000_000,
+        message="hello",
+        public_key="24" * 32,
+        incoming=True,
+    )
+
+    await crud.store_direct_messages([(nostracct.id, dm)])
+    await crud.get_indexed_nostracct(nostracct.public_key)
+
+    # the queries nested in the batch store are not counted on their own
+    assert set(crud.db_timings.stages) == {"store_direct_messages"}
+    assert crud.db_timings.stages["store_direct_messages"].count == 1
@@ -0,0 +1,59 @@
+import threading
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+from conftest import ext_module
+
+services = ext_module("services")
+helpers = ext_module("helpers")
+NostrEvent = ext_module("nostr.event").NostrEvent
+
+KEY = bytes(range(32))
+
+
+def _events(peer: str, count: int):
+    return [
+        NostrEvent(
+            pubkey=peer,
+            created_at=1_700_000_000 + n,
+            kind=4,
+            content=helpers.encrypt_message(f"{peer[:2]}-{n}", KEY),
+            id=f"{peer[:2]}{n:062x}",
+        )
+        for n in range(count)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_decrypt_jobs_run_on_the_workers_together(monkeypatch):
+    nostracct = SimpleNamespace(
+        id="acct", public_key="00" * 32, shared_secret=lambda _: KEY
+    )
+    size = services.DECRYPT_BATCH_MIN_SIZE
+    events = _events("aa" * 32, size) + _events("bb" * 32, size)
+    events += _events("cc" * 32, 1)
+
+    async def route(event):
+        return nostracct, event.pubkey
+
+    # fails if the two large groups are not decrypted at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    decrypt_messages = helpers.decrypt_messages
+
+    def decrypt_together(contents, key):
+        if len(contents) >= size:
+            barrier.wait()
+        return decrypt_messages(contents, key)
+
+    incoming = AsyncMock()
+    monkeypatch.setattr(services, "_route_nip04_message", route)
+    monkeypatch.setattr(services, "decrypt_messages", decrypt_together)
+    monkeypatch.setattr(services, "_handle_incoming_dms", incoming)
+
+    await services._handle_nip04_messages(events)
+
+    received = {call.args[0].id: call.args[2] for call in incoming.await_args_list}
+    assert len(received) == len(events)
+    for event in events:
+        assert received[event.id] == f"{event.pubkey[:2]}-{int(event.id[2:], 16)}"
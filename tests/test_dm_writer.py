@@ -0,0 +1,55 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+from conftest import ext_module
+
+models = ext_module("models")
+services = ext_module("services")
+
+NOSTRACCT = SimpleNamespace(id="acct", public_key="cd" * 32)
+
+
+def make_dm(i: int):
+    return models.PartialDirectMessage(
+        event_id=f"{i:064x}",
+        event_created_at=1_700_000_000 + i,
+        message=f"message {i}",
+        public_key="ab" * 32,
+        incoming=False,
+    )
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried(monkeypatch):
+    store = AsyncMock(side_effect=[RuntimeError("database is locked"), ([], [])])
+    monkeypatch.setattr(services, "store_direct_messages", store)
+    writer = services.DirectMessageWriter(flush_window=0.01, retry_delay=0.01)
+
+    await writer.add(NOSTRACCT, make_dm(1))
+    await writer.add(NOSTRACCT, make_dm(2))
+    await asyncio.sleep(0.1)
+
+    assert store.await_count == 2
+    assert [dm.event_id for _, dm in store.await_args.args[0]] == [
+        make_dm(1).event_id,
+        make_dm(2).event_id,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_dropped_batch_is_forgotten_by_the_event_id_filter(monkeypatch):
+    store = AsyncMock(side_effect=RuntimeError("database is gone"))
+    monkeypatch.setattr(services, "store_direct_messages", store)
+    writer = services.DirectMessageWriter(
+        flush_window=0.01, retry_delay=0.01, max_retries=2
+    )
+    dm = make_dm(3)
+    services.event_id_filter.remember(dm.event_id)
+
+    await writer.add(NOSTRACCT, dm)
+    await asyncio.sleep(0.2)
+
+    assert store.await_count == 3
+    assert not services.event_id_filter.is_recent(dm.event_id)
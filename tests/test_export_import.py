@@ -0,0 +1,79 @@
+import json
+from typing import AsyncIterator, List
+
+import pytest
+from conftest import ext_module
+
+crud = ext_module("crud")
+models = ext_module("models")
+services = ext_module("services")
+NostrEvent = ext_module("nostr.event").NostrEvent
+
+
+async def as_chunks(data: bytes, size: int = 100) -> AsyncIterator[bytes]:
+    for i in range(0, len(data), size):
+        yield data[i : i + size]
+
+
+async def count(db, table: str, nostracct_id: str) -> int:
+    row = await db.fetchone(
+        f"SELECT COUNT(*) AS c FROM nostrchat.{table} "
+        "WHERE nostracct_id = :nostracct_id",
+        {"nostracct_id": nostracct_id},
+    )
+    return row["c"]
+
+
+@pytest.mark.asyncio
+async def test_interrupted_import_can_be_run_again(db):
+    nostracct = await crud.create_nostracct(
+        "import-user",
+        models.PartialNostrAcct(private_key="11" * 32, public_key="12" * 32),
+    )
+    peer = "13" * 32
+    sent = NostrEvent(
+        pubkey=nostracct.public_key, created_at=1_700_000_100, kind=4, content="x"
+    )
+    sent.id = sent.event_id
+    dms = [
+        models.PartialDirectMessage(
+            event_id=sent.id if i == 0 else f"{i:064x}",
+            event_created_at=1_700_000_000 + i,
+            message=f"message {i}",
+            public_key=peer,
+            incoming=i != 0,
+        )
+        for i in range(20)
+    ]
+    await crud.store_direct_messages([(nostracct.id, dm) for dm in dms])
+    await crud.create_outbox_event(nostracct.id, sent)
+
+    export = b"".join(
+        [
+            chunk
+            async for chunk in services.export_nostracct_history(
+                nostracct, include_events=True
+            )
+        ]
+    )
+    lines: List[bytes] = export.splitlines(keepends=True)
+    assert json.loads(lines[0])["type"] == "header"
+    assert any(json.loads(line).get("event") for line in lines)
+
+    # start over with an empty account
+    await crud.delete_nostracct_direct_messages(nostracct.id)
+    await crud.delete_nostracct_outbox_events(nostracct.id)
+
+    broken = b"".join(lines[:12]) + b'{"type": "unknown"}\n'
+    with pytest.raises(ValueError):
+        await services.import_nostracct_history(
+            nostracct, as_chunks(broken), batch_size=5
+        )
+    assert 0 < await count(db, "direct_messages", nostracct.id) < len(dms)
+
+    for _ in range(2):
+        await services.import_nostracct_history(
+            nostracct, as_chunks(export), batch_size=5
+        )
+    assert await count(db, "direct_messages", nostracct.id) == len(dms)
+    assert await count(db, "outbox", nostracct.id) == 1
@@ -0,0 +1,66 @@
+import pytest
+from conftest import ext_module
+
+crud = ext_module("crud")
+models = ext_module("models")
+services = ext_module("services")
+
+
+async def insert_legacy_message(db, nostracct_id: str, dm_id: str, message: str):
+    # as stored before compression existed: no format and no size
+    await db.execute(
+        """
+        INSERT INTO nostrchat.direct_messages
+        (nostracct_id, id, event_id, event_created_at, message, public_key,
+        type, incoming)
+        VALUES (:nostracct_id, :id, :id, 1700000000, :message, :public_key, -1,
+        :incoming)
+        """,
+        {
+            "nostracct_id": nostracct_id,
+            "id": dm_id,
+            "message": message,
+            "public_key": "31" * 32,
+            "incoming": True,
+        },
+    )
+
+
+@pytest.mark.asyncio
+async def test_legacy_messages_are_only_scanned_once(db):
+    nostracct = await crud.create_nostracct(
+        "compress-user",
+        models.PartialNostrAcct(private_key="32" * 32, public_key="33" * 32),
+    )
+    await insert_legacy_message(db, nostracct.id, "legacy-long", "a" * 5000)
+    await insert_legacy_message(db, nostracct.id, "legacy-short", "hello")
+
+    assert await services.compress_stored_messages(pause=0) == 1
+    assert await crud.get_uncompressed_direct_messages() == []
+
+    long_dm = await crud.get_direct_message(nostracct.id, "legacy-long")
+    short_dm = await crud.get_direct_message(nostracct.id, "legacy-short")
+    assert long_dm and long_dm.message == "a" * 5000
+    assert short_dm and short_dm.message == "hello"
+
+
+@pytest.mark.asyncio
+async def test_search_index_storage_counts_the_plain_text_copies(db):
+    nostracct = await crud.create_nostracct(
+        "index-user",
+        models.PartialNostrAcct(private_key="34" * 32, public_key="35" * 32),
+    )
+    before = await crud.get_search_index_storage()
+    dm = models.PartialDirectMessage(
+        event_id="36" * 32,
+        event_created_at=1_700_000_000,
+        message="b" * 5000,
+        public_key="37" * 32,
+        incoming=True,
+    )
+    await crud.store_direct_messages([(nostracct.id, dm)])
+
+    after = await crud.get_search_index_storage()
+    assert after["messages"] == before["messages"] + 1
+    assert after["text_bytes"] == before["text_bytes"] + 5000
+    assert after["index_bytes"] > 0
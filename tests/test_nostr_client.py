@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from conftest import ext_module
+
+nostr_client = ext_module("nostr.nostr_client")
+NostrEvent = ext_module("nostr.event").NostrEvent
+services = ext_module("services")
+
+
+class FailingWebsocket:
+    def __init__(self, fail_after: int):
+        self.sent = []
+        self.fail_after = fail_after
+
+    async def send(self, data: str):
+        if len(self.sent) == self.fail_after:
+            raise ConnectionError("closed")
+        self.sent.append(data)
+
+
+@pytest.mark.asyncio
+async def test_unsent_requests_go_back_to_the_head_of_the_queue():
+    client = nostr_client.NostrClient()
+    client.ws = FailingWebsocket(fail_after=1)
+    reqs = [["REQ", f"sub-{n}", {}] for n in range(3)]
+    await client.send_req_queue.put(["CLOSE", "queued-later"])
+
+    with pytest.raises(ConnectionError):
+        await client._send_frames(reqs)
+
+    queued = [client.send_req_queue.get_nowait() for _ in range(3)]
+    assert queued == [reqs[1], reqs[2], ["CLOSE", "queued-later"]]
+
+
+def test_startup_time_is_exported(monkeypatch):
+    monkeypatch.setattr(services.nostr_client, "startup_time", 1.5)
+    assert "nostrchat_startup_seconds 1.5" in services.render_metrics()
+
+
+@pytest.mark.asyncio
+async def test_retry_does_not_queue_a_second_copy_of_an_unsent_event():
+    client = nostr_client.NostrClient()
+    event = NostrEvent(pubkey="41" * 32, created_at=1_700_000_000, kind=4)
+    event.id = event.event_id
+
+    first = await client.publish_nostr_event(event)
+    retry = await client.publish_nostr_event(event)
+
+    assert retry is first
+    assert client.send_req_queue.qsize() == 1
+    client.send_req_queue.get_nowait()
+    assert not client.send_req_queue.has_event(event.id)
+    # once the frame left the queue a retry queues it again
+    await client.publish_nostr_event(event)
+    assert client.send_req_queue.qsize() == 1
+
+
+class IdleWebsocket:
+    close_code = None
+    close_reason = ""
+
+    def __init__(self):
+        self.closed = asyncio.Event()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self.closed.wait()
+        raise StopAsyncIteration
+
+    async def close(self):
+        self.closed.set()
+
+
+def queued_close_sentinels(client) -> int:
+    items = [
+        client.recieve_event_queue.get_nowait()
+        for _ in range(99)
+        if not client.recieve_event_queue.empty()
+    ]
+    return sum(isinstance(item, ValueError) for item in items)
+
+
+@pytest.mark.asyncio
+async def test_restart_queues_a_single_resubscribe():
+    client = nostr_client.NostrClient()
+    client.ws = IdleWebsocket()
+    client._receive_task = asyncio.create_task(client._receive_frames(client.ws))
+    await asyncio.sleep(0)
+
+    await client.restart()
+    await asyncio.sleep(0)
+    assert queued_close_sentinels(client) == 1
+
+    # restarted while disconnected, the re-subscribe is still forced
+    await client.restart()
+    assert queued_close_sentinels(client) == 1
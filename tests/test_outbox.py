@@ -0,0 +1,63 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+import secp256k1
+from conftest import ext_module
+from fastapi.exceptions import HTTPException
+
+crud = ext_module("crud")
+models = ext_module("models")
+nostr_client = ext_module("nostr.nostr_client")
+services = ext_module("services")
+views_api = ext_module("views_api")
+
+
+def public_key(private_key: str) -> str:
+    return secp256k1.PrivateKey(bytes.fromhex(private_key)).pubkey.serialize()[1:].hex()
+
+
+async def make_nostracct(user_id: str, private_key: str):
+    return await crud.create_nostracct(
+        user_id,
+        models.PartialNostrAcct(
+            private_key=private_key, public_key=public_key(private_key)
+        ),
+    )
+
+
+@pytest.mark.asyncio
+async def test_message_is_not_stored_without_its_outbox_row(db, monkeypatch):
+    nostracct = await make_nostracct("outbox-user", "81" * 32)
+    peer = public_key("82" * 32)
+    wallet = SimpleNamespace(wallet=SimpleNamespace(user="outbox-user"))
+
+    async def broken(*args, **kwargs):
+        raise RuntimeError("connection lost")
+
+    monkeypatch.setattr(views_api, "create_outbox_event", broken)
+    with pytest.raises(HTTPException):
+        await views_api.api_create_message(
+            models.PartialDirectMessage(message="hello", public_key=peer), wallet
+        )
+    assert await crud.get_direct_messages(nostracct.id, peer) == []
+
+
+@pytest.mark.asyncio
+async def test_send_timeout_does_not_cancel_the_receipt(db, monkeypatch):
+    nostracct = await make_nostracct("timeout-user", "83" * 32)
+    event = nostracct.build_dm_event("hello", public_key("84" * 32))
+    await crud.create_outbox_event(nostracct.id, event)
+    client = nostr_client.NostrClient()
+    monkeypatch.setattr(services, "nostr_client", client)
+
+    sender = services.OutboxSender(send_timeout=0.01)
+    assert await sender.send_due_events() == 1
+
+    receipt = client._receipts[event.id]
+    assert not receipt.written.cancelled()
+    # the retry waits on the same receipt and the frame is queued only once
+    assert await client.publish_nostr_event(event) is receipt
+    assert client.send_req_queue.qsize() == 1
+    client._event_written(event.id)
+    assert await asyncio.wait_for(receipt.written, 1) is True
@@ -0,0 +1,57 @@
+import json
+from unittest.mock import AsyncMock
+
+import pytest
+from conftest import ext_module
+
+services = ext_module("services")
+RelayFrame = ext_module("nostr.receive_queue").RelayFrame
+
+
+@pytest.mark.asyncio
+async def test_relay_frames_are_parsed(monkeypatch):
+    handle_eose = AsyncMock()
+    handle_ok = AsyncMock()
+    monkeypatch.setattr(services.nostr_client, "handle_eose", handle_eose)
+    monkeypatch.setattr(services.nostr_client, "handle_ok", handle_ok)
+    eose_before = services.frames_received.values.get("EOSE", 0)
+
+    event_id = "ab" * 32
+    await services.process_nostr_messages(
+        [
+            RelayFrame.received(json.dumps(["EOSE", "sub-1"])),
+            RelayFrame.received(json.dumps(["OK", event_id, True, ""])),
+        ]
+    )
+
+    handle_eose.assert_awaited_once_with("sub-1")
+    handle_ok.assert_awaited_once_with(event_id, True, "")
+    assert services.frames_received.values["EOSE"] == eose_before + 1
+
+
+@pytest.mark.asyncio
+async def test_relay_event_frame_reaches_the_handlers(monkeypatch):
+    handle_event = AsyncMock()
+    update_profile = AsyncMock()
+    monkeypatch.setattr(services.nostr_client, "handle_event", handle_event)
+    monkeypatch.setattr(services, "_handle_peer_profile_update", update_profile)
+    monkeypatch.setattr(
+        services.signature_verifier, "verify", AsyncMock(side_effect=lambda e: e)
+    )
+
+    event = {
+        "id": "cd" * 32,
+        "pubkey": "ef" * 32,
+        "created_at": 1_700_000_000,
+        "kind": 0,
+        "tags": [],
+        "content": json.dumps({"name": "peer"}),
+        "sig": "00" * 64,
+    }
+    await services.process_nostr_messages(
+        [RelayFrame.received(json.dumps(["EVENT", "sub-1", event]))]
+    )
+
+    handle_event.assert_awaited_once_with("sub-1")
+    update_profile.assert_awaited_once()
+    assert update_profile.await_args.args[0].id == event["id"]
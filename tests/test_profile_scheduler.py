@@ -0,0 +1,42 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from conftest import ext_module
+
+profile_scheduler = ext_module("nostr.profile_scheduler")
+
+AUTHOR = "91" * 32
+
+
+class FakeClient:
+    def __init__(self):
+        self.subscriptions = []
+
+    async def subscribe(self, subscription_id, filters, one_shot, timeout):
+        future = asyncio.get_running_loop().create_future()
+        self.subscriptions.append(future)
+        return SimpleNamespace(backfill_complete=future)
+
+
+async def fetch(scheduler, client, eose: bool) -> int:
+    scheduler.request(AUTHOR)
+    await scheduler.flush()
+    client.subscriptions[-1].set_result(eose)
+    await asyncio.sleep(0)
+    return len(client.subscriptions)
+
+
+@pytest.mark.asyncio
+async def test_profiles_are_fetched_again_after_a_failed_request():
+    client = FakeClient()
+    scheduler = profile_scheduler.ProfileFetchScheduler(client)
+
+    # closed before EOSE, the authors are not marked as fetched
+    assert await fetch(scheduler, client, eose=False) == 1
+    assert AUTHOR not in scheduler._recent
+    assert await fetch(scheduler, client, eose=True) == 2
+    assert AUTHOR in scheduler._recent
+
+    scheduler.request(AUTHOR)
+    assert not scheduler._pending
@@ -0,0 +1,128 @@
+"""
+The hot CRUD queries must be served by an index: the plan of every statement
+they run may not contain a full table scan. Checked with `EXPLAIN QUERY PLAN`
+on SQLite and `EXPLAIN` on Postgres (see `NOSTRCHAT_TEST_DATABASE_URL`).
+"""
+
+import json
+from typing import Awaitable, Callable, List, Tuple
+
+import pytest
+from conftest import ext_module
+
+crud = ext_module("crud")
+
+NOSTRACCT_ID = "acct"
+PUBLIC_KEY = "ab" * 32
+
+
+async def record_queries(
+    db, monkeypatch, call: Callable[[], Awaitable]
+) -> List[Tuple[str, dict]]:
+    queries: List[Tuple[str, dict]] = []
+    for name in ("fetchall", "fetchone"):
+        original = getattr(db, name)
+
+        def recording(query, values=None, *args, _original=original, **kwargs):
+            queries.append((query, values or {}))
+            return _original(query, values, *args, **kwargs)
+
+        monkeypatch.setattr(db, name, recording)
+    await call()
+    monkeypatch.undo()
+    return queries
+
+
+async def full_scans(db, query: str, values: dict) -> List[str]:
+    if db.type != "SQLITE":
+        return await postgres_full_scans(db, query, values)
+    plan = await db.fetchall(f"EXPLAIN QUERY PLAN {query}", values)
+    # e.g. 'SCAN direct_messages', indexed steps read 'SEARCH ... USING INDEX'
+    # or 'SCAN ... USING (COVERING) INDEX'
+    return [
+        row["detail"]
+        for row in plan
+        if row["detail"].startswith("SCAN ") and " USING " not in row["detail"]
+    ]
+
+
+async def postgres_full_scans(db, query: str, values: dict) -> List[str]:
+    # the test tables are tiny, without this Postgres always scans them
+    async with db.connect() as conn:
+        await conn.execute("SET enable_seqscan = off")
+        rows = await conn.fetchall(f"EXPLAIN (FORMAT JSON) {query}", values)
+        await conn.execute("RESET enable_seqscan")
+    plan = rows[0]["QUERY PLAN"]
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    scans, nodes = [], [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if node["Node Type"] == "Seq Scan":
+            scans.append(f"Seq Scan on {node['Relation Name']}")
+        nodes += node.get("Plans", [])
+    return scans
+
+
+HOT_QUERIES = {
+    "get_nostracct": lambda: crud.get_nostracct("user", NOSTRACCT_ID),
+    "get_nostracct_by_pubkey": lambda: crud.get_nostracct_by_pubkey(PUBLIC_KEY),
+    "get_nostracct_for_user": lambda: crud.get_nostracct_for_user("user"),
+    "get_direct_message": lambda: crud.get_direct_message(NOSTRACCT_ID, "dm"),
+    "get_direct_message_by_event_id": lambda: crud.get_direct_message_by_event_id(
+        NOSTRACCT_ID, "cd" * 32
+    ),
+    "get_direct_messages": lambda: crud.get_direct_messages(
+        NOSTRACCT_ID, PUBLIC_KEY, limit=50
+    ),
+    "get_direct_messages before": lambda: crud.get_direct_messages(
+        NOSTRACCT_ID, PUBLIC_KEY, before="1700000000:dm", limit=50
+    ),
+    "get_direct_messages after": lambda: crud.get_direct_messages(
+        NOSTRACCT_ID, PUBLIC_KEY, after="1700000000:dm", limit=50
+    ),
+    "get_existing_event_ids": lambda: crud.get_existing_event_ids(["cd" * 32]),
+    "get_direct_messages_event_ids": lambda: crud.get_direct_messages_event_ids(),
+    "get_orders_from_direct_messages": lambda: crud.get_orders_from_direct_messages(
+        NOSTRACCT_ID
+    ),
+    "get_peer": lambda: crud.get_peer(NOSTRACCT_ID, PUBLIC_KEY),
+    "get_peers": lambda: crud.get_peers(NOSTRACCT_ID),
+    "get_peers_by_recency": lambda: crud.get_peers_by_recency(NOSTRACCT_ID),
+    "get_peers_by_recency before": lambda: crud.get_peers_by_recency(
+        NOSTRACCT_ID, before=f"1700000000:{PUBLIC_KEY}"
+    ),
+    "get_due_outbox_events": lambda: crud.get_due_outbox_events(),
+    "get_outbox_event": lambda: crud.get_outbox_event("cd" * 32),
+    "get_direct_messages_older_than": lambda: crud.get_direct_messages_older_than(
+        NOSTRACCT_ID, 1_700_000_000, 500
+    ),
+    "get_uncompressed_direct_messages": lambda: (
+        crud.get_uncompressed_direct_messages()
+    ),
+}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", HOT_QUERIES.keys())
+async def test_hot_query_uses_an_index(db, monkeypatch, name):
+    queries = await record_queries(db, monkeypatch, HOT_QUERIES[name])
+    assert queries, f"{name} ran no query"
+    for query, values in queries:
+        assert await full_scans(db, query, values) == [], query
+
+
+@pytest.mark.asyncio
+async def test_uncompressed_messages_use_the_partial_index(db, monkeypatch):
+    queries = await record_queries(
+        db, monkeypatch, lambda: crud.get_uncompressed_direct_messages()
+    )
+    for query, values in queries:
+        if db.type == "SQLITE":
+            plan = await db.fetchall(f"EXPLAIN QUERY PLAN {query}", values)
+            assert any("idx_direct_messages_unsized" in r["detail"] for r in plan)
+        else:
+            async with db.connect() as conn:
+                await conn.execute("SET enable_seqscan = off")
+                plan = await conn.fetchall(f"EXPLAIN {query}", values)
+                await conn.execute("RESET enable_seqscan")
+            assert any("idx_direct_messages_unsized" in r["QUERY PLAN"] for r in plan)
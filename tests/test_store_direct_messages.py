@@ -0,0 +1,64 @@
+import pytest
+from conftest import ext_module
+
+crud = ext_module("crud")
+models = ext_module("models")
+
+PEER = "72" * 32
+
+
+def make_dm(i: int):
+    return models.PartialDirectMessage(
+        event_id=f"{0x7000 + i:064x}",
+        event_created_at=1_700_000_000 + i,
+        message=f"message {i}",
+        public_key=PEER,
+        incoming=True,
+    )
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_rolled_back_and_stored_again(db, monkeypatch):
+    nostracct = await crud.create_nostracct(
+        "store-user",
+        models.PartialNostrAcct(private_key="73" * 32, public_key="74" * 32),
+    )
+    batch = [(nostracct.id, make_dm(i)) for i in range(3)]
+
+    async def broken(*args, **kwargs):
+        raise RuntimeError("connection lost")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(crud, "update_peers_last_message", broken)
+        with pytest.raises(RuntimeError):
+            await crud.store_direct_messages(batch)
+    assert await crud.get_direct_messages(nostracct.id, PEER) == []
+    assert await crud.get_peer(nostracct.id, PEER) is None
+
+    created, new_peers = await crud.store_direct_messages(batch)
+    assert len(created) == 3
+    assert new_peers == [(nostracct.id, PEER)]
+    peer = await crud.get_peer(nostracct.id, PEER)
+    assert peer and peer.unread_messages == 3
+    hits = await crud.search_direct_messages(nostracct.id, "message")
+    assert len(hits) == 3
+
+
+@pytest.mark.asyncio
+async def test_rows_skipped_on_conflict_are_not_indexed(db):
+    nostracct = await crud.create_nostracct(
+        "index-user",
+        models.PartialNostrAcct(private_key="75" * 32, public_key="76" * 32),
+    )
+    stored = models.DirectMessage(**make_dm(10).dict(exclude={"time"}), id="stored")
+    duplicate = models.DirectMessage(
+        **make_dm(10).dict(exclude={"time"}), id="duplicate"
+    )
+    await crud.insert_direct_messages([(nostracct.id, stored)])
+    await crud.insert_direct_messages([(nostracct.id, duplicate)])
+
+    rows = await db.fetchall(
+        "SELECT id FROM nostrchat.dm_search WHERE nostracct_id = :nostracct_id",
+        {"nostracct_id": nostracct.id},
+    )
+    assert [row["id"] for row in rows] == ["stored"]
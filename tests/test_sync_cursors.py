@@ -0,0 +1,76 @@
+import json
+import time
+
+import pytest
+from conftest import ext_module
+
+crud = ext_module("crud")
+models = ext_module("models")
+services = ext_module("services")
+RelayFrame = ext_module("nostr.receive_queue").RelayFrame
+Subscription = ext_module("nostr.subscriptions").Subscription
+
+
+@pytest.mark.asyncio
+async def test_sync_cursors_only_move_forward(db):
+    nostracct_id = "cursor-acct"
+    await crud.update_sync_cursors({(nostracct_id, 4): 1_700_000_100})
+    await crud.update_sync_cursors(
+        {(nostracct_id, 4): 1_700_000_050, (nostracct_id, 0): 1_700_000_010}
+    )
+    assert (await crud.get_sync_cursors())[nostracct_id] == {
+        4: 1_700_000_100,
+        0: 1_700_000_010,
+    }
+
+    await crud.update_sync_cursors({(nostracct_id, 4): 1_700_000_200})
+    assert (await crud.get_sync_cursors())[nostracct_id][4] == 1_700_000_200
+
+
+def make_dm(i: int, created_at: int):
+    return models.PartialDirectMessage(
+        event_id=f"{i:064x}",
+        event_created_at=created_at,
+        message=f"message {i}",
+        public_key="52" * 32,
+        incoming=True,
+    )
+
+
+@pytest.mark.asyncio
+async def test_cursor_is_saved_after_the_backfill_and_never_in_the_future(db):
+    nostracct = await crud.create_nostracct(
+        "cursor-user",
+        models.PartialNostrAcct(private_key="53" * 32, public_key="54" * 32),
+    )
+    client = services.nostr_client
+
+    def subscribe():
+        client.subscriptions.add(
+            Subscription(
+                id="cursor-sub", filters=[], public_keys=[nostracct.public_key]
+            )
+        )
+
+    subscribe()
+
+    # backfills come newest first, one sender dated its message in the future
+    now = int(time.time())
+    for i, created_at in enumerate([now + 86_400, now - 100, now - 200]):
+        await services.dm_writer.add(nostracct, make_dm(500 + i, created_at))
+    await services.dm_writer.flush()
+    assert nostracct.id not in await crud.get_sync_cursors()
+
+    # a closed subscription did not complete its backfill
+    await services.process_nostr_messages(
+        [RelayFrame.received(json.dumps(["CLOSED", "cursor-sub", "error"]))]
+    )
+    assert nostracct.id not in await crud.get_sync_cursors()
+
+    subscribe()
+    await services.process_nostr_messages(
+        [RelayFrame.received(json.dumps(["EOSE", "cursor-sub"]))]
+    )
+    since = (await crud.get_sync_cursors())[nostracct.id][4]
+    assert now <= since <= int(time.time())
+    client.subscriptions.on_closed("cursor-sub", "test done")
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+import secp256k1
+from conftest import ext_module
+
+NostrEvent = ext_module("nostr.event").NostrEvent
+verifier = ext_module("nostr.verifier")
+
+
+def signed_profile(name: str) -> NostrEvent:
+    private_key = secp256k1.PrivateKey(bytes.fromhex("61" * 32))
+    event = NostrEvent(
+        pubkey=private_key.pubkey.serialize()[1:].hex(),
+        created_at=1_700_000_000,
+        kind=0,
+        content=json.dumps({"name": name}),
+    )
+    event.id = event.event_id
+    event.sig = private_key.schnorr_sign(bytes.fromhex(event.id), None, raw=True).hex()
+    return event
+
+
+def copy(event: NostrEvent, **changes) -> NostrEvent:
+    return NostrEvent.from_dict({**event.dict(), **changes})
+
+
+@pytest.mark.asyncio
+async def test_cached_id_does_not_let_a_forged_event_through():
+    signature_verifier = verifier.SignatureVerifier()
+    genuine = signed_profile("alice")
+    assert await signature_verifier.verify([genuine]) == [genuine]
+
+    other_content = copy(genuine, content=json.dumps({"name": "mallory"}))
+    other_sig = copy(genuine, sig="00" * 64)
+    other_pubkey = copy(genuine, pubkey="62" * 32)
+    forged = [other_content, other_sig, other_pubkey]
+    assert await signature_verifier.verify(forged) == []
+
+    replay = copy(genuine)
+    assert await signature_verifier.verify([replay, other_sig]) == [replay]
+    assert signature_verifier.cache_hits == 1
@@ -2,11 +2,14 @@ import json
 from http import HTTPStatus
 from typing import List, Optional
 
-from fastapi import Depends
+from fastapi import Depends, Query, Request
 from fastapi.exceptions import HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from lnbits.core.services import websocket_updater
+from lnbits.core.models import User
 from lnbits.decorators import (
     WalletTypeInfo,
+    check_admin,
     require_admin_key,
     require_invoice_key,
 )
@@ -19,29 +22,49 @@ from .crud import (
     create_peer,
     create_direct_message,
     create_nostracct,
+    create_outbox_event,
     delete_nostracct,
     delete_nostracct_direct_messages,
+    delete_nostracct_outbox_events,
     get_peer,
     get_peers,
+    get_peers_by_recency,
+    get_archived_conversations,
     get_direct_messages,
-    get_last_direct_messages_time,
+    get_message_storage_report,
+    get_search_index_storage,
     get_nostracct_by_pubkey,
+    get_outbox_event,
+    restore_archived_conversation,
+    search_direct_messages,
     get_nostracct_for_user,
     touch_nostracct,
+    transaction,
     update_peer_no_unread_messages,
     update_nostracct,
 )
 from .helpers import normalize_public_key
 from .models import (
+    ArchivedConversation,
     Peer,
+    DeliveryStatus,
     DirectMessage,
+    DirectMessageSearchHit,
     NostrAcct,
     PartialDirectMessage,
     PartialNostrAcct,
+    RetentionPolicy,
 )
+from .nostr.verifier import VerificationMode
 from .services import (
-    resubscribe_to_all_nostraccts,
-    subscribe_to_all_nostraccts,
+    export_nostracct_history,
+    import_nostracct_history,
+    outbox_sender,
+    render_metrics,
+    signature_verifier,
+    stage_timings,
+    subscribe_to_nostracct,
+    unsubscribe_from_nostracct,
     update_nostracct_to_nostr,
 )
 
@@ -63,7 +86,7 @@ async def api_create_nostracct(
 
         nostracct = await create_nostracct(wallet.wallet.user, data)
 
-        await resubscribe_to_all_nostraccts()
+        await subscribe_to_nostracct(nostracct.public_key)
 
         await nostr_client.nostracct_temp_subscription(data.public_key)
 
@@ -93,9 +116,9 @@ async def api_get_nostracct(
 
         nostracct = await touch_nostracct(wallet.wallet.user, nostracct.id)
         assert nostracct
-        last_dm_time = await get_last_direct_messages_time(nostracct.id)
-        assert nostracct.time
-        nostracct.config.restore_in_progress = (nostracct.time - last_dm_time) < 30
+        nostracct.config.restore_in_progress = nostr_client.is_backfilling(
+            nostracct.public_key
+        )
 
         return nostracct
     except Exception as ex:
@@ -117,11 +140,12 @@ async def api_delete_nostracct(
         assert nostracct, "NostrAcct cannot be found"
         assert nostracct.id == nostracct_id, "Wrong nostracct ID"
 
-        await nostr_client.unsubscribe_nostraccts()
-
         await delete_nostracct_direct_messages(nostracct.id)
+        await delete_nostracct_outbox_events(nostracct.id)
         await delete_nostracct(nostracct.id)
 
+        await unsubscribe_from_nostracct(nostracct.public_key)
+
     except AssertionError as ex:
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST,
@@ -133,8 +157,6 @@ async def api_delete_nostracct(
             status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
             detail="Cannot get nostracct",
         ) from ex
-    finally:
-        await subscribe_to_all_nostraccts()
 
 
 @nostrchat_ext.put("/api/v1/nostracct/{nostracct_id}/nostr")
@@ -215,6 +237,40 @@ async def api_toggle_nostracct(
         ) from ex
 
 
+@nostrchat_ext.put("/api/v1/nostracct/{nostracct_id}/retention")
+async def api_set_nostracct_retention(
+    nostracct_id: str,
+    data: RetentionPolicy,
+    wallet: WalletTypeInfo = Depends(require_admin_key),
+) -> NostrAcct:
+    try:
+        nostracct = await get_nostracct_for_user(wallet.wallet.user)
+        assert nostracct, "NostrAcct cannot be found"
+        assert nostracct.id == nostracct_id, "Wrong nostracct ID"
+        assert data.days is None or data.days >= 1, "Keep messages at least one day"
+        assert (
+            data.messages_per_peer is None or data.messages_per_peer >= 1
+        ), "Keep at least one message per peer"
+
+        nostracct.config.retention = data
+        updated = await update_nostracct(
+            wallet.wallet.user, nostracct.id, nostracct.config
+        )
+        assert updated, "NostrAcct cannot be updated"
+        return updated
+    except AssertionError as ex:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=str(ex),
+        ) from ex
+    except Exception as ex:
+        logger.warning(ex)
+        raise HTTPException(
+            status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
+            detail="Cannot update the retention policy",
+        ) from ex
+
+
 @nostrchat_ext.delete("/api/v1/nostracct/{nostracct_id}/nostr")
 async def api_delete_nostracct_on_nostr(
     nostracct_id: str,
@@ -246,16 +302,23 @@ async def api_delete_nostracct_on_nostr(
 
 @nostrchat_ext.get("/api/v1/message/{public_key}")
 async def api_get_messages(
-    public_key: str, wallet: WalletTypeInfo = Depends(require_invoice_key)
+    public_key: str,
+    before: Optional[str] = Query(None),
+    after: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    wallet: WalletTypeInfo = Depends(require_invoice_key),
 ) -> List[DirectMessage]:
     try:
         nostracct = await get_nostracct_for_user(wallet.wallet.user)
         assert nostracct, "NostrAcct cannot be found"
 
-        messages = await get_direct_messages(nostracct.id, public_key)
-        await update_peer_no_unread_messages(nostracct.id, public_key)
+        messages = await get_direct_messages(
+            nostracct.id, public_key, before=before, after=after, limit=limit
+        )
+        if not before:
+            await update_peer_no_unread_messages(nostracct.id, public_key)
         return messages
-    except AssertionError as ex:
+    except (ValueError, AssertionError) as ex:
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST,
             detail=str(ex),
@@ -280,8 +343,14 @@ async def api_create_message(
         data.event_id = dm_event.id
         data.event_created_at = dm_event.created_at
 
-        dm = await create_direct_message(nostracct.id, data)
-        await nostr_client.publish_nostr_event(dm_event)
+        # the PENDING message and its outbox row are stored together, so a
+        # failure cannot leave a message that is never sent
+        async with transaction() as conn:
+            dm = await create_direct_message(
+                nostracct.id, data, DeliveryStatus.PENDING, conn
+            )
+            await create_outbox_event(nostracct.id, dm_event, conn)
+        outbox_sender.notify()
 
         return dm
     except AssertionError as ex:
@@ -297,6 +366,66 @@ async def api_create_message(
         ) from ex
 
 
+@nostrchat_ext.get("/api/v1/search")
+async def api_search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    public_key: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10_000),
+    wallet: WalletTypeInfo = Depends(require_invoice_key),
+) -> List[DirectMessageSearchHit]:
+    try:
+        nostracct = await get_nostracct_for_user(wallet.wallet.user)
+        assert nostracct, "NostrAcct cannot be found"
+
+        return await search_direct_messages(
+            nostracct.id, q, public_key=public_key, limit=limit, offset=offset
+        )
+    except (ValueError, AssertionError) as ex:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=str(ex),
+        ) from ex
+    except Exception as ex:
+        logger.warning(ex)
+        raise HTTPException(
+            status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
+            detail="Cannot search messages",
+        ) from ex
+
+
+@nostrchat_ext.get("/api/v1/message/status/{event_id}")
+async def api_get_message_status(
+    event_id: str,
+    wallet: WalletTypeInfo = Depends(require_invoice_key),
+) -> dict:
+    try:
+        nostracct = await get_nostracct_for_user(wallet.wallet.user)
+        assert nostracct, "NostrAcct cannot be found"
+
+        outbox_event = await get_outbox_event(event_id)
+        assert (
+            outbox_event and outbox_event.nostracct_id == nostracct.id
+        ), "Message cannot be found"
+        return {
+            "event_id": outbox_event.id,
+            "status": outbox_event.status,
+            "attempts": outbox_event.attempts,
+            "last_error": outbox_event.last_error,
+        }
+    except AssertionError as ex:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=str(ex),
+        ) from ex
+    except Exception as ex:
+        logger.warning(ex)
+        raise HTTPException(
+            status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
+            detail="Cannot get message status",
+        ) from ex
+
+
 ######################################## PEERS #####################################
 
 
@@ -322,6 +451,30 @@ async def api_get_peers(
         ) from ex
 
 
+@nostrchat_ext.get("/api/v1/peer/summary")
+async def api_get_peers_summary(
+    before: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+    wallet: WalletTypeInfo = Depends(require_invoice_key),
+) -> List[Peer]:
+    try:
+        nostracct = await get_nostracct_for_user(wallet.wallet.user)
+        assert nostracct, "NostrAcct cannot be found"
+        return await get_peers_by_recency(nostracct.id, before=before, limit=limit)
+
+    except (ValueError, AssertionError) as ex:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=str(ex),
+        ) from ex
+    except Exception as ex:
+        logger.warning(ex)
+        raise HTTPException(
+            status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
+            detail="Cannot get peers",
+        ) from ex
+
+
 @nostrchat_ext.post("/api/v1/peer")
 async def api_create_peer(
     data: Peer,
@@ -358,6 +511,107 @@ async def api_create_peer(
         ) from ex
 
 
+######################################## ARCHIVE ######################################
+
+
+@nostrchat_ext.get("/api/v1/archive")
+async def api_get_archived_conversations(
+    wallet: WalletTypeInfo = Depends(require_invoice_key),
+) -> List[ArchivedConversation]:
+    try:
+        nostracct = await get_nostracct_for_user(wallet.wallet.user)
+        assert nostracct, "NostrAcct cannot be found"
+
+        return await get_archived_conversations(nostracct.id)
+    except AssertionError as ex:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=str(ex),
+        ) from ex
+    except Exception as ex:
+        logger.warning(ex)
+        raise HTTPException(
+            status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
+            detail="Cannot get archived conversations",
+        ) from ex
+
+
+@nostrchat_ext.post("/api/v1/archive/{public_key}/restore")
+async def api_restore_archived_conversation(
+    public_key: str,
+    hold_days: int = Query(30, ge=0, le=3650),
+    wallet: WalletTypeInfo = Depends(require_admin_key),
+) -> dict:
+    """
+    Move an archived conversation back. The retention job leaves it alone for
+    `hold_days`, otherwise it would archive it again on its next run.
+    """
+    try:
+        nostracct = await get_nostracct_for_user(wallet.wallet.user)
+        assert nostracct, "NostrAcct cannot be found"
+
+        restored = await restore_archived_conversation(
+            nostracct.id, public_key, hold_days * 86_400
+        )
+        return {"restored": restored}
+    except AssertionError as ex:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=str(ex),
+        ) from ex
+    except Exception as ex:
+        logger.warning(ex)
+        raise HTTPException(
+            status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
+            detail="Cannot restore the conversation",
+        ) from ex
+
+
+######################################## EXPORT #######################################
+
+
+@nostrchat_ext.get("/api/v1/export")
+async def api_export_history(
+    include_events: bool = Query(False),
+    wallet: WalletTypeInfo = Depends(require_admin_key),
+) -> StreamingResponse:
+    nostracct = await get_nostracct_for_user(wallet.wallet.user)
+    if not nostracct:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail="NostrAcct cannot be found",
+        )
+    filename = f"nostrchat-{nostracct.public_key[:16]}.ndjson"
+    return StreamingResponse(
+        export_nostracct_history(nostracct, include_events),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@nostrchat_ext.post("/api/v1/import")
+async def api_import_history(
+    request: Request,
+    wallet: WalletTypeInfo = Depends(require_admin_key),
+) -> dict:
+    try:
+        nostracct = await get_nostracct_for_user(wallet.wallet.user)
+        assert nostracct, "NostrAcct cannot be found"
+
+        return await import_nostracct_history(nostracct, request.stream())
+    except (ValueError, AssertionError) as ex:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=str(ex),
+        ) from ex
+    except Exception as ex:
+        logger.warning(ex)
+        raise HTTPException(
+            status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
+            detail="Cannot import history",
+        ) from ex
+
+
 ######################################## OTHER ########################################
 
 
@@ -367,6 +621,43 @@ async def api_create_peer(
 #     return list(currencies.keys())
 
 
+@nostrchat_ext.get("/api/v1/subscriptions")
+async def api_get_subscriptions(_: User = Depends(check_admin)) -> List[dict]:
+    return [s.dict() for s in nostr_client.subscriptions.live()]
+
+
+@nostrchat_ext.get("/api/v1/verification")
+async def api_get_verification(_: User = Depends(check_admin)) -> dict:
+    return {
+        "verifier": signature_verifier.stats(),
+        "stages": stage_timings.stats(),
+    }
+
+
+@nostrchat_ext.put("/api/v1/verification")
+async def api_set_verification_mode(
+    mode: VerificationMode, _: User = Depends(check_admin)
+) -> dict:
+    signature_verifier.mode = mode
+    return signature_verifier.stats()
+
+
+@nostrchat_ext.get("/api/v1/metrics", response_class=PlainTextResponse)
+async def api_get_metrics(_: User = Depends(check_admin)) -> str:
+    return render_metrics()
+
+
+@nostrchat_ext.get("/api/v1/storage")
+async def api_get_message_storage(_: User = Depends(check_admin)) -> dict:
+    formats = await get_message_storage_report()
+    return {
+        "formats": formats,
+        "bytes_saved": sum(f["bytes_saved"] for f in formats),
+        # the search index stores every message as plain text, compressed or not
+        "search_index": await get_search_index_storage(),
+    }
+
+
 @nostrchat_ext.put("/api/v1/restart")
 async def restart_nostr_client(wallet: WalletTypeInfo = Depends(require_admin_key)):
     try: